@@ -0,0 +1,72 @@
+"""
+Decodificación JSON con el backend más rápido disponible.
+
+Usa orjson si está instalado y si no la librería estándar (json); ambos aceptan bytes o str y sus
+errores son json.JSONDecodeError, así que los bloques try/except existentes no cambian.
+Lo usan foresight_api (respuestas de la API) y las páginas (configuración de flotas y perímetros).
+
+Ejecutar este archivo compara la velocidad de ambos backends sobre respuestas grabadas
+(archivos .json pasados como argumento) o, si no se pasan, sobre los archivos de configuración
+y perímetros del repositorio y una respuesta sintética del tamaño de una flota grande:
+
+    python decodificador_json.py [respuesta_grabada.json ...]
+"""
+import glob
+import json
+import sys
+import time
+from typing import Any
+
+try:
+    import orjson
+    BACKEND_JSON = "orjson"
+    loads = orjson.loads
+except ImportError:  # orjson es opcional
+    orjson = None
+    BACKEND_JSON = "json"
+    loads = json.loads
+
+
+def cargar_json(archivo) -> Any:
+    """Equivalente a json.load(archivo) con el backend rápido."""
+    return loads(archivo.read())
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def _respuesta_sintetica(filas: int) -> bytes:
+    """Respuesta con la forma de REPORT_EXECUTE (DATA1) / usersearchplatform (DATA)."""
+    fila = {
+        "Unit": "7001-ABC12D", "Report Time": "2025-10-01T08:15:30.000", "Speed_dUnit": "72",
+        "Latitude": "10.4806", "Longitude": "-66.9036", "Location": "Av. Principal, Caracas, Distrito Capital",
+        "ignition": "true", "heading": "180", "LastReportTime": "01/10/2025 08:15:30 AM",
+    }
+    return json.dumps({"ForesightFlexAPI": {"DATA1": [fila] * filas}}).encode("utf-8")
+
+
+def _medir(funcion, contenido: bytes, repeticiones: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion(contenido)
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+if __name__ == "__main__":
+    rutas = sys.argv[1:] or sorted(glob.glob("configuracion_flotas/*.json") + glob.glob("perimetros/*.json"))
+    cargas = [(ruta, open(ruta, "rb").read()) for ruta in rutas]
+    if len(sys.argv) == 1:
+        cargas.append(("(sintética) 5.000 filas DATA1", _respuesta_sintetica(5_000)))
+        cargas.append(("(sintética) 50.000 filas DATA1", _respuesta_sintetica(50_000)))
+
+    print(f"Backend activo: {BACKEND_JSON}")
+    for nombre, contenido in cargas:
+        repeticiones = max(1, min(200, 20_000_000 // max(len(contenido), 1)))
+        t_json = _medir(json.loads, contenido, repeticiones)
+        linea = f"{nombre}: {len(contenido) / 1e6:.2f} MB | json {len(contenido) / t_json / 1e6:.0f} MB/s"
+        if orjson is not None:
+            assert orjson.loads(contenido) == json.loads(contenido)
+            t_orjson = _medir(orjson.loads, contenido, repeticiones)
+            linea += f" | orjson {len(contenido) / t_orjson / 1e6:.0f} MB/s | x{t_json / t_orjson:.1f}"
+        print(linea)
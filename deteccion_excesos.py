@@ -0,0 +1,156 @@
+"""
+Detección de excesos de velocidad 'Pico' y 'Sostenido' con NumPy (sin pandas groupby ni numba).
+
+Un registro es 'Sostenido' si el registro anterior o el siguiente de la MISMA unidad está a
+THRESHOLD_SECONDS segundos o menos; si no, es 'Pico'. Los registros 'Sostenido' consecutivos de
+una unidad forman un solo evento; cada 'Pico' es un evento de un registro.
+
+Lo usa pages/reporte_excesos.py. La paridad con la implementación original de la página se verifica
+en tests/test_deteccion_excesos.py; ejecutar este archivo solo mide el kernel contra una cadena
+equivalente con pandas:
+
+    python deteccion_excesos.py [filas]
+"""
+import sys
+import time
+from typing import Dict
+
+import numpy as np
+
+# Marca de tiempo inválida (NaT en int64): nunca se considera vecina de otro registro
+NAT_INT64 = np.iinfo(np.int64).min
+
+
+def detectar_runs_excesos(codigos_unidad: np.ndarray, tiempos_ns: np.ndarray, velocidades: np.ndarray,
+                          umbral_segundos: float) -> Dict[str, np.ndarray]:
+    """
+    Kernel de detección en una sola pasada sobre arreglos ya ordenados por (unidad, tiempo).
+
+    - codigos_unidad: int, código de la unidad de cada registro.
+    - tiempos_ns: int64, epoch en nanosegundos (NAT_INT64 para fechas inválidas).
+    - velocidades: float, velocidad de cada registro.
+
+    Retorna arreglos alineados por evento (en orden de registros):
+    inicio, fin (índices del primer y último registro; el primero sirve para la ubicación de inicio),
+    sostenido (bool), registros, velocidad_max, velocidad_min, velocidad_promedio y duracion_segundos.
+    """
+    codigos_unidad = np.asarray(codigos_unidad)
+    tiempos_ns = np.asarray(tiempos_ns, dtype=np.int64)
+    velocidades = np.asarray(velocidades, dtype=np.float64)
+    n = len(tiempos_ns)
+
+    if n == 0:
+        vacio_i = np.empty(0, dtype=np.int64)
+        vacio_f = np.empty(0, dtype=np.float64)
+        return {"inicio": vacio_i, "fin": vacio_i, "sostenido": np.empty(0, dtype=bool), "registros": vacio_i,
+                "velocidad_max": vacio_f, "velocidad_min": vacio_f, "velocidad_promedio": vacio_f,
+                "duracion_segundos": vacio_f}
+
+    umbral_ns = np.int64(umbral_segundos * 1_000_000_000)
+    valido = tiempos_ns != NAT_INT64
+
+    # Vecino cercano: misma unidad, ambos tiempos válidos y separación <= umbral
+    cerca_anterior = np.zeros(n, dtype=bool)
+    cerca_anterior[1:] = (
+        (codigos_unidad[1:] == codigos_unidad[:-1]) & valido[1:] & valido[:-1] &
+        (tiempos_ns[1:] - tiempos_ns[:-1] <= umbral_ns)
+    )
+    cerca_siguiente = np.zeros(n, dtype=bool)
+    cerca_siguiente[:-1] = cerca_anterior[1:]
+    sostenido = cerca_anterior | cerca_siguiente
+
+    # Un evento empieza en cada Pico y en cada Sostenido cuyo anterior (de la misma unidad) no lo es
+    misma_unidad_anterior = np.zeros(n, dtype=bool)
+    misma_unidad_anterior[1:] = codigos_unidad[1:] == codigos_unidad[:-1]
+    sostenido_anterior = np.zeros(n, dtype=bool)
+    sostenido_anterior[1:] = sostenido[:-1]
+    inicia_evento = ~sostenido | ~(sostenido_anterior & misma_unidad_anterior)
+
+    inicio = np.flatnonzero(inicia_evento)
+    fin = np.empty_like(inicio)
+    fin[:-1] = inicio[1:] - 1
+    fin[-1] = n - 1
+    registros = fin - inicio + 1
+
+    suma = np.add.reduceat(velocidades, inicio)
+    # Dentro de un evento sostenido todos los tiempos son válidos y están ordenados: duración = fin - inicio
+    duracion = np.where(sostenido[inicio], (tiempos_ns[fin] - tiempos_ns[inicio]) / 1e9, 0.0)
+
+    return {
+        "inicio": inicio,
+        "fin": fin,
+        "sostenido": sostenido[inicio],
+        "registros": registros,
+        "velocidad_max": np.maximum.reduceat(velocidades, inicio),
+        "velocidad_min": np.minimum.reduceat(velocidades, inicio),
+        "velocidad_promedio": suma / registros,
+        "duracion_segundos": duracion,
+    }
+
+
+def tiempos_a_ns(serie_tiempos) -> np.ndarray:
+    """Serie datetime de pandas (con o sin zona horaria) -> int64 en ns; NaT queda como NAT_INT64."""
+    return serie_tiempos.dt.as_unit('ns').astype('int64').to_numpy()
+
+
+# ----------------------------------------------------------------------
+# Benchmark contra la cadena groupby/diff/shift/cumsum con pandas (corregida por unidad)
+# ----------------------------------------------------------------------
+
+def _referencia_pandas(df, umbral_segundos):
+    """Clasificación y agregación con pandas, usada solo para medir."""
+    grupos = df.groupby('UNIDAD', sort=False)
+    prev = grupos['Full_Time'].diff().dt.total_seconds()
+    sig = grupos['Full_Time'].diff(-1).dt.total_seconds().abs()
+    sost = (prev.fillna(umbral_segundos + 1) <= umbral_segundos) | (sig.fillna(umbral_segundos + 1) <= umbral_segundos)
+    sost_prev = sost.groupby(df['UNIDAD'], sort=False).shift(1, fill_value=False)
+    grupo = (sost & ~sost_prev).groupby(df['UNIDAD'], sort=False).cumsum().where(sost, 0)
+
+    agregado = df[grupo > 0].groupby(['UNIDAD', grupo[grupo > 0].rename('G')]).agg(
+        inicio=('Full_Time', 'min'), fin=('Full_Time', 'max'), registros=('UNIDAD', 'count'),
+        vmax=('VELOCIDAD', 'max'), vmin=('VELOCIDAD', 'min'), vprom=('VELOCIDAD', 'mean'),
+    ).reset_index()
+    pico = df[~sost]
+    return (
+        agregado['UNIDAD'].to_numpy(),
+        ((agregado['fin'] - agregado['inicio']).dt.total_seconds()).to_numpy(),
+        agregado['registros'].to_numpy(), agregado['vmax'].to_numpy(),
+        agregado['vmin'].to_numpy(), agregado['vprom'].to_numpy(),
+        pico['VELOCIDAD'].to_numpy(),
+    )
+
+
+def _datos_sinteticos(filas: int, unidades: int = 400, semilla: int = 0):
+    import pandas as pd
+
+    rng = np.random.default_rng(semilla)
+    codigos = np.sort(rng.integers(0, unidades, filas))
+    pasos = rng.choice([15, 30, 45, 60, 61, 90, 600], filas)
+    tiempos = pd.Timestamp('2025-10-01', tz='UTC') + pd.to_timedelta(np.cumsum(pasos), unit='s')
+    return pd.DataFrame({
+        'UNIDAD': np.char.add('U', codigos.astype(str)),
+        'Full_Time': tiempos,
+        'VELOCIDAD': rng.integers(71, 130, filas).astype(np.float64),
+    }).sort_values(['UNIDAD', 'Full_Time'], kind='stable').reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    umbral = 60
+    df = _datos_sinteticos(filas)
+
+    t0 = time.perf_counter()
+    ref = _referencia_pandas(df, umbral)
+    t_pandas = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    codigos = pd.factorize(df['UNIDAD'])[0]
+    tiempos = tiempos_a_ns(df['Full_Time'])
+    runs = detectar_runs_excesos(codigos, tiempos, df['VELOCIDAD'].to_numpy(), umbral)
+    t_numpy = time.perf_counter() - t0
+
+    s = runs['sostenido']
+    print(f"{filas:,} filas | {int(s.sum()):,} sostenidos | {int((~s).sum()):,} picos")
+    print(f"pandas: {t_pandas:.3f} s | numpy: {t_numpy:.3f} s | x{t_pandas / t_numpy:.1f}")
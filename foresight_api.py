@@ -0,0 +1,228 @@
+"""
+Cliente compartido de la API Foresight Flex (dashboard y reportes).
+
+Todas las páginas usan una misma requests.Session por encabezado de autenticación: conexiones
+keep-alive reutilizadas (sin negociar TCP/TLS en cada llamada), gzip, timeouts uniformes,
+reintentos con espera ante errores transitorios y un circuito que deja de llamar a la API
+durante unos segundos tras varias fallas seguidas.
+
+Los errores se propagan como requests.exceptions.RequestException, igual que con requests.post,
+para que los bloques try/except existentes sigan funcionando.
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from decodificador_json import loads
+
+API_URL = "https://flexapi.foresightgps.com/ForesightFlexAPI.ashx"
+CONNCODE = "SATEQSA"
+
+# Cuenta usada por los reportes (REPORT_EXECUTE) y por la búsqueda de unidades del dashboard
+USER_ID_REPORTES = "82825"
+COMPANY_ID = "5809"
+USER_ID_PLATAFORMA = "86946"
+
+# (conexión, lectura) en segundos
+TIMEOUT_CONEXION = 5
+TIMEOUT_LECTURA_DEFECTO = 60
+
+# Reintentos: solo errores de conexión y respuestas 429/5xx transitorias
+REINTENTOS = 2
+ESPERA_REINTENTO = 0.5
+ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+TAMANO_POOL = 16
+
+# Circuito: tras FALLAS_PARA_ABRIR fallas seguidas no se llama a la API durante SEGUNDOS_CIRCUITO_ABIERTO
+FALLAS_PARA_ABRIR = 5
+SEGUNDOS_CIRCUITO_ABIERTO = 30
+
+# Búsqueda de unidades: los conjuntos grandes de IDs se piden en páginas concurrentes de este tamaño
+TAMANO_PAGINA_UNIDADES = 50
+MAX_PAGINAS_EN_PARALELO = 8
+
+_sesiones: Dict[str, requests.Session] = {}
+_lock_sesiones = threading.Lock()
+_circuito = {"fallas": 0, "abierto_hasta": 0.0}
+_lock_circuito = threading.Lock()
+
+
+class CircuitoAbiertoError(requests.exceptions.RequestException):
+    """La API falló varias veces seguidas; se evita llamarla hasta que venza la pausa."""
+
+
+class RespuestaNoJSONError(requests.exceptions.RequestException):
+    """La API respondió sin cuerpo JSON (p. ej. una página de mantenimiento)."""
+
+
+def obtener_sesion(autorizacion: str) -> requests.Session:
+    """Sesión compartida (un pool de conexiones) para un encabezado de autenticación."""
+    with _lock_sesiones:
+        sesion = _sesiones.get(autorizacion)
+        if sesion is None:
+            reintentos = Retry(
+                total=REINTENTOS,
+                backoff_factor=ESPERA_REINTENTO,
+                status_forcelist=ESTADOS_REINTENTABLES,
+                # Las llamadas son consultas (POST sin efectos), se pueden repetir
+                allowed_methods=frozenset(["POST"]),
+                raise_on_status=False,
+            )
+            adaptador = HTTPAdapter(pool_connections=TAMANO_POOL, pool_maxsize=TAMANO_POOL, max_retries=reintentos)
+            sesion = requests.Session()
+            sesion.mount("https://", adaptador)
+            sesion.headers.update({
+                "Content-Type": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+                "Authorization": autorizacion,
+            })
+            _sesiones[autorizacion] = sesion
+        return sesion
+
+
+def autorizacion_reportes() -> str:
+    """
+    Encabezado de la cuenta de reportes: el mismo 'basic_auth_header' de st.secrets que usa el dashboard.
+    Sin la clave detiene la página con el mismo error de configuración del dashboard; las páginas de
+    reportes lo llaman al cargar, antes de consultar la API en hilos.
+    """
+    try:
+        return st.secrets["api"]["basic_auth_header"]
+    except (KeyError, FileNotFoundError):
+        st.error("ERROR CRÍTICO: No se pudo encontrar la clave 'basic_auth_header' en st.secrets.")
+        st.info("Asegúrese de configurar el archivo '.streamlit/secrets.toml' o la configuración de 'Secrets' en la nube.")
+        st.stop()
+
+
+def _registrar_resultado(exito: bool) -> None:
+    with _lock_circuito:
+        if exito:
+            _circuito["fallas"] = 0
+            return
+        _circuito["fallas"] += 1
+        if _circuito["fallas"] >= FALLAS_PARA_ABRIR:
+            _circuito["abierto_hasta"] = time.monotonic() + SEGUNDOS_CIRCUITO_ABIERTO
+            _circuito["fallas"] = 0
+
+
+def llamar_api(payload: Dict[str, Any], autorizacion: Optional[str] = None,
+               timeout_lectura: float = TIMEOUT_LECTURA_DEFECTO) -> Optional[Dict[str, Any]]:
+    """
+    POST a la API con la sesión compartida (sin autorizacion, con la de reportes).
+    Retorna el JSON de 'ForesightFlexAPI' o None si la respuesta no es JSON; lanza RequestException si falla.
+    """
+    with _lock_circuito:
+        restante = _circuito["abierto_hasta"] - time.monotonic()
+    if restante > 0:
+        raise CircuitoAbiertoError(f"API en pausa por fallas repetidas ({restante:.0f} s restantes)")
+
+    if autorizacion is None:
+        autorizacion = autorizacion_reportes()
+
+    try:
+        response = obtener_sesion(autorizacion).post(API_URL, json=payload, timeout=(TIMEOUT_CONEXION, timeout_lectura))
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        # Un 4xx es un error de la solicitud, no de disponibilidad: no abre el circuito
+        _registrar_resultado(e.response is not None and e.response.status_code < 500)
+        raise
+    except requests.exceptions.RequestException:
+        _registrar_resultado(False)
+        raise
+    _registrar_resultado(True)
+
+    if not response.headers.get("Content-Type", "").startswith("application/json"):
+        return None
+    # orjson si está instalado (decodificador_json), sobre los bytes ya descomprimidos
+    return loads(response.content).get("ForesightFlexAPI", {})
+
+
+def ejecutar_reporte_api(reportid: int, parametros: str, valores: str,
+                         timeout_lectura: float = TIMEOUT_LECTURA_DEFECTO) -> Optional[Dict[str, Any]]:
+    """Método REPORT_EXECUTE con la cuenta de reportes (las filas vienen en 'DATA1')."""
+    payload = {
+        "method": "REPORT_EXECUTE",
+        "conncode": CONNCODE,
+        "reportid": reportid,
+        "userid": USER_ID_REPORTES,
+        "prefix": True,
+        "parameter": parametros,
+        "value": valores,
+    }
+    return llamar_api(payload, timeout_lectura=timeout_lectura)
+
+
+# Hilos persistentes para las páginas (se comparten entre flotas y sesiones)
+_executor_paginas = ThreadPoolExecutor(max_workers=MAX_PAGINAS_EN_PARALELO, thread_name_prefix="foresight-pagina")
+
+
+def _buscar_pagina_unidades(ids: str, autorizacion: str, timeout_lectura: float) -> List[Dict[str, Any]]:
+    payload = {
+        "userid": USER_ID_PLATAFORMA,
+        "requesttype": 0,
+        "isdeleted": 0,
+        "pageindex": 1,
+        "orderby": "name",
+        "orderdirection": "ASC",
+        "conncode": CONNCODE,
+        "elements": 1,
+        "ids": ids,
+        "method": "usersearchplatform",
+        # Tamaño de página suficiente para todos los IDs
+        "pagesize": len(ids.split(',')) + 5,
+        "prefix": True,
+    }
+    respuesta = llamar_api(payload, autorizacion, timeout_lectura)
+    if respuesta is None:
+        # Como antes response.json(): una página sin JSON es una falla, no una página sin unidades
+        raise RespuestaNoJSONError(f"Respuesta sin JSON para {len(ids.split(','))} unidades")
+    return respuesta.get("DATA", [])
+
+
+def buscar_unidades(ids: str, autorizacion: str, timeout_lectura: float = TIMEOUT_CONEXION) -> List[Dict[str, Any]]:
+    """
+    Método usersearchplatform: estado en vivo de las unidades (filas de 'DATA').
+    Más de TAMANO_PAGINA_UNIDADES IDs se piden en páginas concurrentes (cada respuesta se descarga y
+    decodifica en su hilo) y se unen en el orden por nombre de la consulta única.
+    """
+    lista_ids = [unit_id.strip() for unit_id in ids.split(',') if unit_id.strip()]
+    if len(lista_ids) <= TAMANO_PAGINA_UNIDADES:
+        return _buscar_pagina_unidades(ids, autorizacion, timeout_lectura)
+
+    paginas = [
+        ','.join(lista_ids[inicio:inicio + TAMANO_PAGINA_UNIDADES])
+        for inicio in range(0, len(lista_ids), TAMANO_PAGINA_UNIDADES)
+    ]
+    futuros = [_executor_paginas.submit(_buscar_pagina_unidades, pagina, autorizacion, timeout_lectura) for pagina in paginas]
+    # Si una página falla se propaga el error: una instantánea incompleta no reemplaza a la anterior
+    unidades = [unidad for futuro in futuros for unidad in futuro.result()]
+    unidades.sort(key=lambda unidad: str(unidad.get("name", "")))
+    return unidades
+
+
+def solicitudes_busqueda_unidades(ids: str) -> int:
+    """Solicitudes que hace buscar_unidades para estos IDs (una por página de TAMANO_PAGINA_UNIDADES)."""
+    total_ids = sum(1 for unit_id in ids.split(',') if unit_id.strip())
+    return max(1, math.ceil(total_ids / TAMANO_PAGINA_UNIDADES))
+
+
+def filas_a_frame(filas: List[Dict[str, Any]], columnas_numericas=()) -> pd.DataFrame:
+    """
+    Decodifica las filas (lista de dicts) por columnas, en una sola pasada por campo.
+    Las columnas numéricas se convierten a float64 (NaN si el valor no es numérico).
+    """
+    campos = dict.fromkeys(campo for fila in filas for campo in fila)
+    columnas = {campo: [fila.get(campo) for fila in filas] for campo in campos}
+    for campo in columnas_numericas:
+        if campo in columnas:
+            columnas[campo] = pd.to_numeric(np.asarray(columnas[campo], dtype=object), errors="coerce").astype(np.float64)
+    return pd.DataFrame(columnas)
@@ -0,0 +1,139 @@
+"""
+Lectura y procesamiento de los perímetros (GeoJSON Polygon/LineString de 'perimetros/').
+
+El resultado se guarda por proceso (compartido por todas las sesiones) y se vuelve a leer solo si
+cambia algún archivo. precalentamiento_flotas lo carga al arrancar, así la primera vista del
+dashboard no procesa la geometría; el dashboard lo envuelve en su propia caché de Streamlit.
+"""
+import glob
+import json
+import os
+import threading
+from typing import Any, Dict, List
+
+from shapely.geometry import LineString, Polygon
+
+from decodificador_json import cargar_json
+
+_perimetros: Dict[str, Any] = {}
+_lock_perimetros = threading.Lock()
+
+
+# Tolerancia (en grados, ~11 m) para simplificar la geometría que se DIBUJA en el mapa.
+# La verificación de pertenencia sigue usando el polígono original a resolución completa.
+TOLERANCIA_SIMPLIFICACION_MAPA = 0.0001
+
+
+def hex_a_rgba(color_hex: str, alpha: int = 255) -> List[int]:
+    """Convierte un color '#RRGGBB' en [r, g, b, a] para pydeck."""
+    color_sin_hash = color_hex.replace('#', '')
+    return [int(color_sin_hash[0:2], 16), int(color_sin_hash[2:4], 16), int(color_sin_hash[4:6], 16), alpha]
+
+
+def simplificar_coordenadas_mapa(coords_lon_lat, tolerancia: float = TOLERANCIA_SIMPLIFICACION_MAPA) -> List[List[float]]:
+    """Reduce los vértices de un anillo/línea para el renderizado (Douglas-Peucker) y redondea a 6 decimales."""
+    if len(coords_lon_lat) < 3:
+        return [[round(lon, 6), round(lat, 6)] for lon, lat in coords_lon_lat]
+    linea = LineString(coords_lon_lat).simplify(tolerancia, preserve_topology=True)
+    return [[round(lon, 6), round(lat, 6)] for lon, lat in linea.coords]
+
+
+def _procesar_perimetros(perimetros_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Carga y procesa todos los perímetros (GeoJSON Polygon/LineString)
+    de la carpeta en objetos Shapely Polygon.
+    """
+    if not os.path.exists(perimetros_dir):
+        os.makedirs(perimetros_dir)
+        print(f"Directorio de perímetros '{perimetros_dir}' creado. ¡Agrega tus archivos JSON!")
+        return {}
+
+    perimetros_cargados = {}
+    archivos_json = glob.glob(os.path.join(perimetros_dir, "*.json"))
+
+    if not archivos_json:
+        return {}
+
+    for i, file_path in enumerate(archivos_json):
+        nombre_perimetro = os.path.basename(file_path).replace('.json', '')
+        coords_lon_lat = None
+
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                geojson_data = cargar_json(f)
+
+            # Navegación GeoJSON: FeatureCollection > Feature > Geometry
+            feature = geojson_data.get('features', [{}])[0]
+            geometry = feature.get('geometry', {})
+            properties = feature.get('properties', {})
+            geom_type = geometry.get('type')
+
+            if geom_type == 'Polygon':
+                # Coordenadas de Polygon: un nivel extra de anidamiento
+                poligon_rings = geometry.get('coordinates', [[]])
+                coords_lon_lat = poligon_rings[0]
+
+            elif geom_type == 'LineString':
+                # Coordenadas de LineString: lista simple de puntos
+                coords_lon_lat = geometry.get('coordinates', [])
+
+            else:
+                 print(f"El archivo {nombre_perimetro}.json tiene un tipo de geometría ('{geom_type}') no soportado y fue omitido.")
+                 continue
+
+            if not coords_lon_lat:
+                 print(f"El archivo {nombre_perimetro}.json no contiene coordenadas válidas y fue omitido.")
+                 continue
+
+            # Crear el objeto Polygon de Shapely (usa [lon, lat])
+            poligono = Polygon(coords_lon_lat)
+
+            # Extraer color de las propiedades (por defecto azul)
+            color_perimetro = properties.get('color', '#9CF527')
+            color_relleno = properties.get('fill', '#9CF527')
+
+
+            # Almacenar la información
+            perimetros_cargados[nombre_perimetro] = {
+                "poligono_shapely": poligono,
+                "coords_lon_lat": coords_lon_lat,
+                "archivo_path": file_path,
+                "version": os.path.getmtime(file_path), # Cambia solo si se edita el archivo
+                "geometria": {
+                    "type": geom_type,
+                    "coordinates": coords_lon_lat
+                },
+                # Geometría reducida y colores RGBA listos para pydeck (se calculan una sola vez)
+                "coords_mapa": simplificar_coordenadas_mapa(coords_lon_lat),
+                "color_borde_rgba": hex_a_rgba(color_perimetro),
+                "color_relleno_rgba": hex_a_rgba(color_relleno),
+                "nombre": properties.get('name', nombre_perimetro),
+                "color_perimetro": color_perimetro,
+                "color_relleno": color_relleno,
+                "properties": properties
+            }
+
+        except json.JSONDecodeError:
+            print(f"El archivo {nombre_perimetro}.json no es un GeoJSON válido y fue omitido.")
+        except Exception as e:
+            print(f"Error al procesar el archivo {nombre_perimetro}.json: {e}. Revise la estructura de coordenadas.")
+
+    return perimetros_cargados
+
+
+def _firma_perimetros(perimetros_dir: str) -> tuple:
+    """Archivos de perímetro y su fecha de modificación (cambia solo si se agrega o edita uno)."""
+    return tuple(sorted(
+        (file_path, os.path.getmtime(file_path)) for file_path in glob.glob(os.path.join(perimetros_dir, "*.json"))
+    ))
+
+
+def leer_perimetros(perimetros_dir: str = "perimetros") -> Dict[str, Dict[str, Any]]:
+    """Perímetros procesados de la carpeta, leídos una sola vez por proceso mientras los archivos no cambien."""
+    with _lock_perimetros:
+        firma = _firma_perimetros(perimetros_dir) if os.path.exists(perimetros_dir) else None
+        guardado = _perimetros.get(perimetros_dir)
+        if guardado is None or guardado["firma"] != firma:
+            guardado = {"firma": firma, "perimetros": _procesar_perimetros(perimetros_dir)}
+            _perimetros[perimetros_dir] = guardado
+        return guardado["perimetros"]
@@ -1,5 +1,6 @@
 # --- IMPORTACIONES ---
 import streamlit as st
+from precalentamiento_flotas import iniciar_precalentamiento
 
 # =========================================================
 # === FUNCIONES Y CONFIGURACIÓN ===
@@ -74,6 +75,14 @@ h1 {{
 # Aplica el CSS
 st.markdown(CSS_STYLE, unsafe_allow_html=True)
 
+# 🔥 PRECALENTAMIENTO: sondeo de fondo de todas las flotas (una sola vez por proceso del servidor, con la
+# primera sesión que abre el inicio o el dashboard), para que la primera vista de cualquier flota no espere a la API
+try:
+    iniciar_precalentamiento(st.secrets["api"]["basic_auth_header"])
+except (KeyError, FileNotFoundError):
+    # Sin clave de la API no se precalienta; el dashboard mostrará su propio error de configuración
+    pass
+
 # ⚠️ INYECTAMOS EL DIV DE FONDO PRIMERO (Para que esté debajo del contenido)
 st.markdown('<div class="main-page-background"></div>', unsafe_allow_html=True)
 
@@ -1,19 +1,24 @@
 # IMPORTACIONES
 import streamlit as st
-import requests
 import json
 import pandas as pd
 import pydeck as pdk
 import time
 import numpy as np
 from typing import List, Dict, Any
-import base64
 import os
-import glob
 import sqlite3 
 import re
+import threading
+import functools
 from datetime import datetime, timedelta, timezone, date
-from shapely.geometry import Polygon, Point
+from shapely.geometry import Point
+from proximidad import construir_indice_zonas, dentro_de_alguna_zona
+from geometria_perimetros import hex_a_rgba, leer_perimetros
+from precalentamiento_flotas import FLOTA_AGREGADA, consultar_unidades, iniciar_precalentamiento, partes_flota_agregada, semilla_movimiento
+from decodificador_json import cargar_json
+from foresight_api import solicitudes_busqueda_unidades
+from servicio_flota import intervalo_por_actividad, intervalo_refresco, obtener_snapshot, publicar_resumen, registrar_intervalo
 
 
 @st.cache_data(ttl=60) # Cache de 1 minuto
@@ -115,7 +120,7 @@ def get_db_connection():
         return None
 
 def initialize_db():
-    """Crea las tablas 'unidades', 'conductores', 'rutas' y 'asignacion' si no existen, asegurando el aislamiento por FLOTA."""
+    """Crea las tablas 'unidades', 'conductores', 'rutas', 'asignacion' y 'alertas_aceptadas' si no existen, asegurando el aislamiento por FLOTA."""
     conn = get_db_connection()
     if conn is None: return
     try:
@@ -179,6 +184,18 @@ def initialize_db():
                 observaciones TEXT
             )
         """)
+
+# 5. TABLA ALERTAS ACEPTADAS (ACUSES COMPARTIDOS POR FLOTA)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS alertas_aceptadas (
+                flota TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                unidad TEXT NOT NULL,
+                aceptada_en REAL NOT NULL,
+                expira_en REAL,
+                PRIMARY KEY(flota, tipo, unidad)
+            )
+        """)
         conn.commit()
     except Exception as e:
         print(f"Error al inicializar la BD: {e}")
@@ -1698,83 +1715,74 @@ TIME_FORMAT = '%b %d %Y %I:%M%p'
 
 
 # FUNCIONES DE PERÍMETROS
+# La lectura y el procesamiento de los archivos viven en geometria_perimetros.py (el precalentamiento
+# los carga al arrancar); aquí solo se cachean por sesión de Streamlit
+
 @st.cache_data(ttl=None) # 🚨 OPTIMIZACIÓN: Cargar perímetros una sola vez por selección de flota
 def cargar_perimetros(perimetros_dir: str = "perimetros") -> Dict[str, Dict[str, Any]]:
     """
     Carga y procesa todos los perímetros (GeoJSON Polygon/LineString) 
     de la carpeta 'perimetros/' en objetos Shapely Polygon.
     """
-    if not os.path.exists(perimetros_dir):
-        os.makedirs(perimetros_dir)
-        print(f"Directorio de perímetros '{perimetros_dir}' creado. ¡Agrega tus archivos JSON!")
-        return {}
-    
-    perimetros_cargados = {}
-    archivos_json = glob.glob(os.path.join(perimetros_dir, "*.json"))
-    
-    if not archivos_json:
-        return {}
-
-    for i, file_path in enumerate(archivos_json):
-        nombre_perimetro = os.path.basename(file_path).replace('.json', '')
-        coords_lon_lat = None
-        
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                geojson_data = json.load(f)
-            
-            # Navegación GeoJSON: FeatureCollection > Feature > Geometry
-            feature = geojson_data.get('features', [{}])[0]
-            geometry = feature.get('geometry', {})
-            properties = feature.get('properties', {})
-            geom_type = geometry.get('type')
-            
-            if geom_type == 'Polygon':
-                # Coordenadas de Polygon: un nivel extra de anidamiento
-                poligon_rings = geometry.get('coordinates', [[]])
-                coords_lon_lat = poligon_rings[0]
-            
-            elif geom_type == 'LineString':
-                # Coordenadas de LineString: lista simple de puntos
-                coords_lon_lat = geometry.get('coordinates', [])
-            
-            else:
-                 print(f"El archivo {nombre_perimetro}.json tiene un tipo de geometría ('{geom_type}') no soportado y fue omitido.")
-                 continue
-
-            if not coords_lon_lat:
-                 print(f"El archivo {nombre_perimetro}.json no contiene coordenadas válidas y fue omitido.")
-                 continue
+    return leer_perimetros(perimetros_dir)
 
-            # Crear el objeto Polygon de Shapely (usa [lon, lat])
-            poligono = Polygon(coords_lon_lat)
-            
-            # Extraer color de las propiedades (por defecto azul)
-            color_perimetro = properties.get('color', '#9CF527')
-            color_relleno = properties.get('fill', '#9CF527')
+def version_perimetros(perimetros_cargados: Dict[str, Dict[str, Any]]) -> tuple:
+    """Identifica la versión del conjunto de perímetros (nombre + fecha de modificación de cada archivo)."""
+    return tuple(sorted((nombre, datos.get('version')) for nombre, datos in perimetros_cargados.items()))
 
-            
-            # Almacenar la información
-            perimetros_cargados[nombre_perimetro] = {
-                "poligono_shapely": poligono,
-                "coords_lon_lat": coords_lon_lat,
-                "archivo_path": file_path,
-                "geometria": {
-                    "type": geom_type,
-                    "coordinates": coords_lon_lat
-                },
-                "nombre": properties.get('name', nombre_perimetro),
-                "color_perimetro": color_perimetro,
-                "color_relleno": color_relleno,
-                "properties": properties
-            }
-        
-        except json.JSONDecodeError:
-            print(f"El archivo {nombre_perimetro}.json no es un GeoJSON válido y fue omitido.")
-        except Exception as e:
-            print(f"Error al procesar el archivo {nombre_perimetro}.json: {e}. Revise la estructura de coordenadas.")
-            
-    return perimetros_cargados
+@st.cache_resource(ttl=None)
+def construir_capas_perimetros(_perimetros_cargados: Dict[str, Dict[str, Any]], version: tuple) -> List[pdk.Layer]:
+    """
+    Construye UNA sola vez por versión de perímetros las capas pydeck (PolygonLayer / PathLayer)
+    con la geometría simplificada y los colores ya convertidos.
+    """
+    perimetros_layers = []
+
+    for nombre_perimetro, datos_perimetro in _perimetros_cargados.items():
+        geometria = datos_perimetro.get('geometria')
+        if not geometria:
+            continue
+
+        if geometria['type'] == 'Polygon':
+            polygon_data = pd.DataFrame({
+                'polygon': [datos_perimetro['coords_mapa']],
+                'nombre': [nombre_perimetro],
+                'fill_color': [datos_perimetro['color_relleno_rgba']],
+                'line_color': [datos_perimetro['color_borde_rgba']], # Opacidad 255 (sólido) para el borde
+            })
+            perimetros_layers.append(pdk.Layer(
+                "PolygonLayer",
+                data=polygon_data,
+                get_polygon="polygon",
+                get_fill_color="fill_color",
+                get_line_color="line_color",
+                get_line_width=2,
+                pickable=True,
+                stroked=True,
+                filled=True,
+                auto_highlight=True,
+                id=f"perimetro_{nombre_perimetro}",
+            ))
+
+        elif geometria['type'] == 'LineString':
+            line_data = pd.DataFrame({
+                'path': [datos_perimetro['coords_mapa']],
+                'nombre': [nombre_perimetro],
+                'color': [datos_perimetro['color_borde_rgba']],
+            })
+            perimetros_layers.append(pdk.Layer(
+                "PathLayer",
+                data=line_data,
+                get_path="path",
+                get_color="color",
+                get_width=3,
+                width_min_pixels=2,
+                pickable=True,
+                auto_highlight=True,
+                id=f"perimetro_{nombre_perimetro}",
+            ))
+
+    return perimetros_layers
 
 def verificar_coordenada_en_perimetro(latitud, longitud, perimetros_cargados):
     """Verifica si una coordenada está dentro de los polígonos cargados usando Shapely."""
@@ -1802,6 +1810,58 @@ COLOR_RESGUARDO_SECUNDARIO = "#191452"
 COLOR_VERTEDERO = "#FCC6BB" 
 COLOR_FUERA_DE_PERIMETRO = "#7627F5" 
 COLOR_FALLA_GPS = "#AAAAAA" 
+COLOR_PARADA_LARGA = "#FFC107"
+
+# 🔢 CÓDIGOS DE ESTADO DE LA COLUMNA 'ESTADO' (int8) 🔢
+# El DataFrame en vivo solo guarda el código; etiqueta y estilo de tarjeta se buscan al renderizar.
+ESTADO_ENCENDIDA = 0
+ESTADO_APAGADA = 1
+ESTADO_RESGUARDO_SEDE = 2
+ESTADO_RESGUARDO_FUERA_SEDE = 3
+ESTADO_VERTEDERO = 4
+ESTADO_FUERA_PERIMETRO = 5
+ESTADO_ENCENDIDA_SEDE = 6
+ESTADO_FALLA_GPS = 7
+ESTADO_SIN_DATOS = 8 # Fila de respaldo (FALLBACK)
+
+ETIQUETAS_ESTADO = np.array([
+    "Encendida 🔥", "Apagada ❄️", "Resguardo (Sede) 🛡️", "Resguardo (Fuera de Sede) 🛡️",
+    "Vertedero 🚛", "Fuera de Perímetro 🌐", "Encendida (Sede) 🔥", "Falla GPS 🛠", "N/A",
+], dtype=object)
+COLORES_ESTADO = np.array([
+    "#4CAF50", "#D32F2F", "#337ab7", COLOR_RESGUARDO_SECUNDARIO,
+    COLOR_VERTEDERO, COLOR_FUERA_DE_PERIMETRO, "#B37305", COLOR_FALLA_GPS, "#D32F2F",
+], dtype=object)
+COLORES_TEXTO_ESTADO = np.array(["white"] * 7 + ["black", "white"], dtype=object)
+
+# Estados considerados "en base" (sede, resguardo, vertedero) o excluidos de las alertas de ruta
+ESTADOS_EN_BASE_O_EXCLUIDOS = [ESTADO_RESGUARDO_SEDE, ESTADO_RESGUARDO_FUERA_SEDE, ESTADO_ENCENDIDA_SEDE,
+                               ESTADO_VERTEDERO, ESTADO_FUERA_PERIMETRO, ESTADO_FALLA_GPS]
+
+# Tipos de columna del DataFrame en vivo (columnar: códigos enteros, float32 y booleanos)
+TIPOS_COLUMNAS_EN_VIVO = {
+    "ESTADO": np.int8,
+    "VELOCIDAD": np.float32,
+    "LATITUD": np.float64, # Se mantiene float64: la detección de paradas compara coordenadas a 6 decimales
+    "LONGITUD": np.float64,
+    "SENTIDO": np.float32,
+    "STOP_DURATION_MINUTES": np.float32,
+    "EN_SEDE_FLAG": bool,
+    "EN_RESGUARDO_SECUNDARIO_FLAG": bool,
+    "EN_VERTEDERO_FLAG": bool,
+    "EN_FUERA_PERIMETRO_FLAG": bool,
+    "ES_FALLA_GPS_FLAG": bool,
+}
+
+def etiquetas_estado(codigos) -> np.ndarray:
+    """Etiquetas legibles (con emoji) para un arreglo/Serie de códigos de estado."""
+    return ETIQUETAS_ESTADO[np.asarray(codigos, dtype=np.int64)]
+
+def estilos_tarjeta(codigos) -> np.ndarray:
+    """Estilo CSS de la tarjeta para cada código de estado (mismo formato que get_card_style)."""
+    codigos = np.asarray(codigos, dtype=np.int64)
+    return ("background-color: " + COLORES_ESTADO[codigos] + "; padding: 15px; border-radius: 5px; color: "
+            + COLORES_TEXTO_ESTADO[codigos] + "; margin-bottom: 0px;")
 
 
 # 🚨 CONSTANTES DE ALARMAS DE VELOCIDAD 🚨
@@ -1872,7 +1932,7 @@ def construir_status_con_emojis(row_data, is_en_perimetro, estado_display=None):
     # Si está fuera de perímetro, construir el estado con emojis coloridos
     if estado_display is None:
         # Construir estado si no se proporciona
-        estado_ignicion = row_data['IGNICION']
+        estado_ignicion = ETIQUETAS_ESTADO[int(row_data['ESTADO'])]
         velocidad = row_data['VELOCIDAD']
         stop_duration = row_data['STOP_DURATION_MINUTES']
         
@@ -1911,114 +1971,89 @@ def construir_status_con_emojis(row_data, is_en_perimetro, estado_display=None):
         else:
             return f'<span style="color: black;">🛑</span> {estado_display}'
 
-# 🚨 FUNCIÓN OPTIMIZADA 🚨
-def verificar_falla_gps(unidad_data: Dict[str, Any], hora_venezuela: datetime,
-                        minutos_encendida: int, minutos_apagada: int) -> Dict[str, Any]:
+# 🚨 DETECCIÓN DE FALLA GPS EN LOTE 🚨
+@functools.lru_cache(maxsize=4096)
+def parsear_last_report(last_report_str: str) -> float:
     """
-    Evalúa si la unidad debe cambiar a estado 'Falla GPS' y actualiza el diccionario de datos.
+    Convierte un 'LastReportTime' ('Sep 30 2025 12:57PM') a segundos epoch en hora de Venezuela.
+    Memoizado: las unidades estacionadas repiten la misma cadena ciclo tras ciclo. Retorna NaN si no se puede parsear.
     """
-    last_report_str = unidad_data.get('LastReportTime')
-    ignicion_raw = unidad_data.get("ignition", "false").lower()
-    estado_ignicion = ignicion_raw == "true"
-
-    if not last_report_str:
-        return unidad_data
-
     try:
-        last_report_dt = datetime.strptime(last_report_str, TIME_FORMAT).replace(tzinfo=VENEZUELA_TZ)
-    except ValueError:
-        return unidad_data
-
-    # 1. Calcular la diferencia de tiempo
-    diferencia_tiempo: timedelta = hora_venezuela - last_report_dt
-    minutos_sin_reportar = diferencia_tiempo.total_seconds() / 60.0
-
-    # 2. Definir los umbrales de tiempo
-    UMBRAL_ENCENDIDA = timedelta(minutes=minutos_encendida)
-    UMBRAL_APAGADA = timedelta(minutes=minutos_apagada)
-
-    es_falla_gps = False
-    motivo_falla = ""
+        return datetime.strptime(last_report_str, TIME_FORMAT).replace(tzinfo=VENEZUELA_TZ).timestamp()
+    except (TypeError, ValueError):
+        return np.nan
+
+def parsear_last_report_lote(textos: List[Any]) -> np.ndarray:
+    """Parsea en lote los 'LastReportTime' de la flota (NaN para vacíos o inválidos)."""
+    return np.fromiter(
+        (parsear_last_report(texto) if texto else np.nan for texto in textos),
+        dtype=np.float64, count=len(textos)
+    )
 
-    if estado_ignicion:
-        if diferencia_tiempo > UMBRAL_ENCENDIDA:
-            es_falla_gps = True
-            motivo_falla = f"Encendida **{minutos_sin_reportar:.0f} minutos** sin reportar (Umbral {minutos_encendida} min)."
+def detectar_fallas_gps(textos_reporte: List[Any], ignicion: np.ndarray, hora_venezuela: datetime,
+                        minutos_encendida: int, minutos_apagada: int):
+    """
+    Evalúa la Falla GPS de toda la flota con una sola comparación de arreglos.
+    Retorna (es_falla_gps, minutos_sin_reportar); las unidades sin hora válida nunca se marcan como falla.
+    """
+    minutos_sin_reportar = (hora_venezuela.timestamp() - parsear_last_report_lote(textos_reporte)) / 60.0
+    umbral = np.where(ignicion, minutos_encendida, minutos_apagada)
+    # NaN > umbral es False: sin reporte parseable no hay falla
+    es_falla_gps = minutos_sin_reportar > umbral
+    return es_falla_gps, minutos_sin_reportar
+
+def construir_motivo_falla_gps(minutos_sin_reportar: float, encendida: bool,
+                               minutos_encendida: int, minutos_apagada: int) -> str:
+    """Texto del motivo de Falla GPS (solo se construye para las unidades en falla)."""
+    if encendida:
+        return f"Encendida **{minutos_sin_reportar:.0f} minutos** sin reportar (Umbral {minutos_encendida} min)."
+
+    # Display simplificado a minutos totales (o horas si es mucho)
+    if minutos_sin_reportar >= 60:
+        tiempo_display = f"{(minutos_sin_reportar / 60.0):.1f} horas"
     else:
-        if diferencia_tiempo > UMBRAL_APAGADA:
-            es_falla_gps = True
-            # Display simplificado a minutos totales (o horas si es mucho)
-            if minutos_sin_reportar >= 60:
-                 tiempo_display = f"{(minutos_sin_reportar / 60.0):.1f} horas"
-            else:
-                 tiempo_display = f"{minutos_sin_reportar:.0f} minutos"
-
-            umbral_display = f"{minutos_apagada // 60}h {minutos_apagada % 60}min" if minutos_apagada >= 60 else f"{minutos_apagada}min"
+        tiempo_display = f"{minutos_sin_reportar:.0f} minutos"
 
-            motivo_falla = f"Apagada **{tiempo_display}** sin reportar (Umbral {umbral_display})."
+    umbral_display = f"{minutos_apagada // 60}h {minutos_apagada % 60}min" if minutos_apagada >= 60 else f"{minutos_apagada}min"
 
-# 3. Aplicar el estado y estilo si es Falla GPS
-    if es_falla_gps:
-        unidad_data['Estado_Falla_GPS'] = True
-        unidad_data['FALLA_GPS_MOTIVO'] = motivo_falla
-        unidad_data['LAST_REPORT_TIME_FOR_DETAIL'] = last_report_str
-        unidad_data['IGNICION_OVERRIDE'] = "Falla GPS 🛠"
-        # Usamos el f-string para el estilo
-        unidad_data['CARD_STYLE_OVERRIDE'] = f"background-color: {COLOR_FALLA_GPS}; padding: 15px; border-radius: 5px; color: black; margin-bottom: 0px;"
+    return f"Apagada **{tiempo_display}** sin reportar (Umbral {umbral_display})."
 
-    return unidad_data
+# 🚨 CONFIGURACIÓN DE AUDIO COMO RECURSOS ESTÁTICOS (EJECUCIÓN ÚNICA AL INICIO) 🚨
+# Los clips viven en 'static/' y Streamlit los sirve en 'app/static/<archivo>'
+# (server.enableStaticServing = true en .streamlit/config.toml). El navegador los descarga
+# una vez y los cachea; en cada ciclo solo viaja una etiqueta <audio> con la URL del clip.
+AUDIO_STATIC_DIR = "static"
 
-# 🚨 CONFIGURACIÓN DE AUDIO Y BASE64 (EJECUCIÓN ÚNICA AL INICIO) 🚨
-
-# @st.cache_resource para asegurar que se ejecuta una sola vez y no se recalcula en cada rerun.
 @st.cache_resource(ttl=None)
-def obtener_audio_base64(audio_path):
-    """Codifica el archivo de audio en una cadena Base64 al inicio."""
+def obtener_url_audio(nombre_archivo):
+    """Verifica que el clip exista en la carpeta estática y retorna su URL (con versión por fecha de modificación)."""
+    audio_path = os.path.join(AUDIO_STATIC_DIR, nombre_archivo)
     if not os.path.exists(audio_path):
         # En una app en producción, es mejor solo logear el error que detener la app
         print(f"Error Crítico: No se encontró el archivo de audio '{audio_path}'.")
         return None
-    try:
-        with open(audio_path, "rb") as f:
-            data = f.read()
-        return base64.b64encode(data).decode()
-    except Exception as e:
-        print(f"Error al codificar el audio: {e}")
-        return None
+    # La versión solo cambia si se reemplaza el archivo, así el navegador conserva su copia en caché
+    return f"app/static/{nombre_archivo}?v={int(os.path.getmtime(audio_path))}"
 
-# 🚨 EJECUCIÓN DEL BASE64 UNA SOLA VEZ AL INICIO 🚨
-# NOTA: ASUMO que los archivos 'parada.mp3', 'velocidad.mp3' y 'perimetro.mp3' existen en el mismo directorio.
+# 🚨 RESOLUCIÓN DE LAS URLs UNA SOLA VEZ AL INICIO 🚨
+# NOTA: Los archivos 'parada.mp3', 'velocidad.mp3', 'perimetro.mp3' y 'encendido.mp3' deben existir en 'static/'.
 # Si no existen, las alertas de audio no funcionarán.
-AUDIO_BASE64_PARADA = obtener_audio_base64("parada.mp3")
-AUDIO_BASE64_VELOCIDAD = obtener_audio_base64("velocidad.mp3")
-AUDIO_BASE64_PERIMETRO = obtener_audio_base64("perimetro.mp3")  # 🆕 NUEVO AUDIO PARA PERÍMETROS
-AUDIO_BASE64_ENCENDIDO = obtener_audio_base64("encendido.mp3")  # 🔊 NUEVO AUDIO PARA CAMBIO A ENCENDIDO
+AUDIO_URL_PARADA = obtener_url_audio("parada.mp3")
+AUDIO_URL_VELOCIDAD = obtener_url_audio("velocidad.mp3")
+AUDIO_URL_PERIMETRO = obtener_url_audio("perimetro.mp3")  # 🆕 NUEVO AUDIO PARA PERÍMETROS
+AUDIO_URL_ENCENDIDO = obtener_url_audio("encendido.mp3")  # 🔊 NUEVO AUDIO PARA CAMBIO A ENCENDIDO
 
-def reproducir_alerta_sonido(base64_str):
+def reproducir_alerta_sonido(audio_url):
     """
-    Inyecta el script HTML con el audio Base64 usando st.markdown.
+    Envía solo la señal de reproducción: una etiqueta <audio> (unos cientos de bytes) que apunta al clip estático.
     """
-    if not base64_str:
+    if not audio_url:
         return
 
+    # El id único fuerza a montar un elemento nuevo para que el navegador vuelva a reproducir el clip (ya en caché)
     unique_id = int(time.time() * 1000)
     audio_html = f"""
-    <audio controls autoplay style="display:none" id="alerta_audio_tag_{unique_id}">
-        <source src="data:audio/mp3;base64,{base64_str}" type="audio/mp3">
-    </audio>
-    <script>
-        // Lógica de carga y reproducción para evitar bloqueo de autoplay en algunos navegadores
-        const audio = document.getElementById('alerta_audio_tag_{unique_id}');
-        if (audio) {{
-            audio.volume = 1.0;
-            audio.load();
-            audio.play().catch(error => console.warn('Bloqueo de Autoplay: ', error));
-        }}
-        // OPCIONAL: Eliminar el elemento después de la reproducción para limpiar el DOM
-        audio.onended = function() {{
-            this.remove();
-        }};
-    </script>
+    <audio autoplay preload="auto" style="display:none" id="alerta_audio_tag_{unique_id}" src="{audio_url}"></audio>
     """
     st.markdown(audio_html, unsafe_allow_html=True)
 # CONFIGURACIÓN DE PÁGINA
@@ -2086,6 +2121,42 @@ st.markdown("""
     }
     
 
+    /* 4. Grilla de tarjetas (un solo bloque HTML para todas las unidades) */
+    .grid-tarjetas {
+        display: grid;
+        grid-template-columns: repeat(5, minmax(0, 1fr));
+        gap: 15px 1rem;
+        margin-bottom: 15px;
+    }
+    .grid-tarjetas p {
+        margin: 0;
+    }
+    .tarjeta-detalles {
+        margin-top: 6px;
+        border: 1px solid rgba(250, 250, 250, 0.2);
+        border-radius: 10px;
+        padding: 4px 10px;
+        font-size: 0.85rem;
+    }
+    .tarjeta-detalles summary {
+        cursor: pointer;
+        font-weight: bold;
+    }
+    .tarjeta-detalles summary:hover {
+        color: #1e88e5;
+    }
+    .tarjeta-detalles div {
+        opacity: 0.8;
+        margin: 4px 0;
+    }
+    .tarjeta-falla {
+        background-color: rgba(255, 43, 43, 0.09);
+        color: #ff4b4b;
+        border-radius: 5px;
+        padding: 6px 8px;
+        opacity: 1 !important;
+    }
+
     /* ✨ REGLA PARA ALINEAR EL TESTIGO A LA DERECHA ✨ */
     .update-align {
         display: flex; /* Habilita el manejo de alineación flexible */
@@ -2095,7 +2166,7 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 # CONFIGURACIÓN DE LA API Y SEGURIDAD (st.secrets)
-API_URL = "https://flexapi.foresightgps.com/ForesightFlexAPI.ashx"
+# El endpoint y la sesión HTTP compartida viven en foresight_api.py
 
 try:
 # 🔑 La clave se carga de forma SEGURA desde st.secrets
@@ -2137,7 +2208,7 @@ def cargar_configuracion_flotas(config_dir: str = CONFIG_DIR) -> Dict[str, Dict[
 
             try:
                 with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                    data = cargar_json(f)
 
                     # 🚨 MODIFICACIÓN CLAVE: Ahora se valida la existencia de 'sede_coords'.
                     if all(key in data for key in ["ids", "sede_coords"]):
@@ -2183,7 +2254,7 @@ def cargar_datos_flota_conductor(nombre_flota: str, data_dir: str = DATA_DIR) ->
 
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+            data = cargar_json(f)
             # Retorna el diccionario de unidades (ej: {"7001": {...}})
             return data
     except json.JSONDecodeError:
@@ -2215,25 +2286,13 @@ if not FLOTAS_CONFIG:
 
 # -----------------------------------------------------------
 
-# ENCABEZADO DE AUTENTICACION
+# ENCABEZADO DE AUTENTICACION: BASIC_AUTH_HEADER se pasa a consultar_unidades (foresight_api: una sesión por encabezado)
 
-HEADERS = {
-    "Content-Type": "application/json",
-    "Authorization": BASIC_AUTH_HEADER
-}
+# 🔥 PRECALENTAMIENTO: también desde aquí (no solo desde home.py) para quien entra directo a /dashboard;
+# solo la primera llamada del proceso lo arranca
+iniciar_precalentamiento(BASIC_AUTH_HEADER)
 
 # CALCULO DE DISTANCIA (FUNCIÓN HAVERSINE)
-def haversine(lat1, lon1, lat2, lon2):
-    """Calcula la distancia Haversine entre dos puntos en la Tierra (en km). OPTIMIZADA con numpy."""
-    R = 6371
-    # Vectorización con numpy
-    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = np.sin(dlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2.0)**2
-    c = 2 * np.arcsin(np.sqrt(a))
-    return R * c
-
 # FUNCIÓN DE RESPALDO PARA VERIFICACIÓN SIN SHAPELY
 def es_punto_dentro_perimetro(lat, lon, coordenadas_perimetro):
     """
@@ -2326,16 +2385,16 @@ def get_card_style(ignicion_status, speed):
 
 # CALLBACK MODIFICADO PARA DESCARTE
 def descartar_alerta_stop(unidad_id_a_descartar):
-    """Marca la alerta de Parada Larga como 'descartada' y DESACTIVA la bandera de audio."""
-    st.session_state['alertas_descartadas'][unidad_id_a_descartar] = True
+    """Marca la alerta de Parada Larga como 'descartada' para toda la flota y DESACTIVA la bandera de audio."""
+    aceptar_alertas(st.session_state['flota_seleccionada'], 'parada', [unidad_id_a_descartar])
     st.session_state['reproducir_audio_alerta'] = False
     st.cache_data.clear()
     st.session_state['scroll_to_top_flag'] = True
 
 # DESCARTAR EXCESO DE VELOCIDAD
 def descartar_alerta_velocidad(unidad_id_a_descartar):
-    """Marca la alerta de Exceso de Velocidad como 'descartada' y DESACTIVA la bandera de audio."""
-    st.session_state['alertas_velocidad_descartadas'][unidad_id_a_descartar] = True
+    """Marca la alerta de Exceso de Velocidad como 'descartada' para toda la flota y DESACTIVA la bandera de audio."""
+    aceptar_alertas(st.session_state['flota_seleccionada'], 'velocidad', [unidad_id_a_descartar])
     st.session_state['reproducir_audio_velocidad'] = False
     st.cache_data.clear()
     st.session_state['scroll_to_top_flag'] = True
@@ -2345,37 +2404,215 @@ def get_fallback_data(error_type="Conexión Fallida"):
     """Genera una estructura de datos de una sola fila para señalizar el error en el main loop."""
 
     # Aseguramos que la estructura del DataFrame sea completa para evitar errores en el bucle
-    return pd.DataFrame([{
-        "UNIDAD": "FALLBACK",
-        "UNIT_ID": "FALLBACK_ID",
-        "IGNICION": "N/A",
-        "VELOCIDAD": 0.0,
-        "LATITUD": 0.0,
-        "LONGITUD": 0.0,
-        "UBICACION_TEXTO": f"FALLBACK - {error_type}",
-        "CARD_STYLE": "background-color: #D32F2F; padding: 15px; border-radius: 5px; color: white; margin-bottom: 0px;",
-        "FALLA_GPS_MOTIVO": None,
-        "LAST_REPORT_TIME_DISPLAY": None,
-        "STOP_DURATION_MINUTES": 0.0, # Añadido para consistencia
-        "STOP_DURATION_TIMEDELTA": timedelta(seconds=0), # Añadido para consistencia
-        "EN_SEDE_FLAG": False, # Añadido para consistencia
-        "EN_RESGUARDO_SECUNDARIO_FLAG": False, # Añadido para consistencia
-        "EN_VERTEDERO_FLAG": False, # NUEVO FLAG
-        "EN_FUERA_PERIMETRO_FLAG": False, # NUEVO FLAG
-        "ES_FALLA_GPS_FLAG": False # Añadido para consistencia
-    }])
-
-# FUNCIÓN DE OBTENCIÓN Y FILTRADO DE DATOS DINÁMICA (TTL de 5 segundos)
-# Se usan los argumentos gps_min_encendida y gps_min_apagada para que la función sepa cuándo refrescar el caché.
-@st.cache_data(ttl=5)
+    return construir_frame_en_vivo({
+        "UNIDAD": ["FALLBACK"],
+        "UNIT_ID": ["FALLBACK_ID"],
+        "ESTADO": [ESTADO_SIN_DATOS],
+        "VELOCIDAD": [0.0],
+        "LATITUD": [0.0],
+        "LONGITUD": [0.0],
+        "SENTIDO": [0.0],
+        "UBICACION_TEXTO": [f"FALLBACK - {error_type}"],
+        "FALLA_GPS_MOTIVO": [None],
+        "LAST_REPORT_TIME_DISPLAY": [None],
+        "STOP_DURATION_MINUTES": [0.0], # Añadido para consistencia
+        "EN_SEDE_FLAG": [False], # Añadido para consistencia
+        "EN_RESGUARDO_SECUNDARIO_FLAG": [False], # Añadido para consistencia
+        "EN_VERTEDERO_FLAG": [False], # NUEVO FLAG
+        "EN_FUERA_PERIMETRO_FLAG": [False], # NUEVO FLAG
+        "ES_FALLA_GPS_FLAG": [False] # Añadido para consistencia
+    })
+
+def construir_frame_en_vivo(columnas: Dict[str, list]) -> pd.DataFrame:
+    """Arma el DataFrame en vivo a partir de columnas (listas) y aplica los tipos compactos de TIPOS_COLUMNAS_EN_VIVO."""
+    df = pd.DataFrame(columnas).astype(TIPOS_COLUMNAS_EN_VIVO)
+    df.attrs['indices_estado'] = calcular_indices_estado(df)
+    return df
+
+def calcular_indices_estado(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Posiciones (np.flatnonzero) de las unidades en cada estado, calculadas una sola vez al clasificar.
+    Los filtros del sidebar y las métricas de la flota consultan estos índices en lugar de re-escanear el DataFrame.
+    """
+    estado = df['ESTADO'].to_numpy()
+    en_sede = df['EN_SEDE_FLAG'].to_numpy()
+    en_resguardo = df['EN_RESGUARDO_SECUNDARIO_FLAG'].to_numpy()
+    en_vertedero = df['EN_VERTEDERO_FLAG'].to_numpy()
+    fuera_perimetro = df['EN_FUERA_PERIMETRO_FLAG'].to_numpy()
+    falla_gps = df['ES_FALLA_GPS_FLAG'].to_numpy()
+
+    return {
+        "encendidas": np.flatnonzero((estado == ESTADO_ENCENDIDA) | (estado == ESTADO_ENCENDIDA_SEDE)),
+        "apagadas": np.flatnonzero(estado == ESTADO_APAGADA),
+        "sede": np.flatnonzero(en_sede),
+        "resguardo_fuera_sede": np.flatnonzero(en_resguardo),
+        "vertedero": np.flatnonzero(en_vertedero),
+        "fuera_perimetro": np.flatnonzero(fuera_perimetro),
+        "falla_gps": np.flatnonzero(falla_gps),
+        # En ruta: NO está en sede, NO en resguardo secundario, NO en vertedero, NO en perímetro, NO es Falla GPS
+        "en_ruta": np.flatnonzero(~(en_sede | en_resguardo | en_vertedero | fuera_perimetro | falla_gps)),
+    }
+
+def agregar_indice_paradas_largas(df: pd.DataFrame, stop_threshold_minutes: float) -> None:
+    """Completa los índices con las Paradas Largas, que dependen de la duración calculada en el bucle de doble verificación."""
+    indices = df.attrs['indices_estado']
+    estado_en_ruta = ~np.isin(df['ESTADO'].to_numpy(), ESTADOS_EN_BASE_O_EXCLUIDOS)
+    indices["paradas_largas"] = np.flatnonzero(
+        (df['STOP_DURATION_MINUTES'].to_numpy() > stop_threshold_minutes) &
+        (df['VELOCIDAD'].to_numpy() < 1.0) &
+        estado_en_ruta
+    )
+
+# Opción del radio de filtros -> clave del índice precalculado
+INDICE_POR_FILTRO_ESTADO = {
+    "Vertedero 🚛": "vertedero",
+    "Fuera de Perímetro 🌐": "fuera_perimetro",
+    "Falla GPS 🛠": "falla_gps",
+    "Apagadas ❄️": "apagadas",
+    "Paradas Largas 🛑": "paradas_largas",
+    "Resguardo (Sede) 🛡️": "sede",
+    "Resguardo (Fuera de Sede) 🛡️": "resguardo_fuera_sede",
+}
+
+# FUNCIÓN DE OBTENCIÓN DE DATOS (STALE-WHILE-REVALIDATE)
+# La respuesta de la API vive en servicio_flota: se refresca en segundo plano con el intervalo adaptativo de la flota
+# (según su actividad y el presupuesto global de solicitudes) y, si la API está lenta o caída, se sigue mostrando
+# la última respuesta buena (con su edad) en lugar del fallback.
+ESPERA_PRIMERA_CARGA_S = 8        # Solo la primera carga de una flota espera a la API
+EDAD_DATOS_OBSOLETOS_S = 30       # A partir de esta edad se avisa que los datos no están al día
+
+def calcular_resumen_flota(df: pd.DataFrame, flota_data: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Conteos de la flota para otras páginas (servicio_flota.publicar_resumen), a partir de los índices de estado.
+    'ruta_falla' cuenta las unidades con Falla GPS cuya última posición está fuera de la sede y del resguardo.
+    Las cámaras no tienen fuente de datos en la API y no se incluyen.
+    """
+    indices = df.attrs['indices_estado']
+    falla_gps = indices['falla_gps']
+    lat_falla = df['LATITUD'].to_numpy()[falla_gps]
+    lon_falla = df['LONGITUD'].to_numpy()[falla_gps]
+    en_base = (
+        dentro_de_alguna_zona(construir_indice_zonas(flota_data.get("sede_coords", []), PROXIMIDAD_KM_S), lat_falla, lon_falla) |
+        dentro_de_alguna_zona(construir_indice_zonas(flota_data.get("resguardo_secundario_coords", []), PROXIMIDAD_KM_R), lat_falla, lon_falla)
+    )
+    return {
+        "total": len(df),
+        "en_ruta": len(indices['en_ruta']),
+        "en_sede": len(indices['sede']),
+        "encendidas": len(indices['encendidas']),
+        "apagadas": len(indices['apagadas']),
+        "falla_gps": len(falla_gps),
+        "ruta_falla": int((~en_base).sum()),
+    }
+
+# "Toda Flota" (FLOTA_AGREGADA) se consulta por partes: una solicitud por flota real, clasificada con la configuración
+# (sede, vertedero, perímetro) de esa flota, y los resultados se unen en una sola vista
+@st.cache_data(ttl=None, show_spinner=False)
+def particionar_flota_agregada(nombre_flota: str, config: Dict[str, Any]) -> List[tuple]:
+    """[(flota, ids, clave de instantánea), ...] de la flota agregada (ver precalentamiento_flotas)."""
+    return partes_flota_agregada(nombre_flota, {flota: datos["ids"] for flota, datos in config.items()})
+
+def solicitudes_por_refresco_flota(nombre_flota: str, config: Dict[str, Any]) -> int:
+    """Solicitudes a la API de un refresco de la flota: las páginas de buscar_unidades de cada parte."""
+    if nombre_flota == FLOTA_AGREGADA:
+        return sum(solicitudes_busqueda_unidades(ids_grupo) for _, ids_grupo, _ in particionar_flota_agregada(nombre_flota, config))
+    return solicitudes_busqueda_unidades(config[nombre_flota]["ids"])
+
+def obtener_datos_flota_agregada(nombre_flota: str, config: Dict[str, Any], gps_min_encendida: int, gps_min_apagada: int):
+    """
+    Consulta en paralelo cada flota real de la flota agregada (cada una con su propia instantánea,
+    latencia y errores) y une las flotas que tengan datos; una flota caída no tumba a las demás.
+    """
+    partes = particionar_flota_agregada(nombre_flota, config)
+    intervalo = intervalo_refresco(nombre_flota)
+    # Las partes que son una flota real completa comparten la instantánea (y el precalentamiento) de esa flota
+    consultas = {
+        flota_grupo: (clave, functools.partial(consultar_unidades, ids_grupo, BASIC_AUTH_HEADER))
+        for flota_grupo, ids_grupo, clave in partes
+    }
+
+    # 1. Lanzar todos los refrescos sin esperar; 2. esperar (solo en la primera carga) con un plazo común
+    for clave, consulta in consultas.values():
+        obtener_snapshot(clave, consulta, intervalo, 0)
+    plazo = time.monotonic() + ESPERA_PRIMERA_CARGA_S
+
+    frames = []
+    flotas_sin_datos = []
+    edad_datos_s = 0.0
+    errores = []
+    for flota_grupo, (clave, consulta) in consultas.items():
+        snapshot = obtener_snapshot(clave, consulta, intervalo, max(0.0, plazo - time.monotonic()))
+        if snapshot["error"]:
+            errores.append(f"{flota_grupo}: {snapshot['error']}")
+        if snapshot["datos"] is None:
+            flotas_sin_datos.append(flota_grupo)
+            continue
+        df_grupo = clasificar_unidades(flota_grupo, config, snapshot["datos"], snapshot["marca"], gps_min_encendida, gps_min_apagada)
+        if "FALLBACK" in df_grupo["UNIDAD"].iloc[0]:
+            flotas_sin_datos.append(flota_grupo)
+            continue
+        frames.append(df_grupo)
+        edad_datos_s = max(edad_datos_s, snapshot["edad_s"])
+        if clave == flota_grupo:
+            # La parte es la flota real completa: su resumen sirve también a las demás páginas
+            publicar_resumen(flota_grupo, calcular_resumen_flota(df_grupo, config[flota_grupo]), snapshot["marca"])
+
+    if not frames:
+        print(f"❌ Error de Conexión/API ({nombre_flota}): {'; '.join(errores) or 'Sin respuesta en la primera carga'}")
+        return get_fallback_data("Error de Conexión/API")
+
+    # Mismo orden que la consulta única (orderby name) y los índices de estado recalculados sobre la unión
+    df = pd.concat(frames, ignore_index=True).sort_values('UNIDAD', kind='stable', ignore_index=True)
+    df.attrs = {'indices_estado': calcular_indices_estado(df)}
+    df.attrs['edad_datos_s'] = edad_datos_s
+    df.attrs['error_refresco'] = '; '.join(errores) or None
+    df.attrs['flotas_sin_datos'] = flotas_sin_datos
+    publicar_resumen(nombre_flota, calcular_resumen_flota(df, config[nombre_flota]), time.time() - edad_datos_s)
+    return df
+
 def obtener_datos_unidades(nombre_flota: str, config: Dict[str, Any], gps_min_encendida: int, gps_min_apagada: int):
-    """Obtiene y limpia los datos de la API, aplicando la lógica de color por estado/sede, incluyendo Falla GPS."""
+    """Última instantánea de la flota ya clasificada; nunca bloquea más que la primera carga."""
 
     flota_data = config.get(nombre_flota)
     if not flota_data:
         # Esto no debería pasar si la lógica de selección en el sidebar es correcta
         return get_fallback_data("Configuración de Flota No Encontrada")
 
+    if nombre_flota == FLOTA_AGREGADA:
+        return obtener_datos_flota_agregada(nombre_flota, config, gps_min_encendida, gps_min_apagada)
+
+    if not flota_data.get("sede_coords", []):
+        return get_fallback_data("Error de Configuración: 'sede_coords' vacía.")
+
+    # Sesión keep-alive compartida (timeout 5 s, reintentos y circuito en foresight_api)
+    snapshot = obtener_snapshot(
+        nombre_flota,
+        functools.partial(consultar_unidades, flota_data["ids"], BASIC_AUTH_HEADER),
+        intervalo_refresco(nombre_flota),
+        ESPERA_PRIMERA_CARGA_S,
+    )
+
+    if snapshot["datos"] is None:
+        # Sin ninguna respuesta buena todavía: único caso en que se muestra el fallback
+        print(f"❌ Error de Conexión/API: {snapshot['error'] or 'Sin respuesta en la primera carga'}")
+        return get_fallback_data("Error de Conexión/API")
+
+    df = clasificar_unidades(nombre_flota, config, snapshot["datos"], snapshot["marca"], gps_min_encendida, gps_min_apagada)
+    df.attrs['edad_datos_s'] = snapshot["edad_s"]
+    df.attrs['error_refresco'] = snapshot["error"]
+    if "FALLBACK" not in df["UNIDAD"].iloc[0]:
+        publicar_resumen(nombre_flota, calcular_resumen_flota(df, flota_data), snapshot["marca"])
+    return df
+
+# La clasificación solo se repite cuando llega una instantánea nueva (marca_snapshot) o cambian los parámetros
+@st.cache_data(ttl=None, max_entries=32, show_spinner=False)
+def clasificar_unidades(nombre_flota: str, config: Dict[str, Any], _lista_unidades: List[Dict[str, Any]],
+                        marca_snapshot: float, gps_min_encendida: int, gps_min_apagada: int):
+    """Limpia la respuesta de la API, aplicando la lógica de color por estado/sede, incluyendo Falla GPS."""
+
+    flota_data = config.get(nombre_flota)
+    lista_unidades = _lista_unidades
+
     # 🚨 OBTENCIÓN DE COORDENADAS DE UBICACIONES DINÁMICAS DESDE EL JSON 🚨
     # Todas son listas de listas de [lat, lon]
     SEDE_COORDS = flota_data.get("sede_coords", [])
@@ -2400,7 +2637,7 @@ def obtener_datos_unidades(nombre_flota: str, config: Dict[str, Any], gps_min_en
         # Fallback: intentar cargar directamente
         try:
             with open(archivo_perimetro_path, 'r', encoding='utf-8') as f:
-                perimetro_data = json.load(f)
+                perimetro_data = cargar_json(f)
                 # Extraer coordenadas del GeoJSON
                 if 'features' in perimetro_data and len(perimetro_data['features']) > 0:
                     geometry = perimetro_data['features'][0].get('geometry', {})
@@ -2421,251 +2658,181 @@ def obtener_datos_unidades(nombre_flota: str, config: Dict[str, Any], gps_min_en
     else:
         print(f"🔍 Verificación de perímetro DESHABILITADA para {nombre_flota} (funcionamiento normal)")
 
-    if not SEDE_COORDS:
-        return get_fallback_data("Error de Configuración: 'sede_coords' vacía.")
-
-    # Aseguramos un tamaño de página suficiente para todos los IDs
-    payload = {
-        "userid": "86946",
-        "requesttype": 0,
-        "isdeleted": 0,
-        "pageindex": 1,
-        "orderby": "name",
-        "orderdirection": "ASC",
-        "conncode": "SATEQSA",
-        "elements": 1,
-        "ids": flota_data["ids"],
-        "method": "usersearchplatform",
-        "pagesize": len(flota_data["ids"].split(',')) + 5,
-        "prefix": True
-    }
-
-    try:
-        response = requests.post(API_URL, json=payload, headers=HEADERS, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-
-        lista_unidades = data.get("ForesightFlexAPI", {}).get("DATA", [])
-
-        if not lista_unidades:
-            return get_fallback_data("Lista de Unidades Vacía (Revisa IDs)")
-
-        hora_actual_ve = obtener_hora_venezuela()
+    if not lista_unidades:
+        return get_fallback_data("Lista de Unidades Vacía (Revisa IDs)")
 
-        # PROCESAMIENTO DE DATOS REALES
-        datos_filtrados = []
-        for unidad in lista_unidades:
+    # La Falla GPS se evalúa a la hora de la respuesta: una instantánea vieja se muestra tal como llegó
+    hora_actual_ve = datetime.fromtimestamp(marca_snapshot, VENEZUELA_TZ)
 
-            # 1. APLICAR LÓGICA DE FALLA GPS CON PARÁMETROS DINÁMICOS
-            unidad_con_falla_check = verificar_falla_gps(unidad, hora_actual_ve, gps_min_encendida, gps_min_apagada)
+    # PROCESAMIENTO DE DATOS REALES (acumulación por columnas, sin un dict por fila)
+    columnas = {nombre_columna: [] for nombre_columna in (
+        "UNIDAD", "UNIT_ID", "ESTADO", "VELOCIDAD", "LATITUD", "LONGITUD", "SENTIDO", "UBICACION_TEXTO",
+        "FALLA_GPS_MOTIVO", "LAST_REPORT_TIME_DISPLAY", "STOP_DURATION_MINUTES", "EN_SEDE_FLAG",
+        "EN_RESGUARDO_SECUNDARIO_FLAG", "EN_VERTEDERO_FLAG", "EN_FUERA_PERIMETRO_FLAG", "ES_FALLA_GPS_FLAG")}
 
-            es_falla_gps = unidad_con_falla_check.get('Estado_Falla_GPS', False)
+    # 1. LÓGICA DE FALLA GPS CON PARÁMETROS DINÁMICOS (toda la flota de una vez, sin mutar la respuesta)
+    textos_reporte = [unidad.get('LastReportTime') for unidad in lista_unidades]
+    ignicion_flota = np.array([unidad.get("ignition", "false").lower() == "true" for unidad in lista_unidades], dtype=bool)
+    fallas_gps, minutos_sin_reportar = detectar_fallas_gps(
+        textos_reporte, ignicion_flota, hora_actual_ve, gps_min_encendida, gps_min_apagada
+    )
 
-            # Extracción y limpieza de datos
-            ignicion_raw = unidad_con_falla_check.get("ignition", "false").lower()
-            # Uso de float() con valor por defecto seguro
-            velocidad = float(unidad_con_falla_check.get("speed_dunit", 0.0))
-            lat = float(unidad_con_falla_check.get("ylat", 0.0))
-            lon = float(unidad_con_falla_check.get("xlong", 0.0))
-            sentido = float(unidad_con_falla_check.get("heading", 0.0))
-            # unit_id debe ser único, usamos unitid o name como fallback
-            unit_id = unidad_con_falla_check.get("unitid", unidad_con_falla_check.get("name", "N/A_ID_FALLBACK"))
+    # 2. PROXIMIDAD A UBICACIONES DINÁMICAS (índice espacial, una consulta por tipo de zona para toda la flota)
+    lat_flota = np.array([float(unidad.get("ylat", 0.0)) for unidad in lista_unidades], dtype=np.float64)
+    lon_flota = np.array([float(unidad.get("xlong", 0.0)) for unidad in lista_unidades], dtype=np.float64)
+    # Prioridad: Vertedero > Sede > Resguardo Secundario; las unidades con Falla GPS no cuentan en ninguna
+    en_vertedero_flota = ~fallas_gps & dentro_de_alguna_zona(
+        construir_indice_zonas(COORDENADAS_VERTEDERO, PROXIMIDAD_KM_V), lat_flota, lon_flota)
+    en_sede_flota = ~fallas_gps & ~en_vertedero_flota & dentro_de_alguna_zona(
+        construir_indice_zonas(SEDE_COORDS, PROXIMIDAD_KM_S), lat_flota, lon_flota)
+    en_resguardo_flota = ~fallas_gps & ~en_vertedero_flota & ~en_sede_flota & dentro_de_alguna_zona(
+        construir_indice_zonas(COORDENADAS_RESGUARDO_SECUNDARIO, PROXIMIDAD_KM_R), lat_flota, lon_flota)
+
+    for posicion, unidad_con_falla_check in enumerate(lista_unidades):
+
+        es_falla_gps = bool(fallas_gps[posicion])
+
+        # Extracción y limpieza de datos
+        # Uso de float() con valor por defecto seguro
+        velocidad = float(unidad_con_falla_check.get("speed_dunit", 0.0))
+        lat = lat_flota[posicion]
+        lon = lon_flota[posicion]
+        sentido = float(unidad_con_falla_check.get("heading", 0.0))
+        # unit_id debe ser único, usamos unitid o name como fallback
+        unit_id = unidad_con_falla_check.get("unitid", unidad_con_falla_check.get("name", "N/A_ID_FALLBACK"))
+
+        ignicion_estado = bool(ignicion_flota[posicion])
+
+        falla_gps_motivo = None
+        last_report_time_display = unidad_con_falla_check.get('LastReportTime', 'N/A')
+
+        if es_falla_gps:
+            # Caso Falla GPS: Sobrescribe el estado (y por lo tanto el estilo)
+            estado_final = ESTADO_FALLA_GPS
+            falla_gps_motivo = construir_motivo_falla_gps(
+                minutos_sin_reportar[posicion], ignicion_estado, gps_min_encendida, gps_min_apagada
+            )
 
-            ignicion_estado = ignicion_raw == "true"
+            # Para fines de métricas, marcamos el tipo de resguardo como NINGUNO
+            en_sede = False
+            en_resguardo_secundario = False
+            en_vertedero = False # ¡NUEVO FLAG!
+            en_fuera_perimetro = False
 
-            falla_gps_motivo = None
-            last_report_time_display = unidad_con_falla_check.get('LastReportTime', 'N/A')
+        else:
+            # UBICACIONES DINÁMICAS (ya resueltas en lote con el índice espacial, con su prioridad)
+            en_vertedero = bool(en_vertedero_flota[posicion])
+            en_sede = bool(en_sede_flota[posicion])
+            en_resguardo_secundario = bool(en_resguardo_flota[posicion])
 
-            if es_falla_gps:
-                # Caso Falla GPS: Sobrescribe el estado y estilo
-                estado_final_display = unidad_con_falla_check['IGNICION_OVERRIDE']
-                card_style = unidad_con_falla_check['CARD_STYLE_OVERRIDE']
-                falla_gps_motivo = unidad_con_falla_check.get('FALLA_GPS_MOTIVO')
-                last_report_time_display = unidad_con_falla_check.get('LAST_REPORT_TIME_FOR_DETAIL', last_report_time_display)
+            # LÓGICA DE ESTADO FINAL (código entero; la etiqueta y el color se resuelven al renderizar)
 
-                # Para fines de métricas, marcamos el tipo de resguardo como NINGUNO
-                en_sede = False
-                en_resguardo_secundario = False
-                en_vertedero = False # ¡NUEVO FLAG!
+            estado_final = ESTADO_APAGADA
+            en_fuera_perimetro = False  # Inicializar flag de fuera de perímetro
 
-            else:
-                # CÁLCULO DE DISTANCIA A UBICACIONES DINÁMICAS
-
-                # 1. ¿Está en el VERTEDERO? (Máxima Prioridad Operacional)
-                en_vertedero = False
-                for vertedero_coords in COORDENADAS_VERTEDERO:
-                    v_lat, v_lon = vertedero_coords
-                    distancia = haversine(lat, lon, v_lat, v_lon)
-                    if distancia <= PROXIMIDAD_KM_V:
-                        en_vertedero = True
-                        break
+            if en_vertedero:
+                estado_final = ESTADO_VERTEDERO
 
-                # 2. ¿Está en la SEDE? (Revisar solo si NO está en Vertedero)
-                en_sede = False
-                if not en_vertedero:
-                    for sede_coords in SEDE_COORDS:
-                        lat_sede, lon_sede = sede_coords
-                        distancia = haversine(lat, lon, lat_sede, lon_sede)
-                        if distancia <= PROXIMIDAD_KM_S:
-                            en_sede = True
-                            break
-
-                # 3. ¿Está en Resguardo Secundario? (Revisar solo si NO está en Vertedero ni Sede)
-                en_resguardo_secundario = False
-                if not en_vertedero and not en_sede and COORDENADAS_RESGUARDO_SECUNDARIO:
-                    for resguardo_coords in COORDENADAS_RESGUARDO_SECUNDARIO:
-                        lat_res, lon_res = resguardo_coords
-                        distancia_resguardo = haversine(lat, lon, lat_res, lon_res)
-                        if distancia_resguardo <= PROXIMIDAD_KM_R:
-                            en_resguardo_secundario = True
-                            break
-
-                # LÓGICA DE ESTADO FINAL
-
-                estado_final_display = "Apagada ❄️"
-                color_fondo = "#D32F2F"
-                color_texto = "white"
-                en_fuera_perimetro = False  # Inicializar flag de fuera de perímetro
-
-                if en_vertedero:
-                    estado_final_display = "Vertedero 🚛";
-                    color_fondo = "#FCC6BB"
-                    color_texto = "white"
-
-                elif ignicion_estado:
-                    if en_sede:
-                        estado_final_display = "Encendida (Sede) 🔥";
-                        color_fondo = "#B37305"
-                        color_texto = "white"
-                        
-                    else:
-                        estado_final_display = "Encendida 🔥";
-                        color_fondo = "#4CAF50"
-                        color_texto = "white"
-
-                else: # Apagada
-                    if en_sede:
-                        estado_final_display = "Resguardo (Sede) 🛡️";
-                        color_fondo = "#337ab7"
-                        color_texto = "white"
-                        
-                    elif en_resguardo_secundario:
-                        estado_final_display = "Resguardo (Fuera de Sede) 🛡️";
-                        color_fondo = "#191452"
-                    
-                # 4. ¿Está FUERA DE PERÍMETRO? 
-                # Solo verificar si:
-                # - NO está en la lista de excepciones (ids_exep)
-                # - NO está en estado de resguardo (en sede o fuera de sede)  
-                # - NO está en otras ubicaciones críticas como vertedero/sede/resguardo secundario
-                # - Hay perímetro disponible
+            elif ignicion_estado:
+                if en_sede:
+                    estado_final = ESTADO_ENCENDIDA_SEDE
+                else:
+                    estado_final = ESTADO_ENCENDIDA
 
-                en_fuera_perimetro = False
-                perimetros_encontrados = False
-                
-                unit_id = unidad_con_falla_check.get("unitid", unidad_con_falla_check.get("name", "N/A_ID_FALLBACK"))
+            else: # Apagada
+                if en_sede:
+                    estado_final = ESTADO_RESGUARDO_SEDE
+                elif en_resguardo_secundario:
+                    estado_final = ESTADO_RESGUARDO_FUERA_SEDE
                 
-                # EXCEPCIÓN PARA UNIDADES EN ids_exep
-                unit_id_str = str(unit_id).strip()
+            # 4. ¿Está FUERA DE PERÍMETRO? 
+            # Solo verificar si:
+            # - NO está en la lista de excepciones (ids_exep)
+            # - NO está en estado de resguardo (en sede o fuera de sede)  
+            # - NO está en otras ubicaciones críticas como vertedero/sede/resguardo secundario
+            # - Hay perímetro disponible
+
+            en_fuera_perimetro = False
+            perimetros_encontrados = False
+            
+            unit_id = unidad_con_falla_check.get("unitid", unidad_con_falla_check.get("name", "N/A_ID_FALLBACK"))
+            
+            # EXCEPCIÓN PARA UNIDADES EN ids_exep
+            unit_id_str = str(unit_id).strip()
+            
+            # Verificar si la unidad está en la lista de excepciones
+            # Esto funciona para IDs numéricos, alfanuméricos, con espacios, letras, etc.
+            is_exception = False
+            for id_exep in IDS_EXEP:
+                id_exep_str = str(id_exep).strip()
+                # Comparación directa de strings (maneja cualquier tipo de ID)
+                if unit_id_str == id_exep_str:
+                    is_exception = True
+                    break
                 
-                # Verificar si la unidad está en la lista de excepciones
-                # Esto funciona para IDs numéricos, alfanuméricos, con espacios, letras, etc.
-                is_exception = False
-                for id_exep in IDS_EXEP:
-                    id_exep_str = str(id_exep).strip()
-                    # Comparación directa de strings (maneja cualquier tipo de ID)
-                    if unit_id_str == id_exep_str:
+                # Comparación adicional para IDs numéricos (por compatibilidad)
+                if unit_id_str.isdigit() and id_exep_str.isdigit():
+                    if int(unit_id_str) == int(id_exep_str):
                         is_exception = True
                         break
-                    
-                    # Comparación adicional para IDs numéricos (por compatibilidad)
-                    if unit_id_str.isdigit() and id_exep_str.isdigit():
-                        if int(unit_id_str) == int(id_exep_str):
-                            is_exception = True
-                            break
+            
+            # VERIFICACIÓN DE FUERA DE PERÍMETRO
+            # Solo verificar si:
+            # 1. Hay perímetro disponible 
+            # 2. La unidad NO está en la lista de excepciones
+            # 3. La unidad NO está en estado de resguardo (en sede o fuera de sede)
+            en_fuera_perimetro = False
+            
+            if tiene_perimetro and not is_exception and not (en_sede or en_resguardo_secundario):
+                # Verificar si está dentro del perímetro principal
+                if coordenadas_perimetro and len(coordenadas_perimetro) >= 3:
+                    if es_punto_dentro_perimetro(lat, lon, coordenadas_perimetro):
+                        en_fuera_perimetro = False
+                    else:
+                        en_fuera_perimetro = True
                 
-                # VERIFICACIÓN DE FUERA DE PERÍMETRO
-                # Solo verificar si:
-                # 1. Hay perímetro disponible 
-                # 2. La unidad NO está en la lista de excepciones
-                # 3. La unidad NO está en estado de resguardo (en sede o fuera de sede)
+                # También verificar perímetros secundarios (si la unidad está en sede/vertedero/resguardo)
+                if (en_sede or en_vertedero or en_resguardo_secundario) and nombre_flota in PERIMETROS_CARGADOS:
+                    perimetros_encontrados = verificar_coordenada_en_perimetro(lat, lon, {nombre_flota: PERIMETROS_CARGADOS[nombre_flota]})
+                    if perimetros_encontrados:
+                        en_fuera_perimetro = False
+            
+            # SI NO hay perímetro o es excepción, nunca se marca como fuera de perímetro
+            if not tiene_perimetro or is_exception:
                 en_fuera_perimetro = False
-                
-                if tiene_perimetro and not is_exception and not (en_sede or en_resguardo_secundario):
-                    # Verificar si está dentro del perímetro principal
-                    if coordenadas_perimetro and len(coordenadas_perimetro) >= 3:
-                        if es_punto_dentro_perimetro(lat, lon, coordenadas_perimetro):
-                            en_fuera_perimetro = False
-                        else:
-                            en_fuera_perimetro = True
-                    
-                    # También verificar perímetros secundarios (si la unidad está en sede/vertedero/resguardo)
-                    if (en_sede or en_vertedero or en_resguardo_secundario) and nombre_flota in PERIMETROS_CARGADOS:
-                        perimetros_encontrados = verificar_coordenada_en_perimetro(lat, lon, {nombre_flota: PERIMETROS_CARGADOS[nombre_flota]})
-                        if perimetros_encontrados:
-                            en_fuera_perimetro = False
-                
-                # SI NO hay perímetro o es excepción, nunca se marca como fuera de perímetro
-                if not tiene_perimetro or is_exception:
-                    en_fuera_perimetro = False
-                                
-                if en_fuera_perimetro:
-                    # Solo se marca como fuera de perímetro si:
-                    # 1) Hay perímetro disponible 
-                    # 2) La unidad no está en la lista de excepciones
-                    # 3) La verificación confirma que está fuera del perímetro
-                    print(f"⚠️ FUERA DE PERÍMETRO - Unidad: {unidad_con_falla_check.get('name', 'N/A')} | unit_id: {unit_id} | confirmado fuera del perímetro")
-                    estado_final_display = "Fuera de Perímetro 🌐"
-                    color_fondo = "#7627F5"
-                    color_texto = "white"
-                #else:
-                    #print(f"✅ DENTRO DE PERÍMETRO - Unidad: {unidad_con_falla_check.get('name', 'N/A')} | unit_id: {unit_id} | dentro del perímetro o sin verificación")
-
-                # 🔊 DETECCIÓN DE CAMBIO DE ESTADO A ENCENDIDO 🔊
-                # Solo procesar si no es Falla GPS y tiene unit_id
-                if not es_falla_gps and unit_id:
-                    estado_anterior = st.session_state['unidades_estado_anterior'].get(unit_id, "")
-                    
-                    # Verificar si hay cambio de resguardo externo a encendido
-                    if detectar_cambio_a_encendido(unit_id, estado_final_display, estado_anterior):
-                        st.session_state['reproducir_audio_encendido'] = True
-                        print(f"🔊 Cambio detectado: Unidad {unit_id} cambió de resguardo externo a encendido")
-                    
-                    # Actualizar el estado anterior para la próxima verificación
-                    st.session_state['unidades_estado_anterior'][unit_id] = estado_final_display
-
-                card_style = f"background-color: {color_fondo}; padding: 15px; border-radius: 5px; color: {color_texto}; margin-bottom: 0px;"
-
-            datos_filtrados.append({
-                "UNIDAD": unidad_con_falla_check.get("name", "N/A"),
-                "UNIT_ID": unit_id,
-                "IGNICION": estado_final_display,
-                "VELOCIDAD": velocidad,
-                "LATITUD": lat,
-                "LONGITUD": lon,
-                "SENTIDO": sentido,
-                "UBICACION_TEXTO": unidad_con_falla_check.get("location", "Dirección no disponible"),
-                "CARD_STYLE": card_style,
-                "FALLA_GPS_MOTIVO": falla_gps_motivo,
-                "LAST_REPORT_TIME_DISPLAY": last_report_time_display,
-                "STOP_DURATION_MINUTES": 0.0, # Inicializado para el DataFrame
-                "STOP_DURATION_TIMEDELTA": timedelta(seconds=0), # Inicializado para el DataFrame
-                # NUEVAS COLUMNAS PARA MÉTRICAS (incluido Vertedero)
-                "EN_SEDE_FLAG": en_sede,
-                "EN_RESGUARDO_SECUNDARIO_FLAG": en_resguardo_secundario,
-                "EN_VERTEDERO_FLAG": en_vertedero, # ¡NUEVO FLAG!
-                "EN_FUERA_PERIMETRO_FLAG": en_fuera_perimetro if 'en_fuera_perimetro' in locals() else False, # ¡NUEVO FLAG!
-                "ES_FALLA_GPS_FLAG": es_falla_gps
-            })
-
-        # El DataFrame se devuelve con las columnas inicializadas
-        return pd.DataFrame(datos_filtrados)
-
-    except requests.exceptions.RequestException as e:
-        #error_msg = f"API Error: {e}" if not hasattr(e, 'response') else f"HTTP Error: {e.response.status_code}"
-        error_msg = f"API Error: {e}" if not (hasattr(e, 'response') and e.response is not None) else f"HTTP Error: {e.response.status_code}"
-        print(f"❌ Error de Conexión/API: {error_msg}")
-        return get_fallback_data("Error de Conexión/API")
+                            
+            if en_fuera_perimetro:
+                # Solo se marca como fuera de perímetro si:
+                # 1) Hay perímetro disponible 
+                # 2) La unidad no está en la lista de excepciones
+                # 3) La verificación confirma que está fuera del perímetro
+                print(f"⚠️ FUERA DE PERÍMETRO - Unidad: {unidad_con_falla_check.get('name', 'N/A')} | unit_id: {unit_id} | confirmado fuera del perímetro")
+                estado_final = ESTADO_FUERA_PERIMETRO
+            #else:
+                #print(f"✅ DENTRO DE PERÍMETRO - Unidad: {unidad_con_falla_check.get('name', 'N/A')} | unit_id: {unit_id} | dentro del perímetro o sin verificación")
+
+            # (La detección de cambio a encendido se hace en el bucle principal: depende del estado de la sesión)
+
+        columnas["UNIDAD"].append(unidad_con_falla_check.get("name", "N/A"))
+        columnas["UNIT_ID"].append(unit_id)
+        columnas["ESTADO"].append(estado_final)
+        columnas["VELOCIDAD"].append(velocidad)
+        columnas["LATITUD"].append(lat)
+        columnas["LONGITUD"].append(lon)
+        columnas["SENTIDO"].append(sentido)
+        columnas["UBICACION_TEXTO"].append(unidad_con_falla_check.get("location", "Dirección no disponible"))
+        columnas["FALLA_GPS_MOTIVO"].append(falla_gps_motivo)
+        columnas["LAST_REPORT_TIME_DISPLAY"].append(last_report_time_display)
+        columnas["STOP_DURATION_MINUTES"].append(0.0) # Inicializado para el DataFrame
+        # NUEVAS COLUMNAS PARA MÉTRICAS (incluido Vertedero)
+        columnas["EN_SEDE_FLAG"].append(en_sede)
+        columnas["EN_RESGUARDO_SECUNDARIO_FLAG"].append(en_resguardo_secundario)
+        columnas["EN_VERTEDERO_FLAG"].append(en_vertedero) # ¡NUEVO FLAG!
+        columnas["EN_FUERA_PERIMETRO_FLAG"].append(en_fuera_perimetro) # ¡NUEVO FLAG!
+        columnas["ES_FALLA_GPS_FLAG"].append(es_falla_gps)
+
+    # El DataFrame se devuelve con las columnas inicializadas y tipos compactos
+    return construir_frame_en_vivo(columnas)
 
 # FUNCIÓN PARA MOSTRAR LA LEYENDA DE COLORES EN EL SIDEBAR
 def display_color_legend():
@@ -2726,19 +2893,14 @@ def save_dynamic_config():
     st.toast("✅ Configuración guardada y aplicada!", icon='💾')
 
 # CALLBACK PARA SELECCIONAR LA UNIDAD A UBICAR (NUEVO)
-def set_unit_to_locate(unit_id):
+def set_unit_to_locate():
     """
-    Callback para establecer la UNIT_ID en el estado de sesión.
-    Si se hace clic en la misma unidad, la deselecciona (toggle).
+    Callback del selector único de ubicación: establece la UNIT_ID elegida en el estado de sesión.
+    Elegir la opción vacía deselecciona la unidad.
     """
-    current_selected = st.session_state.get('unit_to_locate_id')
-    if current_selected == unit_id:
-        st.session_state['unit_to_locate_id'] = None
-        st.cache_data.clear()
-    else:
-        st.session_state['unit_to_locate_id'] = unit_id
+    st.session_state['unit_to_locate_id'] = st.session_state.get('selector_unidad_mapa')
     # Es crucial limpiar la caché para forzar el re-renderizado
-        st.cache_data.clear()
+    st.cache_data.clear()
 
 # CALLBACK PARA DESELECCIONAR LA UNIDAD A UBICAR (NUEVO)
 def clear_unit_to_locate():
@@ -2748,54 +2910,26 @@ def clear_unit_to_locate():
     """
     # 1. Lógica de limpieza de estado y caché
     st.session_state['unit_to_locate_id'] = None
+    st.session_state['selector_unidad_mapa'] = None
     st.cache_data.clear()
         
     # 2. ✅ NUEVA ACCIÓN: Establecer el indicador de scroll
     st.session_state['scroll_to_top_flag'] = True
 
 # 🚨 NUEVAS FUNCIONES PARA CONTROL AVANZADO DE AUDIO DE PERÍMETRO 🚨
-def limpiar_alarmas_perimetro_expiradas():
-    """
-    Limpia las alarmas de perímetro que han expirado (más de 15 minutos desde la aceptación).
-    """
-    if not st.session_state.get('perimetro_unidades_aceptadas'):
-        return
-    
-    hora_actual = obtener_hora_venezuela()
-    unidades_para_limpiar = []
-    
-    for unidad_id, tiempo_aceptacion in st.session_state['perimetro_unidades_aceptadas'].items():
-        # Verificar si han pasado más de 15 minutos (TIEMPO_SILENCIO_PERIMETRO)
-        if isinstance(tiempo_aceptacion, datetime):
-            diferencia = hora_actual - tiempo_aceptacion
-            if diferencia.total_seconds() >= (TIEMPO_SILENCIO_PERIMETRO * 60):  # Convertir minutos a segundos
-                unidades_para_limpiar.append(unidad_id)
-                # También remover de alertas descartadas para permitir nueva alarma
-                if unidad_id in st.session_state['alertas_perimetro_descartadas']:
-                    del st.session_state['alertas_perimetro_descartadas'][unidad_id]
-    
-    # Limpiar las expiradas
-    for unidad_id in unidades_para_limpiar:
-        del st.session_state['perimetro_unidades_aceptadas'][unidad_id]
-        print(f"🧹 Alarma de perímetro expirada para unidad {unidad_id}")
-
 def aceptar_alarma_perimetro(unidad_id):
     """
-    Marca una alarma de perímetro como aceptada y registra el tiempo para el silencio de 15 minutos.
+    Marca una alarma de perímetro como aceptada (para toda la flota) con silencio de 15 minutos.
     """
-    st.session_state['alertas_perimetro_descartadas'][unidad_id] = True
-    st.session_state['perimetro_unidades_aceptadas'][unidad_id] = obtener_hora_venezuela()
+    aceptar_alertas(st.session_state['flota_seleccionada'], 'perimetro', [unidad_id], silencio_minutos=TIEMPO_SILENCIO_PERIMETRO)
     st.cache_data.clear()
     print(f"✅ Alarma de perímetro aceptada para unidad {unidad_id} - silencio por 15 minutos")
     
 def aceptar_todas_alarmas_perimetro(unidades_ids):
     """
-    Marca todas las alarmas de perímetro como aceptadas.
+    Marca todas las alarmas de perímetro como aceptadas (para toda la flota).
     """
-    hora_actual = obtener_hora_venezuela()
-    for unidad_id in unidades_ids:
-        st.session_state['alertas_perimetro_descartadas'][unidad_id] = True
-        st.session_state['perimetro_unidades_aceptadas'][unidad_id] = hora_actual
+    aceptar_alertas(st.session_state['flota_seleccionada'], 'perimetro', unidades_ids, silencio_minutos=TIEMPO_SILENCIO_PERIMETRO)
     st.session_state['reproducir_audio_perimetro'] = False
     st.cache_data.clear()
     print(f"✅ {len(unidades_ids)} alarmas de perímetro aceptadas - silencio por 15 minutos")
@@ -2803,17 +2937,11 @@ def aceptar_todas_alarmas_perimetro(unidades_ids):
 # 🔊 FUNCIÓN PARA DETECTAR CAMBIO DE ESTADO A ENCENDIDO 🔊
 def detectar_cambio_a_encendido(unit_id, estado_actual, estado_anterior):
     """
-    Detecta si una unidad cambió de resguardo externo a encendido.
+    Detecta si una unidad cambió de resguardo externo a encendido (códigos de estado).
     Retorna True si debe reproducirse el audio de encendido.
     """
-    # Verificar si el estado actual es "Encendida" o "Encendida 🔥"
-    estado_actual_encendido = ("Encendida" in estado_actual and "Vertedero" not in estado_actual and "Sede" not in estado_actual)
-    
-    # Verificar si el estado anterior era resguardo externo
-    estado_anterior_resguardo = "Resguardo (Fuera de Sede)" in estado_anterior
-    
-    # Si hay un cambio de resguardo externo a encendido, retornar True
-    return estado_actual_encendido and estado_anterior_resguardo and estado_anterior != "" 
+    # Encendida en ruta (no en sede ni en vertedero) viniendo de Resguardo (Fuera de Sede)
+    return estado_actual == ESTADO_ENCENDIDA and estado_anterior == ESTADO_RESGUARDO_FUERA_SEDE
     
 
 # INICIALIZACIÓN DEL ESTADO DE SESIÓN
@@ -2822,8 +2950,6 @@ if 'flota_seleccionada' not in st.session_state:
     st.session_state['flota_seleccionada'] = None
 if 'ultima_flota_procesada' not in st.session_state:  # 🆕 NUEVO ESTADO PARA DETECTAR CAMBIOS DE FLOTA
     st.session_state['ultima_flota_procesada'] = None
-if 'perimetro_check_counter' not in st.session_state:  # 🆕 NUEVO ESTADO PARA CONTROL DE VERIFICACIÓN CADA 10 SEGUNDOS
-    st.session_state['perimetro_check_counter'] = 0
 if 'filtro_en_ruta' not in st.session_state:
     st.session_state['filtro_en_ruta'] = False
 if 'filtro_estado_especifico' not in st.session_state:
@@ -2842,6 +2968,11 @@ if 'config_params' not in st.session_state:
 # 🚨 NUEVO ESTADO DE SESIÓN PARA LA UNIDAD A UBICAR 🚨
 if 'unit_to_locate_id' not in st.session_state:
     st.session_state['unit_to_locate_id'] = None
+# 📄 ESTADO DE LA PAGINACIÓN DE LA GRILLA
+if 'grid_pagina' not in st.session_state:
+    st.session_state['grid_pagina'] = 1
+if 'grid_paginas_extra' not in st.session_state:
+    st.session_state['grid_paginas_extra'] = 0
 # ------------------------------------------------------------------------------------
 
 # 🚨 FUNCIONES COMPARTIDAS: Almacena el estado globalmente (Shared State) 🚨
@@ -2861,6 +2992,121 @@ def get_global_velocity_state() -> Dict[str, Any]:
     """Retorna un diccionario de estado para tracking de velocidad por unidad."""
     return {}
 
+# 🚨 ACUSES DE ALERTAS COMPARTIDOS: Un operador acepta, toda la flota queda silenciada 🚨
+INTERVALO_LIMPIEZA_ACUSES = 10 # Segundos entre limpiezas de acuses expirados (por flota, no por sesión)
+
+@st.cache_resource(ttl=None)
+def get_global_ack_state() -> Dict[str, Any]:
+    """
+    Retorna el estado global de alertas aceptadas, compartido por todas las sesiones.
+    Estructura: {'acuses': {(flota, tipo): {unidad: expira_en o None}}, 'ultima_limpieza': {flota: epoch}}.
+    Se carga una sola vez desde la tabla 'alertas_aceptadas' para sobrevivir a reinicios.
+    """
+    estado = {'lock': threading.Lock(), 'acuses': {}, 'ultima_limpieza': {}}
+    conn = get_db_connection()
+    if conn is None: return estado
+    try:
+        ahora = time.time()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM alertas_aceptadas WHERE expira_en IS NOT NULL AND expira_en <= ?", (ahora,))
+        conn.commit()
+        cursor.execute("SELECT flota, tipo, unidad, expira_en FROM alertas_aceptadas")
+        for row in cursor.fetchall():
+            estado['acuses'].setdefault((row['flota'], row['tipo']), {})[row['unidad']] = row['expira_en']
+    except Exception as e:
+        print(f"Error al cargar alertas aceptadas: {e}")
+    finally:
+        conn.close()
+    return estado
+
+def aceptar_alertas(flota: str, tipo: str, unidades: List[str], silencio_minutos: float = None):
+    """
+    Registra el acuse de las alertas 'tipo' ('parada', 'velocidad', 'perimetro') para las unidades dadas.
+    Si se indica silencio_minutos, el acuse expira pasado ese tiempo; si no, dura hasta que se libere.
+    """
+    if not flota or not unidades: return
+    ahora = time.time()
+    expira_en = ahora + silencio_minutos * 60 if silencio_minutos else None
+    estado = get_global_ack_state()
+    with estado['lock']:
+        acuses = estado['acuses'].setdefault((flota, tipo), {})
+        for unidad in unidades:
+            acuses[unidad] = expira_en
+    conn = get_db_connection()
+    if conn is None: return
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO alertas_aceptadas (flota, tipo, unidad, aceptada_en, expira_en) VALUES (?, ?, ?, ?, ?)",
+            [(flota, tipo, unidad, ahora, expira_en) for unidad in unidades]
+        )
+        conn.commit()
+    except Exception as e:
+        print(f"Error al guardar alertas aceptadas: {e}")
+    finally:
+        conn.close()
+
+def liberar_alertas(flota: str, tipo: str, unidades: List[str]):
+    """Elimina los acuses de las unidades dadas (p.ej. cuando la unidad vuelve a moverse)."""
+    estado = get_global_ack_state()
+    with estado['lock']:
+        acuses = estado['acuses'].get((flota, tipo), {})
+        liberadas = [unidad for unidad in unidades if acuses.pop(unidad, False) is not False]
+    if not liberadas: return
+    conn = get_db_connection()
+    if conn is None: return
+    try:
+        conn.executemany(
+            "DELETE FROM alertas_aceptadas WHERE flota = ? AND tipo = ? AND unidad = ?",
+            [(flota, tipo, unidad) for unidad in liberadas]
+        )
+        conn.commit()
+    except Exception as e:
+        print(f"Error al liberar alertas aceptadas: {e}")
+    finally:
+        conn.close()
+
+def filtrar_alertas_pendientes(flota: str, tipo: str, unidades) -> List[str]:
+    """Retorna las unidades cuya alerta 'tipo' NO ha sido aceptada (o cuyo silencio ya expiró)."""
+    ahora = time.time()
+    estado = get_global_ack_state()
+    with estado['lock']:
+        acuses = dict(estado['acuses'].get((flota, tipo), {}))
+    return [
+        unidad for unidad in unidades
+        if unidad not in acuses or (acuses[unidad] is not None and acuses[unidad] <= ahora)
+    ]
+
+def limpiar_alarmas_perimetro_expiradas(flota: str):
+    """
+    Limpia los acuses cuyo silencio expiró (p.ej. 15 minutos de perímetro).
+    Se evalúa una sola vez por flota cada INTERVALO_LIMPIEZA_ACUSES, sin importar cuántas sesiones la observan.
+    """
+    ahora = time.time()
+    estado = get_global_ack_state()
+    with estado['lock']:
+        if ahora - estado['ultima_limpieza'].get(flota, 0) < INTERVALO_LIMPIEZA_ACUSES:
+            return
+        estado['ultima_limpieza'][flota] = ahora
+        expiradas = []
+        for (flota_acuse, tipo), acuses in estado['acuses'].items():
+            if flota_acuse != flota: continue
+            for unidad, expira_en in list(acuses.items()):
+                if expira_en is not None and expira_en <= ahora:
+                    del acuses[unidad]
+                    expiradas.append((tipo, unidad))
+    if not expiradas: return
+    conn = get_db_connection()
+    if conn is None: return
+    try:
+        conn.execute("DELETE FROM alertas_aceptadas WHERE flota = ? AND expira_en IS NOT NULL AND expira_en <= ?", (flota, ahora))
+        conn.commit()
+    except Exception as e:
+        print(f"Error al limpiar alertas aceptadas: {e}")
+    finally:
+        conn.close()
+    for tipo, unidad in expiradas:
+        print(f"🧹 Alarma de {tipo} expirada para unidad {unidad} (flota {flota})")
+
 # Inicializar y obtener la referencia al estado global (se ejecuta una sola vez)
 current_stop_state = get_global_stop_state()
 current_coordinate_state = get_global_coordinate_state()
@@ -2868,29 +3114,20 @@ current_velocity_state = get_global_velocity_state()
 # ------------------------------------------------------------------------------------
 
 # El resto de variables deben seguir usando st.session_state ya que son locales a cada usuario.
-if 'alertas_descartadas' not in st.session_state:
-    st.session_state['alertas_descartadas'] = {}
-if 'alertas_velocidad_descartadas' not in st.session_state:
-    st.session_state['alertas_velocidad_descartadas'] = {}
 if 'reproducir_audio_alerta' not in st.session_state:
     st.session_state['reproducir_audio_alerta'] = False
 if 'reproducir_audio_velocidad' not in st.session_state:
     st.session_state['reproducir_audio_velocidad'] = False
 if 'reproducir_audio_perimetro' not in st.session_state:  # 🆕 NUEVO ESTADO PARA AUDIO DE PERÍMETRO
     st.session_state['reproducir_audio_perimetro'] = False
-if 'alertas_perimetro_descartadas' not in st.session_state:  # 🆕 NUEVO ESTADO PARA ALERTAS DE PERÍMETRO DESCARTADAS
-    st.session_state['alertas_perimetro_descartadas'] = {}
 # 🚨 NUEVOS ESTADOS PARA CONTROL AVANZADO DE AUDIO DE PERÍMETRO 🚨
 if 'perimetro_audio_last_play' not in st.session_state:  # Último tiempo de reproducción de audio
     st.session_state['perimetro_audio_last_play'] = None
-if 'perimetro_unidades_aceptadas' not in st.session_state:  # Unidades con alarma aceptada y tiempo de silencio
-    st.session_state['perimetro_unidades_aceptadas'] = {}
 # 🔊 NUEVOS ESTADOS PARA DETECCIÓN DE CAMBIO A ENCENDIDO 🔊
 if 'unidades_estado_anterior' not in st.session_state:  # Estado anterior de cada unidad para detectar cambios
     st.session_state['unidades_estado_anterior'] = {}
 if 'reproducir_audio_encendido' not in st.session_state:  # Bandera para reproducir audio de encendido
     st.session_state['reproducir_audio_encendido'] = False
-    st.session_state['perimetro_unidades_aceptadas'] = {}  # {unidad_id: tiempo_aceptacion}
 if 'perimetro_ultimas_unidades_fuera' not in st.session_state:  # Tracking de unidades fuera de perímetro en ciclo anterior
     st.session_state['perimetro_ultimas_unidades_fuera'] = set()
 
@@ -2904,7 +3141,8 @@ def actualizar_dashboard():
         if st.session_state.get('ultima_flota_procesada') != flota_actual:
             # Detectar cambio de flota y limpiar cache
             st.session_state['ultima_flota_procesada'] = flota_actual
-            st.session_state['perimetro_check_counter'] = 0  # 🆕 RESETEAR CONTADOR DE VERIFICACIÓN
+            st.session_state['unit_to_locate_id'] = None
+            st.session_state['selector_unidad_mapa'] = None  # Las unidades de la flota anterior ya no son opciones válidas
             st.cache_data.clear()
             print(f"🔄 Cambio de flota detectado: limpieza de cache para '{flota_actual}'")
     st.cache_data.clear()
@@ -3187,6 +3425,241 @@ def format_metric_line(label, value=None, value_size="1.5rem", is_header=False,
     return html_content
 
 
+# 🃏 CONSTRUCCIÓN DE LA GRILLA DE TARJETAS COMO UN SOLO BLOQUE HTML 🃏
+CARD_STYLE_PARADA_LARGA = f"background-color: {COLOR_PARADA_LARGA}; padding: 15px; border-radius: 5px; color: black; margin-bottom: 0px;"
+
+def escapar_html_serie(serie: pd.Series) -> pd.Series:
+    """Escapa los caracteres especiales de HTML de una columna de texto (vectorizado)."""
+    return (serie.astype(str)
+            .str.replace('&', '&amp;', regex=False)
+            .str.replace('<', '&lt;', regex=False)
+            .str.replace('>', '&gt;', regex=False)
+            .str.replace('"', '&quot;', regex=False))
+
+def construir_html_tarjetas(df: pd.DataFrame, stop_threshold_minutes: float, speed_threshold_kph: float) -> str:
+    """
+    Construye el HTML de TODAS las tarjetas con operaciones vectorizadas sobre columnas de texto.
+    Un solo st.markdown reemplaza las ~6 llamadas + botón + expander que se hacían por unidad.
+    Misma precedencia que las tarjetas originales: Falla GPS > Parada Larga > Exceso de Velocidad.
+    """
+    if df.empty:
+        return ""
+
+    velocidad = df['VELOCIDAD'].astype(float)
+    stop_duration = df['STOP_DURATION_MINUTES'].astype(float)
+    es_falla = df['ES_FALLA_GPS_FLAG'].astype(bool)
+    fuera_perimetro = df['EN_FUERA_PERIMETRO_FLAG'].astype(bool)
+    is_out_of_hq_status = ~(df['EN_SEDE_FLAG'] | df['EN_RESGUARDO_SECUNDARIO_FLAG'] | df['EN_VERTEDERO_FLAG'] | fuera_perimetro | es_falla)
+
+    es_parada = ~es_falla & (stop_duration > stop_threshold_minutes) & (velocidad < 1.0) & is_out_of_hq_status
+    es_critico = ~es_falla & ~es_parada & (velocidad >= VELOCIDAD_CRITICA_AUDIO)
+    es_alerta = ~es_falla & ~es_parada & ~es_critico & (velocidad >= speed_threshold_kph)
+
+    stop_min_txt = stop_duration.round(0).astype(int).astype(str)
+    estado_display = pd.Series(np.select(
+        [es_parada, es_critico, es_alerta],
+        ["Parada Larga 🛑: " + stop_min_txt + " min", "EXCESO VELOCIDAD CRÍTICO 🚨", "Alerta Velocidad ⚠️"],
+        default=etiquetas_estado(df['ESTADO'])
+    ), index=df.index)
+    card_style = pd.Series(np.where(es_parada, CARD_STYLE_PARADA_LARGA, estilos_tarjeta(df['ESTADO'])), index=df.index)
+    color_velocidad = np.select([es_falla, es_parada, es_critico, es_alerta], ["black", "black", "#D32F2F", "#FF9800"], default="white")
+    final_text_color = pd.Series(np.where(df['EN_VERTEDERO_FLAG'] | es_falla, "black", color_velocidad), index=df.index)
+
+    # Status con emojis (equivalente vectorizado de construir_status_con_emojis)
+    status_display = pd.Series(np.select(
+        [~fuera_perimetro, es_parada, es_critico, es_alerta,
+         estado_display.str.contains("Falla GPS", regex=False),
+         estado_display.str.contains("Encendida", regex=False),
+         estado_display.str.contains("Apagada", regex=False)],
+        ["En Perímetro",
+         '<span style="color: #FFD700;">🛑</span> ' + estado_display,
+         '<span style="color: red;">🛑</span> EXCESO VELOCIDAD CRÍTICO 🚨',
+         '<span style="color: orange;">🛑</span> Alerta Velocidad ⚠️',
+         '<span style="color: gray;">🛑</span> Falla GPS',
+         '<span style="color: green;">🛑</span> Encendida',
+         '<span style="color: red;">🛑</span> Apagada'],
+        default='<span style="color: black;">🛑</span> ' + estado_display
+    ), index=df.index)
+
+    segundos_parado = (stop_duration * 60).clip(lower=0)
+    tiempo_parado_display = (
+        (segundos_parado // 60).astype(int).astype(str) + " min "
+        + (segundos_parado % 60).astype(int).astype(str).str.zfill(2) + " seg"
+    )
+
+    nombre_unidad = escapar_html_serie(df['UNIDAD'].str.split('-').str[0])
+    ubicacion = escapar_html_serie(df['UBICACION_TEXTO'])
+    last_report = escapar_html_serie(df['LAST_REPORT_TIME_DISPLAY'].fillna(''))
+    falla_motivo = df['FALLA_GPS_MOTIVO'].fillna('').astype(str)
+    tiene_motivo = falla_motivo != ''
+
+    bloque_falla = pd.Series(np.where(
+        tiene_motivo,
+        '<div class="tarjeta-falla">🛠 <b>Motivo Falla GPS:</b> ' + escapar_html_serie(falla_motivo)
+        + '<br>🕒 <b>Último Reporte:</b> ' + last_report + '</div>',
+        ''
+    ), index=df.index)
+    bloque_ultimo_reporte = pd.Series(np.where(
+        tiene_motivo, '', '<div>Último Reporte: <b>' + last_report + '</b></div>'
+    ), index=df.index)
+
+    tarjetas = (
+        '<div><div style="' + card_style + '">'
+        + '<p style="text-align: center; margin-bottom: 10px; margin-top: 0px;">'
+        + '<span style="background-color: rgba(0,0,0,0.3); padding: 5px 10px; border-radius: 5px; font-size: 1.5em; font-weight: 900;">'
+        + nombre_unidad + '</span></p>'
+        + '<p style="display: flex; align-items: center; justify-content: center; font-size: 1.9em; font-weight: 900; margin-top: 0px;">'
+        + '📍 <span style="margin-left: 8px; color: ' + final_text_color + ';">' + velocidad.round(0).astype(int).astype(str) + ' Km</span></p>'
+        + '<p style="font-size: 1.0em; margin-top: 0px; opacity: 1.1; text-align: center; margin-bottom: 0px;">' + estado_display + '</p>'
+        + '</div>'
+        + '<details class="tarjeta-detalles"><summary>Detalles ℹ️</summary>'
+        + '<div>Tiempo Parado: <b>' + tiempo_parado_display + '</b></div>'
+        + bloque_falla
+        + '<div>Dirección: <b>' + ubicacion + '</b></div>'
+        + '<div>Sentido: <b>' + df['SENTIDO'].astype(float).round(0).astype(int).astype(str) + '°</b> (Grados)</div>'
+        + '<div>Status: <b>' + status_display + '</b></div>'
+        + bloque_ultimo_reporte
+        + '<div>Coordenadas: (' + df['LONGITUD'].map('{:.4f}'.format) + ', ' + df['LATITUD'].map('{:.4f}'.format) + ')</div>'
+        + '</details></div>'
+    )
+    return '<div class="grid-tarjetas">' + ''.join(tarjetas.tolist()) + '</div>'
+
+
+# 🗺️ MAPA DE FLOTA COMPLETA (todas las unidades, con los colores de get_card_style) 🗺️
+# El código de estado de la columna ESTADO, más un código extra para la superposición de Parada Larga.
+COLORES_ESTADO_MAPA = list(COLORES_ESTADO) + [COLOR_PARADA_LARGA]
+CODIGO_PARADA_LARGA_MAPA = len(COLORES_ESTADO_MAPA) - 1
+
+def codificar_posiciones_flota(df: pd.DataFrame, stop_threshold_minutes: float) -> pd.DataFrame:
+    """
+    Reduce el DataFrame en vivo a columnas compactas para el mapa:
+    n (nombre corto), lon/lat (5 decimales, ~1 m), h (rumbo entero) y e (código de estado).
+    """
+    codigo = df['ESTADO'].astype(np.int8)
+
+    # Misma superposición de Parada Larga que usan las tarjetas
+    is_out_of_hq_status = ~(df['EN_SEDE_FLAG'] | df['EN_RESGUARDO_SECUNDARIO_FLAG'] | df['EN_VERTEDERO_FLAG'] | df['EN_FUERA_PERIMETRO_FLAG'] | df['ES_FALLA_GPS_FLAG'])
+    es_parada = is_out_of_hq_status & (df['STOP_DURATION_MINUTES'] > stop_threshold_minutes) & (df['VELOCIDAD'] < 1.0)
+    codigo = codigo.mask(es_parada, CODIGO_PARADA_LARGA_MAPA)
+
+    return pd.DataFrame({
+        'n': df['UNIDAD'].str.split('-').str[0].to_numpy(),
+        'lon': df['LONGITUD'].astype(float).round(5).to_numpy(),
+        'lat': df['LATITUD'].astype(float).round(5).to_numpy(),
+        'h': df['SENTIDO'].fillna(0).astype(float).round(0).astype(np.int16).to_numpy() % 360,
+        'e': codigo.to_numpy(),
+        'm': (df['VELOCIDAD'] > 1.0).to_numpy(),
+    })
+
+def vista_inicial_mapa_flota(df_mapa: pd.DataFrame) -> pdk.ViewState:
+    """Centra el mapa en la flota y estima el zoom según la extensión de las posiciones."""
+    lat_min, lat_max = df_mapa['lat'].min(), df_mapa['lat'].max()
+    lon_min, lon_max = df_mapa['lon'].min(), df_mapa['lon'].max()
+    extension = max(lat_max - lat_min, lon_max - lon_min, 0.01)
+    zoom = float(np.clip(8 - np.log2(extension / 0.5), 4, 15))
+    return pdk.ViewState(latitude=float((lat_min + lat_max) / 2), longitude=float((lon_min + lon_max) / 2), zoom=zoom, pitch=0)
+
+def construir_mapa_flota(df_mapa: pd.DataFrame, vista: pdk.ViewState, perimetros_layers: List[pdk.Layer]) -> pdk.Deck:
+    """
+    Una ScatterplotLayer por estado (color constante, solo n/lon/lat por punto) y una TextLayer
+    con flechas de rumbo únicamente para las unidades en movimiento.
+    """
+    capas = list(perimetros_layers)
+    for codigo, df_estado in df_mapa.groupby('e', sort=True):
+        capas.append(pdk.Layer(
+            "ScatterplotLayer",
+            data=df_estado[['n', 'lon', 'lat']],
+            get_position=["lon", "lat"],
+            get_fill_color=hex_a_rgba(COLORES_ESTADO_MAPA[codigo]),
+            get_line_color=[0, 0, 0, 160],
+            stroked=True,
+            line_width_min_pixels=1,
+            get_radius=25,
+            radius_min_pixels=5,
+            radius_max_pixels=12,
+            pickable=True,
+            id=f"flota_estado_{codigo}",
+        ))
+
+    df_rumbo = df_mapa[df_mapa['m']]
+    if not df_rumbo.empty:
+        capas.append(pdk.Layer(
+            "TextLayer",
+            # El glifo '➤' apunta al Este; deck.gl rota en sentido antihorario y el rumbo es horario desde el Norte
+            data=pd.DataFrame({'lon': df_rumbo['lon'], 'lat': df_rumbo['lat'], 'a': 90 - df_rumbo['h'].astype(int), 't': '➤'}),
+            get_position=["lon", "lat"],
+            get_text="t",
+            get_angle="a",
+            get_size=14,
+            get_color=[0, 0, 0, 220],
+            get_pixel_offset=[0, -14],
+            character_set=['➤'],
+            id="flota_rumbos",
+        ))
+
+    return pdk.Deck(
+        map_style='light',
+        initial_view_state=vista,
+        layers=capas,
+        tooltip={'html': '<b>{n}</b>', 'style': {'backgroundColor': 'steelblue', 'color': 'white'}},
+    )
+
+
+# 📄 PAGINACIÓN, BÚSQUEDA Y ORDEN DE LA GRILLA (lado servidor) 📄
+OPCIONES_ORDEN_GRILLA = ["Unidad", "Estado", "Velocidad (Mayor a Menor)", "Tiempo Parado (Mayor a Menor)"]
+OPCIONES_TAMANO_PAGINA = [20, 40, 80, "Todas"]
+
+def reiniciar_paginacion_grilla():
+    """Callback: al cambiar búsqueda, orden o tamaño, volver a la primera página."""
+    st.session_state['grid_pagina'] = 1
+    st.session_state['grid_paginas_extra'] = 0
+
+def mostrar_mas_tarjetas():
+    """Callback: agrega una página más de tarjetas debajo de las visibles (carga bajo demanda)."""
+    st.session_state['grid_paginas_extra'] = st.session_state.get('grid_paginas_extra', 0) + 1
+
+def paginar_tarjetas(df: pd.DataFrame, busqueda: str, orden: str, tamano_pagina, pagina: int, paginas_extra: int):
+    """
+    Filtra, ordena y recorta el DataFrame a la página visible ANTES de construir el HTML.
+    La búsqueda acepta texto (unidad o estado) o una condición de velocidad: '>60', '>=70', '<5'.
+    Retorna (df_pagina, inicio, fin, total, total_paginas).
+    """
+    busqueda = (busqueda or "").strip()
+    if busqueda:
+        condicion_velocidad = re.fullmatch(r'([<>]=?)\s*(\d+(?:[.,]\d+)?)', busqueda)
+        if condicion_velocidad:
+            operador, valor = condicion_velocidad.group(1), float(condicion_velocidad.group(2).replace(',', '.'))
+            comparaciones = {'>': df['VELOCIDAD'] > valor, '>=': df['VELOCIDAD'] >= valor,
+                             '<': df['VELOCIDAD'] < valor, '<=': df['VELOCIDAD'] <= valor}
+            df = df[comparaciones[operador]]
+        else:
+            # El texto se compara contra las pocas etiquetas de estado, no contra cada fila
+            codigos_coincidentes = [codigo for codigo, etiqueta in enumerate(ETIQUETAS_ESTADO) if busqueda.lower() in etiqueta.lower()]
+            df = df[
+                df['UNIDAD'].str.contains(busqueda, case=False, regex=False) |
+                df['ESTADO'].isin(codigos_coincidentes)
+            ]
+
+    if orden == "Estado":
+        df = df.sort_values(by=['ESTADO', 'UNIDAD'], kind='stable')
+    elif orden == "Velocidad (Mayor a Menor)":
+        df = df.sort_values(by=['VELOCIDAD', 'UNIDAD'], ascending=[False, True], kind='stable')
+    elif orden == "Tiempo Parado (Mayor a Menor)":
+        df = df.sort_values(by=['STOP_DURATION_MINUTES', 'UNIDAD'], ascending=[False, True], kind='stable')
+    else:
+        df = df.sort_values(by='UNIDAD', kind='stable')
+
+    total = len(df)
+    if tamano_pagina == "Todas" or total == 0:
+        return df.reset_index(drop=True), 0, total, total, 1
+
+    total_paginas = max(1, -(-total // tamano_pagina))
+    pagina = min(max(1, int(pagina)), total_paginas)
+    inicio = (pagina - 1) * tamano_pagina
+    fin = min(total, inicio + tamano_pagina * (1 + paginas_extra))
+    return df.iloc[inicio:fin].reset_index(drop=True), inicio, fin, total, total_paginas
+
+
 # RENDERIZACIÓN CONDICIONAL EN EL CUERPO PRINCIPAL
 
 flota_a_mostrar = st.session_state.get('flota_seleccionada', 'Flota No Seleccionada')
@@ -3241,15 +3714,61 @@ elif st.session_state.current_logistica_view == 'asignacion_ingreso':
 # 🚨 PLACEHOLDER PARA EL TESTIGO DE ESTADO (Fuera del Sidebar) 🚨
 placeholder_status_light = st.empty()
 
-# Placeholder para el contenido principal (Tarjetas)
+# Placeholder para el contenido principal (Mapa)
 placeholder_main_content = st.empty()
 
-# Placeholder para el contenido principal (Tarjetas)
-placeholder_main_content = st.empty()
+# Placeholder para el Mapa de Flota completa (solo se re-envía cuando cambian posiciones/estados)
+placeholder_mapa_flota = st.empty()
+
+# 🗺️ SELECTOR ÚNICO DE UBICACIÓN: se crea UNA sola vez fuera del bucle, con clave estable.
+# Reemplaza el botón "🗺️ Ubicacion" que cada tarjeta creaba en cada ciclo con una clave nueva.
+flota_selector_mapa = st.session_state.get('flota_seleccionada')
+if flota_selector_mapa and st.session_state.current_logistica_view == 'menu':
+    params_selector = st.session_state['config_params']
+    # Misma llamada (y misma caché) que la primera iteración del bucle
+    df_selector = obtener_datos_unidades(flota_selector_mapa, FLOTAS_CONFIG, params_selector['GPS_MIN_ENCENDIDA'], params_selector['GPS_MIN_APAGADA'])
+    opciones_ubicar = {}
+    if "FALLBACK" not in df_selector["UNIDAD"].iloc[0]:
+        opciones_ubicar = dict(zip(df_selector['UNIT_ID'], df_selector['UNIDAD'].str.split('-').str[0]))
+
+    # 📄 Barra de la grilla: ubicar, buscar, ordenar y paginar (todas con clave estable)
+    col_mapa_flota, col_ubicar, col_buscar, col_orden, col_tamano, col_pagina = st.columns([1, 2, 2, 2, 1, 1])
+    with col_mapa_flota:
+        st.toggle("🗺️ Mapa de Flota", key='modo_mapa_flota', help="Muestra todas las unidades de la flota en un mismo mapa.")
+    with col_ubicar:
+        st.selectbox(
+            "🗺️ Ubicar Unidad en el Mapa",
+            options=[None] + sorted(opciones_ubicar, key=lambda uid: opciones_ubicar[uid]),
+            format_func=lambda uid: "-- Seleccione una Unidad --" if uid is None else opciones_ubicar.get(uid, uid),
+            key='selector_unidad_mapa',
+            on_change=set_unit_to_locate,
+        )
+    with col_buscar:
+        st.text_input("🔎 Buscar (unidad, estado o '>60')", key='grid_busqueda', on_change=reiniciar_paginacion_grilla)
+    with col_orden:
+        st.selectbox("↕️ Ordenar por", OPCIONES_ORDEN_GRILLA, key='grid_orden', on_change=reiniciar_paginacion_grilla)
+    with col_tamano:
+        st.selectbox("Tarjetas por página", OPCIONES_TAMANO_PAGINA, key='grid_tamano_pagina', on_change=reiniciar_paginacion_grilla)
+    with col_pagina:
+        st.number_input("Página", min_value=1, step=1, key='grid_pagina', on_change=lambda: st.session_state.update(grid_paginas_extra=0))
+
+# Placeholder para la grilla de Tarjetas (solo se re-envía cuando su HTML cambia)
+placeholder_grid = st.empty()
+
+# Botón de carga bajo demanda: su placeholder se llena en el bucle solo mientras quedan tarjetas por mostrar
+placeholder_mostrar_mas = st.empty()
+grilla_con_paginacion = bool(flota_selector_mapa) and st.session_state.current_logistica_view == 'menu'
 
 # Usamos la referencia al estado global obtenida antes del bucle
 # current_stop_state = get_global_stop_state()
 
+# Última grilla y último mapa de flota enviados al navegador en ESTA ejecución del script (los placeholders nacen vacíos en cada rerun)
+ultima_grilla_renderizada = None
+ultima_firma_mapa_flota = None
+# Estado del botón "Mostrar más" en ESTA ejecución (un widget con clave estable se crea una sola vez por ejecución)
+boton_mostrar_mas_visible = False
+boton_mostrar_mas_creado = False
+
 # =========================================================================
 # INICIO DEL BUCLE PRINCIPAL (while True) con Testigo
 # =========================================================================
@@ -3299,6 +3818,11 @@ while True:
             st.markdown("---")
             st.info("**seleccione una Flota** en el panel lateral para comenzar el monitoreo en tiempo real.")
 
+        placeholder_grid.empty()
+        ultima_grilla_renderizada = None
+        placeholder_mapa_flota.empty()
+        ultima_firma_mapa_flota = None
+
         # Limpiar Placeholders (reutilizamos la referencia del sidebar)
         try:
             audio_stop_placeholder.empty()
@@ -3329,14 +3853,34 @@ while True:
     df_data_original = obtener_datos_unidades(flota_a_usar, FLOTAS_CONFIG, GPS_MIN_ENCENDIDA, GPS_MIN_APAGADA)
 
     is_fallback = "FALLBACK" in df_data_original["UNIDAD"].iloc[0]
+    edad_datos_s = df_data_original.attrs.get('edad_datos_s') or 0.0
+    datos_obsoletos = not is_fallback and edad_datos_s > EDAD_DATOS_OBSOLETOS_S
+    flotas_sin_datos = df_data_original.attrs.get('flotas_sin_datos', [])
+
+    # 🔊 DETECCIÓN DE CAMBIO DE ESTADO A ENCENDIDO 🔊 (por sesión; la clasificación es compartida y cacheada)
+    # Solo se procesan unidades sin Falla GPS
+    if not is_fallback:
+        estados_anteriores = st.session_state['unidades_estado_anterior']
+        for unit_id, estado_final, es_falla_gps in zip(df_data_original['UNIT_ID'], df_data_original['ESTADO'].tolist(), df_data_original['ES_FALLA_GPS_FLAG'].tolist()):
+            if es_falla_gps or not unit_id:
+                continue
+            # Verificar si hay cambio de resguardo externo a encendido
+            if detectar_cambio_a_encendido(unit_id, estado_final, estados_anteriores.get(unit_id)):
+                st.session_state['reproducir_audio_encendido'] = True
+                print(f"🔊 Cambio detectado: Unidad {unit_id} cambió de resguardo externo a encendido")
+            # Actualizar el estado anterior para la próxima verificación
+            estados_anteriores[unit_id] = estado_final
 
     # -- LÓGICA DE DETECCIÓN DE PARADAS LARGAS Y EXCESO DE VELOCIDAD --
 
     now = pd.Timestamp.now(tz='America/Caracas')
 
     if not is_fallback:
+        unidades_en_movimiento = [] # Unidades cuyos acuses de parada/velocidad se liberan al moverse
+        # Las duraciones se acumulan en un arreglo y se asignan a la columna una sola vez al final
+        duraciones_parada = np.zeros(len(df_data_original), dtype=np.float32)
         # 🚨 DOBLE VERIFICACIÓN: Iterar sobre las filas y actualizar el estado
-        for index, row in df_data_original.iterrows():
+        for posicion, (_, row) in enumerate(df_data_original.iterrows()):
             unit_id_api = row['UNIT_ID']
             velocidad = row['VELOCIDAD']
             lat = row['LATITUD']
@@ -3351,16 +3895,22 @@ while True:
                     'last_recorded_speed': 0.0
                 }
 
+            # Unidad vista por primera vez: las duraciones parten de lo observado por el sondeo de fondo
+            # (precalentamiento_flotas) en lugar de 0
+            if unit_id_api not in current_coordinate_state or unit_id_api not in current_velocity_state:
+                semilla = semilla_movimiento(unit_id_api) or {}
+
             if unit_id_api not in current_coordinate_state:
                 current_coordinate_state[unit_id_api] = {
-                    'stable_time': now,
-                    'last_coordinate': None,
+                    'stable_time': pd.Timestamp(semilla['coordenada_desde'], unit='s', tz='America/Caracas') if semilla else now,
+                    'last_coordinate': semilla.get('coordenada'),
                     'coordinate_duration': 0.0
                 }
 
             if unit_id_api not in current_velocity_state:
+                velocidad_cero_desde = semilla.get('velocidad_cero_desde')
                 current_velocity_state[unit_id_api] = {
-                    'zero_velocity_time': now,
+                    'zero_velocity_time': pd.Timestamp(velocidad_cero_desde, unit='s', tz='America/Caracas') if velocidad_cero_desde else now,
                     'velocity_duration': 0.0
                 }
 
@@ -3443,9 +3993,8 @@ while True:
                 # Usar el máximo entre ambos contadores para la duración mostrada
                 max_duration = max(vel_state['velocity_duration'], coord_state['coordinate_duration'])
                 
-                # Actualizar el DataFrame
-                df_data_original.loc[index, 'STOP_DURATION_MINUTES'] = max_duration
-                df_data_original.loc[index, 'STOP_DURATION_TIMEDELTA'] = timedelta(seconds=max_duration * 60)
+                # Actualizar la duración (se vuelca al DataFrame al final del bucle)
+                duraciones_parada[posicion] = max_duration
 
                 # 🚨 DOBLE VERIFICACIÓN PARA ALERTA: Ambas condiciones deben cumplirse
                 parada_doble_verificacion = (
@@ -3461,9 +4010,7 @@ while True:
             elif is_moving:
                 # Unidad en movimiento - resetear todos los contadores y finalizar alerta activa
                 
-                # Actualizar el DataFrame
-                df_data_original.loc[index, 'STOP_DURATION_MINUTES'] = 0.0
-                df_data_original.loc[index, 'STOP_DURATION_TIMEDELTA'] = timedelta(seconds=0)
+                # La duración queda en 0.0 (valor inicial del arreglo)
 
                 if last_state.get('alerted_stop_minutes'):
                     hora_log = now.strftime('%H:%M:%S')
@@ -3482,10 +4029,7 @@ while True:
                 last_state['last_move_time'] = now
 
                 # Reinicio de estados de alerta al moverse
-                if row['UNIDAD'] in st.session_state['alertas_descartadas']:
-                    del st.session_state['alertas_descartadas'][row['UNIDAD']]
-                if row['UNIDAD'] in st.session_state['alertas_velocidad_descartadas']:
-                    del st.session_state['alertas_velocidad_descartadas'][row['UNIDAD']]
+                unidades_en_movimiento.append(row['UNIDAD'])
 
                 # Desactivamos las banderas de reproducción si la unidad se mueve
                 st.session_state['reproducir_audio_alerta'] = False
@@ -3493,13 +4037,19 @@ while True:
 
             else:
                 # Unidad detenida pero aún no cumple doble verificación
-                # Actualizar el DataFrame con la duración máxima disponible
+                # Actualizar la duración con el máximo disponible
                 max_duration = max(vel_state['velocity_duration'], coord_state['coordinate_duration'])
-                df_data_original.loc[index, 'STOP_DURATION_MINUTES'] = max_duration
-                df_data_original.loc[index, 'STOP_DURATION_TIMEDELTA'] = timedelta(seconds=max_duration * 60)
+                duraciones_parada[posicion] = max_duration
+
+        df_data_original['STOP_DURATION_MINUTES'] = duraciones_parada
+        agregar_indice_paradas_largas(df_data_original, STOP_THRESHOLD_MINUTES)
+
+        # Los acuses son globales: una unidad que se mueve vuelve a alertar para todos los operadores
+        liberar_alertas(flota_a_usar, 'parada', unidades_en_movimiento)
+        liberar_alertas(flota_a_usar, 'velocidad', unidades_en_movimiento)
 
-    # Lógica de Filtrado Condicional (Mejorada la lógica de Parada Larga)
-    df_data_mostrada = df_data_original.copy() # Usamos una copia de la original para aplicar filtros
+    # Lógica de Filtrado Condicional (consulta los índices precalculados en la clasificación)
+    df_data_mostrada = df_data_original
 
     filtro_en_ruta_activo = st.session_state.get("filtro_en_ruta", False)
     filtro_estado_activo = st.session_state.get('filtro_estado_especifico', "Mostrar Todos")
@@ -3507,46 +4057,16 @@ while True:
     filtro_descripcion = "Todas las Unidades"
 
     if not is_fallback:
+        indices_estado = df_data_original.attrs['indices_estado']
 
         # 1. Aplicar filtro de ESTADO ESPECÍFICO
-        if filtro_estado_activo != "Mostrar Todos":
-
-            if "Vertedero" in filtro_estado_activo: # ¡NUEVO FILTRO!
-                df_data_mostrada = df_data_original[df_data_original["EN_VERTEDERO_FLAG"] == True]
-
-            elif "Fuera de Perímetro" in filtro_estado_activo: # ¡NUEVO FILTRO!
-                df_data_mostrada = df_data_original[df_data_original["EN_FUERA_PERIMETRO_FLAG"] == True]
-
-            elif "Falla GPS" in filtro_estado_activo:
-                df_data_mostrada = df_data_original[df_data_original["IGNICION"].str.contains("Falla GPS")]
-
-            elif "Apagadas" in filtro_estado_activo:
-                df_data_mostrada = df_data_original[df_data_original["IGNICION"].str.contains("Apagada ❄️")]
-
-            elif "Resguardo (Sede)" in filtro_estado_activo:
-                # Usa el flag para ser más preciso
-                df_data_mostrada = df_data_original[df_data_original['EN_SEDE_FLAG'] == True]
-
-            elif "Resguardo (Fuera de Sede)" in filtro_estado_activo:
-                # Usa el flag para ser más preciso
-                df_data_mostrada = df_data_original[df_data_original['EN_RESGUARDO_SECUNDARIO_FLAG'] == True]
-
-            elif "Paradas Largas" in filtro_estado_activo:
-                is_out_of_hq_status = ~df_data_original["IGNICION"].str.contains("(Sede)|Resguardo|Falla GPS|Vertedero|Fuera de Perímetro") # ACTUALIZADO
-
-                df_data_mostrada = df_data_original[
-                    (df_data_original['STOP_DURATION_MINUTES'] > STOP_THRESHOLD_MINUTES) &
-                    (df_data_original['VELOCIDAD'] < 1.0) &
-                    is_out_of_hq_status
-                ].copy()
-
+        if filtro_estado_activo in INDICE_POR_FILTRO_ESTADO:
+            df_data_mostrada = df_data_original.take(indices_estado[INDICE_POR_FILTRO_ESTADO[filtro_estado_activo]])
             filtro_descripcion = filtro_estado_activo
 
         # 2. Aplicar filtro "Unidades en Ruta"
         elif filtro_en_ruta_activo:
-            # En ruta significa: NO está en sede, NO en resguardo secundario, NO en vertedero, NO en perímetro, NO es Falla GPS
-            is_en_ruta = ~(df_data_original['EN_SEDE_FLAG'] | df_data_original['EN_RESGUARDO_SECUNDARIO_FLAG'] | df_data_original['EN_VERTEDERO_FLAG'] | df_data_original['EN_FUERA_PERIMETRO_FLAG'] | df_data_original['ES_FALLA_GPS_FLAG'])
-            df_data_mostrada = df_data_original[is_en_ruta].copy()
+            df_data_mostrada = df_data_original.take(indices_estado["en_ruta"])
             filtro_descripcion = "Unidades Fuera de Sede 🛣️"
 
         df_data_mostrada = df_data_mostrada.reset_index(drop=True)
@@ -3564,10 +4084,7 @@ while True:
             (~(df_data_original['EN_SEDE_FLAG'] | df_data_original['EN_RESGUARDO_SECUNDARIO_FLAG'] | df_data_original['EN_VERTEDERO_FLAG'] | df_data_original['EN_FUERA_PERIMETRO_FLAG'] | df_data_original['ES_FALLA_GPS_FLAG']))
         ].copy()
 
-        unidades_pendientes_stop = [
-            uid for uid in todas_las_alertas_stop['UNIDAD']
-            if st.session_state['alertas_descartadas'].get(uid) != True
-        ]
+        unidades_pendientes_stop = filtrar_alertas_pendientes(flota_a_usar, 'parada', todas_las_alertas_stop['UNIDAD'])
 
         unidades_en_alerta_stop = todas_las_alertas_stop[
             todas_las_alertas_stop['UNIDAD'].isin(unidades_pendientes_stop)
@@ -3583,7 +4100,7 @@ while True:
 
             for _, row in unidades_en_alerta_stop.head(5).iterrows():
                 nombre_unidad = row['UNIDAD'].split('-')[0]
-                total_segundos = row['STOP_DURATION_TIMEDELTA'].total_seconds()
+                total_segundos = float(row['STOP_DURATION_MINUTES']) * 60
                 tiempo_parado = f"{int(total_segundos // 60)}min {int(total_segundos % 60):02}seg"
                 #mensaje_alerta_stop += (f"**{nombre_unidad}** ({tiempo_parado}):\n---\n")
                 ubicacion_texto = row['UBICACION_TEXTO']
@@ -3618,20 +4135,14 @@ while True:
             (~(df_data_original['EN_SEDE_FLAG'] | df_data_original['EN_RESGUARDO_SECUNDARIO_FLAG'] | df_data_original['EN_VERTEDERO_FLAG'] | df_data_original['EN_FUERA_PERIMETRO_FLAG'] | df_data_original['ES_FALLA_GPS_FLAG']))
         ].copy()
 
-        unidades_pendientes_speed = [
-            uid for uid in todas_las_alertas_speed['UNIDAD']
-            if st.session_state['alertas_velocidad_descartadas'].get(uid) != True
-        ]
+        unidades_pendientes_speed = filtrar_alertas_pendientes(flota_a_usar, 'velocidad', todas_las_alertas_speed['UNIDAD'])
 
         unidades_en_alerta_speed = todas_las_alertas_speed[
             todas_las_alertas_speed['UNIDAD'].isin(unidades_pendientes_speed)
         ].sort_values(by='VELOCIDAD', ascending=False)
 
         # CONTROL DEL AUDIO VELOCIDAD - Solo para alertas críticas (>= 75 km/h)
-        unidades_pendientes_criticas = [
-            uid for uid in todas_las_alertas_criticas['UNIDAD']
-            if st.session_state['alertas_velocidad_descartadas'].get(uid) != True
-        ]
+        unidades_pendientes_criticas = filtrar_alertas_pendientes(flota_a_usar, 'velocidad', todas_las_alertas_criticas['UNIDAD'])
         
         unidades_en_alerta_critica = todas_las_alertas_criticas[
             todas_las_alertas_criticas['UNIDAD'].isin(unidades_pendientes_criticas)
@@ -3698,11 +4209,19 @@ while True:
     mensaje_alerta_perimetro = ""
 
     if not is_fallback:
-        # 1. Limpiar alarmas expiradas al inicio del ciclo
-        limpiar_alarmas_perimetro_expiradas()
+        # 1. Limpiar alarmas expiradas al inicio del ciclo (una vez por flota, no por sesión)
+        limpiar_alarmas_perimetro_expiradas(flota_a_usar)
         
-        # Verificar si la flota actual tiene perímetro configurado
-        tiene_perimetro_configurado = flota_a_usar in PERIMETROS_CARGADOS
+        # Verificar si la flota actual tiene perímetro configurado. La flota agregada no tiene archivo propio:
+        # cada parte se clasifica con el perímetro de su flota, así que cuentan esos perímetros (o cualquier
+        # unidad ya marcada fuera de perímetro)
+        tiene_perimetro_configurado = (
+            flota_a_usar in PERIMETROS_CARGADOS
+            or bool(df_data_original['EN_FUERA_PERIMETRO_FLAG'].any())
+            or (flota_a_usar == FLOTA_AGREGADA and any(
+                flota_grupo in PERIMETROS_CARGADOS for flota_grupo, _, _ in particionar_flota_agregada(flota_a_usar, FLOTAS_CONFIG)
+            ))
+        )
         
         if tiene_perimetro_configurado:
             # Verificar unidades Fuera de Perímetro
@@ -3717,25 +4236,8 @@ while True:
             st.session_state['perimetro_ultimas_unidades_fuera'] = unidades_fuera_actuales
             
             # 3. Filtrar unidades que NO tienen alarma aceptada Y cuyo silencio de 15 min no ha expirado
-            unidades_pendientes_perimetro = []
+            unidades_pendientes_perimetro = filtrar_alertas_pendientes(flota_a_usar, 'perimetro', todas_las_unidades_fuera_perimetro['UNIDAD'])
             hora_actual = obtener_hora_venezuela()
-            
-            for uid in todas_las_unidades_fuera_perimetro['UNIDAD']:
-                # Verificar si la unidad NO está en alertas descartadas
-                if st.session_state['alertas_perimetro_descartadas'].get(uid) != True:
-                    unidades_pendientes_perimetro.append(uid)
-                else:
-                    # Verificar si el tiempo de silencio de 15 minutos ha expirado
-                    tiempo_aceptacion = st.session_state['perimetro_unidades_aceptadas'].get(uid)
-                    if tiempo_aceptacion:
-                        diferencia = hora_actual - tiempo_aceptacion
-                        if diferencia.total_seconds() >= (TIEMPO_SILENCIO_PERIMETRO * 60):  # Usar constante
-                            # El tiempo de silencio ha expirado, permitir nueva alarma
-                            if uid in st.session_state['alertas_perimetro_descartadas']:
-                                del st.session_state['alertas_perimetro_descartadas'][uid]
-                            if uid in st.session_state['perimetro_unidades_aceptadas']:
-                                del st.session_state['perimetro_unidades_aceptadas'][uid]
-                            unidades_pendientes_perimetro.append(uid)
 
             unidades_en_alerta_perimetro = todas_las_unidades_fuera_perimetro[
                 todas_las_unidades_fuera_perimetro['UNIDAD'].isin(unidades_pendientes_perimetro)
@@ -3828,7 +4330,7 @@ while True:
     # AUDIO PARADA
     with audio_stop_placeholder.container():
         if st.session_state.get('reproducir_audio_alerta'):
-             reproducir_alerta_sonido(AUDIO_BASE64_PARADA)
+             reproducir_alerta_sonido(AUDIO_URL_PARADA)
         else:
              audio_stop_placeholder.empty()
 
@@ -3841,9 +4343,8 @@ while True:
             st.warning(mensaje_alerta_stop)
 
 
-            def aceptar_todas_paradas():
-                for uid in unidades_en_alerta_stop['UNIDAD']:
-                    st.session_state['alertas_descartadas'][uid] = True
+            def aceptar_todas_paradas(unidades_ids=unidades_en_alerta_stop['UNIDAD'].tolist()):
+                aceptar_alertas(flota_a_usar, 'parada', unidades_ids)
                 st.session_state['reproducir_audio_alerta'] = False
                 st.cache_data.clear()
                 
@@ -3860,7 +4361,7 @@ while True:
     # AUDIO VELOCIDAD
     with audio_velocidad_placeholder.container():
         if st.session_state.get('reproducir_audio_velocidad'):
-             reproducir_alerta_sonido(AUDIO_BASE64_VELOCIDAD)
+             reproducir_alerta_sonido(AUDIO_URL_VELOCIDAD)
         else:
              audio_velocidad_placeholder.empty()
 
@@ -3872,9 +4373,8 @@ while True:
            
             st.error(mensaje_alerta_speed)
 
-            def aceptar_todas_velocidades():
-                for uid in unidades_en_alerta_speed['UNIDAD']:
-                    st.session_state['alertas_velocidad_descartadas'][uid] = True
+            def aceptar_todas_velocidades(unidades_ids=unidades_en_alerta_speed['UNIDAD'].tolist()):
+                aceptar_alertas(flota_a_usar, 'velocidad', unidades_ids)
                 st.session_state['reproducir_audio_velocidad'] = False
                 st.cache_data.clear()
                 
@@ -3891,14 +4391,14 @@ while True:
     # 🆕 AUDIO PERÍMETRO
     with audio_perimetro_placeholder.container():
         if st.session_state.get('reproducir_audio_perimetro'):
-            reproducir_alerta_sonido(AUDIO_BASE64_PERIMETRO)
+            reproducir_alerta_sonido(AUDIO_URL_PERIMETRO)
         else:
             audio_perimetro_placeholder.empty()
     
     # 🔊 AUDIO ENCENDIDO (CAMBIO DE RESGUARDO EXTERNO A ENCENDIDO)
     with audio_encendido_placeholder.container():
         if st.session_state.get('reproducir_audio_encendido'):
-            reproducir_alerta_sonido(AUDIO_BASE64_ENCENDIDO)
+            reproducir_alerta_sonido(AUDIO_URL_ENCENDIDO)
         else:
             audio_encendido_placeholder.empty()
 
@@ -3926,29 +4426,30 @@ while True:
     with metricas_placeholder.container():
         if not is_fallback:
 
-            # Lógica para calcular métricas
+            # Lógica para calcular métricas (tamaños de los índices precalculados)
             total_unidades = len(df_data_original)
+            indices_estado = df_data_original.attrs['indices_estado']
 
             # Unidades encendidas (Incluye Encendida en Sede y Encendida en Ruta)
-            unidades_encendidas = len(df_data_original[df_data_original["IGNICION"].str.contains("Encendida")])
+            unidades_encendidas = len(indices_estado["encendidas"])
 
             # Unidades apagadas (Solo Apagada ❄️)
-            unidades_apagadas = len(df_data_original[df_data_original["IGNICION"].str.contains("Apagada ❄️")])
+            unidades_apagadas = len(indices_estado["apagadas"])
 
-            # Unidades en Resguardo/Encendida en Sede (Usa el nuevo flag EN_SEDE_FLAG)
-            unidades_en_sede = df_data_original['EN_SEDE_FLAG'].sum()
+            # Unidades en Resguardo/Encendida en Sede (EN_SEDE_FLAG)
+            unidades_en_sede = len(indices_estado["sede"])
 
-            # Unidades en Resguardo (Fuera de Sede) (Usa el nuevo flag EN_RESGUARDO_SECUNDARIO_FLAG)
-            unidades_resguardo_fuera_sede = df_data_original['EN_RESGUARDO_SECUNDARIO_FLAG'].sum()
+            # Unidades en Resguardo (Fuera de Sede) (EN_RESGUARDO_SECUNDARIO_FLAG)
+            unidades_resguardo_fuera_sede = len(indices_estado["resguardo_fuera_sede"])
 
             # Unidades en Vertedero (¡NUEVO!)
-            unidades_en_vertedero = df_data_original['EN_VERTEDERO_FLAG'].sum()
+            unidades_en_vertedero = len(indices_estado["vertedero"])
 
             # Unidades Fuera de Perímetro (¡NUEVO!)
-            unidades_fuera_perimetro = df_data_original['EN_FUERA_PERIMETRO_FLAG'].sum()
+            unidades_fuera_perimetro = len(indices_estado["fuera_perimetro"])
 
-            # Unidades Falla GPS (Usa el nuevo flag ES_FALLA_GPS_FLAG)
-            unidades_falla_gps = df_data_original['ES_FALLA_GPS_FLAG'].sum()
+            # Unidades Falla GPS (ES_FALLA_GPS_FLAG)
+            unidades_falla_gps = len(indices_estado["falla_gps"])
 
             # INICIO DEL DESPLEGABLE DE ESTADÍSTICAS
             with st.expander("📊 **Estadísticas de la Flota**", expanded=False):
@@ -3998,13 +4499,20 @@ while True:
 
         # 🟢 PUNTO C: ESTADO VERDE (MOSTRANDO/RENDERIZANDO DATA) 🟢
         # El testigo se pone en VERDE, indicando que la data fue recibida y se está mostrando.
+        # Si la API no responde se siguen mostrando los últimos datos buenos, indicando su antigüedad
+        if datos_obsoletos:
+            texto_testigo = f"<span style='color: #FFC107; font-weight: bold;'>🟠 Datos de hace {int(edad_datos_s // 60)} min {int(edad_datos_s % 60)} s (API sin respuesta)</span>"
+        elif flotas_sin_datos:
+            texto_testigo = f"<span style='color: #FFC107; font-weight: bold;'>🟠 Sin datos de: {', '.join(flotas_sin_datos)}</span>"
+        else:
+            texto_testigo = "<span style='color: white; font-weight: bold;'>🟢 Actualizado</span>"
         with placeholder_status_light.container():
             st.markdown(
                 f"""
 
                 <div class="update-align">
                     <div>
-                        <span style='color: white; font-weight: bold;'>🟢 Actualizado</span>
+                        {texto_testigo}
                     </div>
                 </div>
                 """,
@@ -4100,97 +4608,8 @@ while True:
                         id="unidad_pulso_dinamico",
                     )
 
-                    # >>> NUEVA SECCIÓN: CAPAS DE PERÍMETROS <<<
-                    perimetros_layers = []
-                    
-                    # Procesar cada perímetro cargado
-                    for nombre_perimetro, datos_perimetro in PERIMETROS_CARGADOS.items():
-                        if 'geometria' in datos_perimetro:
-                            geometria = datos_perimetro['geometria']
-                            color_perimetro = datos_perimetro.get('color_perimetro', '#42F527') 
-                            color_relleno_hex = datos_perimetro.get('color_relleno', '#9CF527')
-                                                        
-                            # Convertir color hex a RGB
-                            # Convertir color de Borde (color_perimetro) a RGB
-                            color_borde_hex = color_perimetro.replace('#', '')
-                            r_borde = int(color_borde_hex[0:2], 16)
-                            g_borde = int(color_borde_hex[2:4], 16)
-                            b_borde = int(color_borde_hex[4:6], 16)
-                            
-                            # Convertir color de Relleno (color_relleno_hex) a RGB
-                            color_relleno_sin_hash = color_relleno_hex.replace('#', '')
-                            r_relleno = int(color_relleno_sin_hash[0:2], 16)
-                            g_relleno = int(color_relleno_sin_hash[2:4], 16)
-                            b_relleno = int(color_relleno_sin_hash[4:6], 16)
-                            
-                            if geometria['type'] == 'Polygon':
-                                # Para Polígonos, crear una capa PolygonLayer
-                                polygon_coords = geometria['coordinates'][0]  # Primer anillo de coordenadas
-                                
-                                # Crear DataFrame para el polígono
-                                polygon_data = pd.DataFrame({
-                                'polygon': [polygon_coords],
-                                'nombre': [nombre_perimetro],
-                                # Usamos las variables de relleno (r_relleno, g_relleno, b_relleno) para la columna 'fill_color'. 
-                                # Mantenemos la opacidad en 50 (muy transparente)
-                                'fill_color': [[r_relleno, g_relleno, b_relleno, 255]],
-                                # Usamos las variables de borde para la columna 'line_color'
-                                'line_color': [[r_borde, g_borde, b_borde, 255]] # Opacidad 255 (sólido) para el borde
-                                })
-                                
-                                layer_perimetro = pdk.Layer(
-                                    "PolygonLayer",
-                                    data=polygon_data,
-                                    get_polygon="polygon",
-                                    get_fill_color="fill_color",
-                                    get_line_color="[r, g, b, 50]",
-                                    get_line_width=2,
-                                    pickable=True,
-                                    stroked=True,
-                                    filled=True,
-                                    auto_highlight=True,
-                                    id=f"perimetro_{nombre_perimetro}",
-                                )
-                                perimetros_layers.append(layer_perimetro)
-                                
-                            elif geometria['type'] == 'LineString':
-                                # Para LineStrings, crear una capa PathLayer
-                                line_coords = geometria['coordinates']
-                                
-                                # Crear DataFrame para la línea
-                                line_data = pd.DataFrame({
-                                    'path': [line_coords],
-                                    'nombre': [nombre_perimetro],
-                                    # USAR r_borde, g_borde, b_borde
-                                    # Opacidad (el último número): 255 es sólido, 50 es muy transparente.
-                                    'color': [[r_borde, g_borde, b_borde, 255]] 
-                                })
-                                
-                                layer_perimetro = pdk.Layer(
-                                    "PathLayer",
-                                    data=line_data,
-                                    get_path="path",
-                                    get_color="color",
-                                    get_width=3,
-                                    width_min_pixels=2,
-                                    pickable=True,
-                                    auto_highlight=True,
-                                    id=f"perimetro_{nombre_perimetro}",
-                                )
-                                perimetros_layers.append(layer_perimetro)
-                                
-                                layer_perimetro = pdk.Layer(
-                                    "PathLayer",
-                                    data=line_data,
-                                    get_path="path",
-                                    get_color="color",
-                                    get_width=3,
-                                    width_min_pixels=2,
-                                    pickable=True,
-                                    auto_highlight=True,
-                                    id=f"perimetro_{nombre_perimetro}",
-                                )
-                                perimetros_layers.append(layer_perimetro)
+                    # >>> CAPAS DE PERÍMETROS (construidas y cacheadas una vez por versión) <<<
+                    perimetros_layers = construir_capas_perimetros(PERIMETROS_CARGADOS, version_perimetros(PERIMETROS_CARGADOS))
                     
                     # Combinar todas las capas: perímetros + unidad
                     all_layers = perimetros_layers + [layer_unidad_fija, layer_unidad_pulso]
@@ -4215,8 +4634,8 @@ while True:
                     # Definición de variables para el renderizado
                     nombre_unidad_display = selected_row['UNIDAD'].split('-')[0] if '-' in selected_row['UNIDAD'] else selected_row['UNIDAD']
                     velocidad_formateada = f"{selected_row['VELOCIDAD']:.0f}"
-                    card_style = selected_row['CARD_STYLE']
-                    estado_ignicion = selected_row['IGNICION']
+                    card_style = estilos_tarjeta([selected_row['ESTADO']])[0]
+                    estado_ignicion = ETIQUETAS_ESTADO[int(selected_row['ESTADO'])]
                     velocidad_float = selected_row['VELOCIDAD']
                     stop_duration = selected_row['STOP_DURATION_MINUTES']
                     estado_display = estado_ignicion
@@ -4229,7 +4648,7 @@ while True:
                     else:
                         if stop_duration > STOP_THRESHOLD_MINUTES and velocidad_float < 1.0 and is_out_of_hq_status:
                             parada_display = f"Parada Larga 🛑: {stop_duration:.0f} min"
-                            card_style = "background-color: #FFC107; padding: 15px; border-radius: 5px; color: black; margin-bottom: 0px;"
+                            card_style = CARD_STYLE_PARADA_LARGA
                             estado_display = parada_display
                             color_velocidad = "black"
                         elif velocidad_float >= VELOCIDAD_CRITICA_AUDIO:
@@ -4377,146 +4796,106 @@ while True:
             filtro_descripcion_final = filtro_descripcion
 
 
-        # -----------------------------------------------------------------------------------
-        # 🚨 INICIO DEL RENDERIZADO DE TARJETAS (Común a ambas vistas) 🚨
-        # -----------------------------------------------------------------------------------
-
-        st.subheader(f"{filtro_descripcion_final} - ({len(df_data_final_render)})")
-
-        if is_fallback:
-            causa_display = df_data_original['UBICACION_TEXTO'].iloc[0].split(' - ')[1]
-            st.error(f"🚨 **ERROR CRÍTICO DE CONEXIÓN/DATOS** 🚨")
-            st.warning(f"La API de Foresight GPS no devolvió datos. Razón: **{causa_display}**.")
-
-        elif df_data_final_render.empty:
-             st.info(f"No hay unidades que cumplan el filtro **'{filtro_descripcion_final}'** para la flota **{flota_a_usar}** en este momento.")
-
-        else:
-
-            COLUMNS_PER_ROW = 5
-            rows = [df_data_final_render[i:i + COLUMNS_PER_ROW] for i in range(0, len(df_data_final_render), COLUMNS_PER_ROW)]
-
-            for row_index, row_data in enumerate(rows):
-                cols = st.columns(COLUMNS_PER_ROW)
-
-                for col_index, row_tuple in enumerate(row_data.iterrows()):
-                    with cols[col_index]:
-
-                        row = row_tuple[1]
-                        unit_id_current = row['UNIT_ID'] # ID de la unidad actual
-
-                        nombre_unidad_display = row['UNIDAD'].split('-')[0] if '-' in row['UNIDAD'] else row['UNIDAD']
-                        velocidad_formateada = f"{row['VELOCIDAD']:.0f}"
-                        card_style = row['CARD_STYLE']
-                        estado_ignicion = row['IGNICION']
-                        velocidad_float = row['VELOCIDAD']
-                        stop_duration = row['STOP_DURATION_MINUTES']
-
-                        estado_display = estado_ignicion
-                        color_velocidad = "white"
-
-                        # Determinar si la unidad NO está en ninguna zona crítica
-                        is_out_of_hq_status = not (row['EN_SEDE_FLAG'] or row['EN_RESGUARDO_SECUNDARIO_FLAG'] or row['EN_VERTEDERO_FLAG'] or row['EN_FUERA_PERIMETRO_FLAG'] or row['ES_FALLA_GPS_FLAG'])
-
-                        # Lógica de Precedencia: Falla GPS > Parada Larga > Exceso de Velocidad
-
-                        if row['ES_FALLA_GPS_FLAG']:
-                            color_velocidad = "black"
-
-                        else:
-                            # Resaltado visual para Parada Larga
-                            if stop_duration > STOP_THRESHOLD_MINUTES and velocidad_float < 1.0 and is_out_of_hq_status:
-                                parada_display = f"Parada Larga 🛑: {stop_duration:.0f} min"
-                                card_style = "background-color: #FFC107; padding: 15px; border-radius: 5px; color: black; margin-bottom: 0px;"
-                                estado_display = parada_display
-                                color_velocidad = "black"
-
-                            # Resaltado visual para Exceso de Velocidad
-                            elif velocidad_float >= VELOCIDAD_CRITICA_AUDIO:
-                                color_velocidad = "#D32F2F" # ROJO (Crítico)
-                                estado_display = "EXCESO VELOCIDAD CRÍTICO 🚨"
-                            elif velocidad_float >= SPEED_THRESHOLD_KPH:
-                                color_velocidad = "#FF9800" # NARANJA (Alerta)
-                                estado_display = "Alerta Velocidad ⚠️"
-
-                        # Estructura del card HTML
-                        st.markdown(f'<div style="{card_style}">', unsafe_allow_html=True)
-                        st.markdown(
-                            f'<p style="text-align: center; margin-bottom: 10px; margin-top: 0px;">'
-                            f'<span style="background-color: rgba(0,0,0,0.3); padding: 5px 10px; border-radius: 5px; font-size: 1.5em; font-weight: 900;">'
-                            f'{nombre_unidad_display}'
-                            f'</span>'
-                            f'</p>',
-                            unsafe_allow_html=True
-                        )
-                        
-                        final_text_color = "black" if COLOR_VERTEDERO == "#FCC6BB" and row['EN_VERTEDERO_FLAG'] else color_velocidad
-                        if row['ES_FALLA_GPS_FLAG']:
-                            final_text_color = "black"
-
-                        st.markdown(
-                            f'<p style="display: flex; align-items: center; justify-content: center; font-size: 1.9em; font-weight: 900; margin-top: 0px;">'
-                            f'📍 <span style="margin-left: 8px; color: {final_text_color};">{velocidad_formateada} Km</span>'
-                            f'</p>',
-                            unsafe_allow_html=True
-                        )
-                        st.markdown(f'<p style="font-size: 1.0em; margin-top: 0px; opacity: 1.1; text-align: center; margin-bottom: 0px;">{estado_display}</p>', unsafe_allow_html=True)
-                        st.markdown('</div>', unsafe_allow_html=True)
-
-                        # Botón de Mapa
-   
-                        st.button(
-                                "🗺️ Ubicacion",
-                                # SE AÑADE unique_time_id PARA EVITAR DUPLICIDAD
-                                key=f"map_btn_{unit_id_current}_{row_index}_{col_index}_{unique_time_id}",
-                                on_click=set_unit_to_locate,
-                                args=(unit_id_current,), # Pasa el UNIT_ID al callback
-                                use_container_width=True,
-                                type="secondary"
-                        )
-                       
-                        with st.expander("Detalles ℹ️", expanded=False):
-                            stop_timedelta_card = row['STOP_DURATION_TIMEDELTA']
-                            tiempo_parado_display = f"{int(stop_timedelta_card.total_seconds() // 60)} min {int(stop_timedelta_card.total_seconds() % 60):02} seg"
+    # -----------------------------------------------------------------------------------
+    # 🗺️ MAPA DE FLOTA COMPLETA (modo opcional, oculto mientras se ubica una unidad)
+    # -----------------------------------------------------------------------------------
+    if st.session_state.get('modo_mapa_flota') and not is_fallback and not st.session_state.get('unit_to_locate_id') and not df_data_mostrada.empty:
+        df_mapa_flota = codificar_posiciones_flota(df_data_mostrada, STOP_THRESHOLD_MINUTES)
+        # Firma de posiciones/rumbos/estados: si nada cambió, el navegador conserva el mapa actual
+        firma_mapa_flota = (flota_a_usar, pd.util.hash_pandas_object(df_mapa_flota, index=False).to_numpy().tobytes())
+
+        if firma_mapa_flota != ultima_firma_mapa_flota:
+            ultima_firma_mapa_flota = firma_mapa_flota
+            # La vista se calcula una vez por flota para no "saltar" en cada actualización
+            vistas_mapa_flota = st.session_state.setdefault('vista_mapa_flota', {})
+            if flota_a_usar not in vistas_mapa_flota:
+                vistas_mapa_flota[flota_a_usar] = vista_inicial_mapa_flota(df_mapa_flota)
+            with placeholder_mapa_flota.container():
+                st.subheader(f"🗺️ Mapa de Flota {flota_a_usar} ({len(df_mapa_flota)})")
+                st.pydeck_chart(
+                    construir_mapa_flota(
+                        df_mapa_flota,
+                        vistas_mapa_flota[flota_a_usar],
+                        construir_capas_perimetros(PERIMETROS_CARGADOS, version_perimetros(PERIMETROS_CARGADOS)),
+                    ),
+                    use_container_width=True,
+                )
+    elif ultima_firma_mapa_flota is not None:
+        placeholder_mapa_flota.empty()
+        ultima_firma_mapa_flota = None
+
+    # -----------------------------------------------------------------------------------
+    # 🚨 INICIO DEL RENDERIZADO DE TARJETAS (Común a ambas vistas) 🚨
+    # -----------------------------------------------------------------------------------
+    # Toda la grilla es UN bloque HTML; si no cambió desde el ciclo anterior no se re-envía.
+
+    # Solo la página visible llega al constructor de HTML
+    hay_mas_tarjetas = False
+    if not is_fallback and not df_data_final_render.empty:
+        df_data_final_render, inicio_pagina, fin_pagina, total_grilla, total_paginas = paginar_tarjetas(
+            df_data_final_render,
+            st.session_state.get('grid_busqueda', ''),
+            st.session_state.get('grid_orden', OPCIONES_ORDEN_GRILLA[0]),
+            st.session_state.get('grid_tamano_pagina', OPCIONES_TAMANO_PAGINA[0]),
+            st.session_state.get('grid_pagina', 1),
+            st.session_state.get('grid_paginas_extra', 0),
+        )
+        titulo_grilla = f"{filtro_descripcion_final} - ({total_grilla})"
+        hay_mas_tarjetas = grilla_con_paginacion and fin_pagina < total_grilla
+        if total_grilla and total_paginas > 1:
+            titulo_grilla += f" · Mostrando {inicio_pagina + 1}–{fin_pagina} (Página {min(st.session_state.get('grid_pagina', 1), total_paginas)} de {total_paginas})"
+    else:
+        titulo_grilla = f"{filtro_descripcion_final} - ({len(df_data_final_render)})"
 
-                            st.caption(f"Tiempo Parado: **{tiempo_parado_display}**")
+    if is_fallback:
+        causa_display = df_data_original['UBICACION_TEXTO'].iloc[0].split(' - ')[1]
+        contenido_grilla = ('fallback', titulo_grilla, causa_display)
+    elif df_data_final_render.empty:
+        contenido_grilla = ('vacio', titulo_grilla, flota_a_usar)
+    else:
+        contenido_grilla = ('tarjetas', titulo_grilla, construir_html_tarjetas(df_data_final_render, STOP_THRESHOLD_MINUTES, SPEED_THRESHOLD_KPH))
 
-                            falla_motivo = row.get('FALLA_GPS_MOTIVO')
-                            last_report_display = row.get('LAST_REPORT_TIME_DISPLAY')
+    if contenido_grilla != ultima_grilla_renderizada:
+        ultima_grilla_renderizada = contenido_grilla
+        with placeholder_grid.container():
+            st.subheader(titulo_grilla)
 
-                            if falla_motivo:
-                                st.error(
-                                    f"🛠 **Motivo Falla GPS:** {falla_motivo}\n\n"
-                                    f"🕒 **Último Reporte:** {last_report_display}"
-                                )
+            if is_fallback:
+                st.error(f"🚨 **ERROR CRÍTICO DE CONEXIÓN/DATOS** 🚨")
+                st.warning(f"La API de Foresight GPS no devolvió datos. Razón: **{causa_display}**.")
 
-                            st.caption(f"Dirección: **{row['UBICACION_TEXTO']}**")
-                            st.caption(f"Sentido: **{row['SENTIDO']:.0f}°** (Grados)")
-                            
-                            # 🆕 STATUS CON EMOJIS COLORIDOS
-                            status_display = construir_status_con_emojis(row, not row['EN_FUERA_PERIMETRO_FLAG'], estado_display)
-                            st.markdown(f"Status: **{status_display}**", unsafe_allow_html=True)
-                            
-                            if not falla_motivo:
-                                st.caption(f"Último Reporte: **{last_report_display}**")
+            elif df_data_final_render.empty:
+                 st.info(f"No hay unidades que cumplan el filtro **'{filtro_descripcion_final}'** para la flota **{flota_a_usar}** en este momento.")
 
-                            st.caption(f"Coordenadas: ({row['LONGITUD']:.4f}, {row['LATITUD']:.4f})\r\n")
-                    
-                st.markdown("<div style='height: 15px;'></div>", unsafe_allow_html=True)
+            else:
+                st.markdown(contenido_grilla[2], unsafe_allow_html=True)
+
+    # "Mostrar más" solo mientras queden tarjetas debajo de las visibles (no con "Todas" ni en la última página)
+    if hay_mas_tarjetas != boton_mostrar_mas_visible:
+        if hay_mas_tarjetas:
+            if boton_mostrar_mas_creado:
+                # Ya se creó (y ocultó) en esta ejecución: volver a crearlo duplicaría la clave
+                st.rerun()
+            placeholder_mostrar_mas.button("⬇️ Mostrar más unidades", key='btn_grid_mostrar_mas', on_click=mostrar_mas_tarjetas, type="secondary")
+            boton_mostrar_mas_creado = True
+        else:
+            placeholder_mostrar_mas.empty()
+        boton_mostrar_mas_visible = hay_mas_tarjetas
 
     #st.markdown("---")
 
-    # 🆕 VERIFICACIÓN DE PERÍMETROS CADA 10 SEGUNDOS
-    st.session_state['perimetro_check_counter'] += TIME_SLEEP
-    
-    # Si han pasado 10 segundos o más, forzar una nueva verificación de datos
-    if st.session_state['perimetro_check_counter'] >= 10:
-        st.session_state['perimetro_check_counter'] = 0
-        print(f"🔄 Verificación de perímetros ejecutada después de 10 segundos para flota: {flota_a_usar}")
-        # Limpiar cache para forzar nueva carga de datos con verificación de perímetro
-        st.cache_data.clear()
-        # En Streamlit, no se puede usar continue - la página se re-renderiza automáticamente
-    
+    # ⏱️ PLANIFICADOR ADAPTATIVO: el intervalo de refresco de la flota sigue su actividad
+    # (cada instantánea nueva se re-clasifica, con verificación de perímetro, sin limpiar la caché)
+    if not is_fallback:
+        indices_flota = df_data_original.attrs['indices_estado']
+        registrar_intervalo(flota_a_usar, intervalo_por_actividad(
+            total_unidades=len(df_data_original),
+            en_movimiento=int((df_data_original['VELOCIDAD'].to_numpy() > 1.0).sum()),
+            en_sede=len(indices_flota['sede']),
+            alertas_activas=len(unidades_en_alerta_stop) + len(unidades_en_alerta_speed) + len(unidades_en_alerta_perimetro),
+            hora_local=obtener_hora_venezuela().hour,
+        ), solicitudes_por_refresco=solicitudes_por_refresco_flota(flota_a_usar, FLOTAS_CONFIG))
+
     # PARÁMETRO DINÁMICO DE PAUSA
     # testigo permanece VERDE durante el time.sleep
     time.sleep(TIME_SLEEP)
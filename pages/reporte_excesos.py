@@ -1,14 +1,18 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
-import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import pytz 
 import os 
-from typing import Dict, Any 
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple 
 import sqlite3 
+from deteccion_excesos import detectar_runs_excesos, tiempos_a_ns
+from decodificador_json import cargar_json
+from foresight_api import COMPANY_ID, USER_ID_REPORTES, autorizacion_reportes, ejecutar_reporte_api, filas_a_frame
 # import altair as alt # Gráfico de línea no solicitado
-import plotly.express as px 
 import plotly.graph_objects as go 
 
 hide_st_page_style = """
@@ -143,7 +147,7 @@ def load_all_fleets_config() -> Dict[str, Dict[str, Any]]:
     # 1. CARGAR EL ARCHIVO MAESTRO DE MAPEO
     try:
         with open(mapping_filepath, 'r', encoding='utf-8') as f:
-            flotas_map = json.load(f)
+            flotas_map = cargar_json(f)
     except Exception as e:
         print(f"Error al cargar '{MAPPING_FILE}'. Revise el formato JSON. Error: {e}")
         return {}
@@ -159,7 +163,7 @@ def load_all_fleets_config() -> Dict[str, Dict[str, Any]]:
         
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+                data = cargar_json(f)
                 
                 if "ids" in data and isinstance(data["ids"], str): 
                     flotas_config[nombre_flota] = {
@@ -182,118 +186,104 @@ FLOTAS_CONFIG = load_all_fleets_config()
 
 # --- Funciones de Búsqueda Dinámica en DB ---
 
-def get_driver_full_name_by_ficha(ficha: str) -> str:
-    if not ficha or ficha.startswith('ERROR') or 'Desconocido' in ficha:
-        return ficha 
-        
-    sql_query = """
-        SELECT 
-            nombre, apellido
-        FROM 
-            conductores
-        WHERE 
-            ficha_empleado = ?  
-        LIMIT 1;
-    """
-    
-    try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute(sql_query, (ficha.strip(),))
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            nombre_completo = result[0].strip() if result[0] else ""
-            apellido_completo = result[1].strip() if result[1] else ""
-            
-            primer_nombre = nombre_completo.split(' ')[0] if nombre_completo else ""
-            primer_apellido = apellido_completo.split(' ')[0] if apellido_completo else ""
-            
-            short_name = f"{primer_nombre} {primer_apellido}".strip()
-            
-            return short_name if short_name else f"FICHA: {ficha.strip()}"
-        
-        return f"FICHA: {ficha.strip()}" 
-        
-    except sqlite3.Error as e:
-        print(f"Error al buscar nombre en tabla conductores: {e}")
-        return f"ERROR DB (Conductores): {ficha.strip()}"
-    except Exception:
-        return f"FICHA: {ficha.strip()}" 
-
-
-def get_driver_ficha_only_by_unit(unidad: str) -> str:
-    sql_query = """
-        SELECT 
-            conductor_ficha  
-        FROM 
-            asignacion
-        WHERE 
-            unidad = ? 
-        ORDER BY 
-            fecha DESC
-        LIMIT 1;
+SQLITE_MAX_PARAMS = 900 # Límite de parámetros por consulta IN
+
+def _nombre_corto_conductor(nombre: str, apellido: str, ficha: str) -> str:
+    """Primer nombre y primer apellido; si no hay datos se muestra la ficha."""
+    nombre_completo = nombre.strip() if nombre else ""
+    apellido_completo = apellido.strip() if apellido else ""
+
+    primer_nombre = nombre_completo.split(' ')[0] if nombre_completo else ""
+    primer_apellido = apellido_completo.split(' ')[0] if apellido_completo else ""
+
+    short_name = f"{primer_nombre} {primer_apellido}".strip()
+    return short_name if short_name else f"FICHA: {ficha}"
+
+def _consultar_en_lotes(cursor, sql_template: str, valores: list, parametros_previos: tuple = ()) -> list:
+    """Ejecuta un SELECT con cláusula IN (...) por lotes y concatena las filas."""
+    filas = []
+    for i in range(0, len(valores), SQLITE_MAX_PARAMS):
+        lote = valores[i:i + SQLITE_MAX_PARAMS]
+        cursor.execute(sql_template.format(placeholders=','.join('?' * len(lote))), (*parametros_previos, *lote))
+        filas.extend(cursor.fetchall())
+    return filas
+
+# TTL corto (como los conductores del dashboard): solo evita repetir las consultas dentro de una misma
+# ejecución de la página; una reasignación en la base se ve en la siguiente consulta del reporte
+@st.cache_data(ttl=10, show_spinner=False)
+def resolver_conductores(fecha_str: str, flota_name: str, unidades: tuple) -> Dict[str, str]:
     """
-    
-    try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute(sql_query, (unidad,))
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            return result[0].strip()
-        return "Conductor Desconocido"
-
-    except Exception:
-        return "Conductor Desconocido"
-
-def get_driver_ficha_for_unit(unidad: str, fecha_str: str, flota_name: str) -> str:
-    sql_query = """
-        SELECT 
-            conductor_ficha  
-        FROM 
-            asignacion
-        WHERE 
-            unidad = ? 
-            AND flota = ? 
-            AND fecha = ? 
-        ORDER BY 
-            fecha DESC
-        LIMIT 1;
+    Resuelve el conductor de todas las unidades del reporte para una fecha y flota con dos consultas:
+    'asignacion' de esas unidades y el mapa de nombres de 'conductores' de las fichas encontradas.
+    Prioridad por unidad: asignación de la fecha y flota del reporte; si no hay, la asignación más reciente
+    de la unidad (cualquier flota). Sin asignación -> "Conductor Desconocido"; ficha sin nombre -> "FICHA: ...".
+    Compartido por la tabla, el gráfico, la narrativa en pantalla y la exportación TXT.
     """
-    
+    unidades = [str(unidad) for unidad in unidades]
+    if not unidades:
+        return {}
+
     try:
         conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute(sql_query, (unidad, flota_name, fecha_str))
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            return result[0].strip()
-        
-        return get_driver_ficha_only_by_unit(unidad)
+        try:
+            cursor = conn.cursor()
+
+            # 1. Asignaciones de las unidades (más reciente primero)
+            asignaciones = _consultar_en_lotes(cursor, """
+                SELECT unidad, flota, fecha, conductor_ficha
+                FROM asignacion
+                WHERE unidad IN ({placeholders})
+                ORDER BY fecha DESC, id ASC;
+            """, unidades)
+
+            ficha_del_dia: Dict[str, str] = {}
+            ficha_mas_reciente: Dict[str, str] = {}
+            for unidad, flota, fecha, conductor_ficha in asignaciones:
+                ficha = conductor_ficha.strip()
+                ficha_mas_reciente.setdefault(unidad, ficha)
+                if flota == flota_name and fecha == fecha_str:
+                    ficha_del_dia.setdefault(unidad, ficha)
+
+            fichas = {unidad: ficha_del_dia.get(unidad, ficha_mas_reciente.get(unidad)) for unidad in unidades}
+
+            # 2. Mapa de nombres de las fichas encontradas
+            fichas_validas = sorted({ficha for ficha in fichas.values() if ficha})
+            nombres: Dict[str, str] = {}
+            try:
+                for ficha_empleado, nombre, apellido in _consultar_en_lotes(cursor, """
+                    SELECT ficha_empleado, nombre, apellido
+                    FROM conductores
+                    WHERE ficha_empleado IN ({placeholders})
+                    ORDER BY id ASC;
+                """, fichas_validas):
+                    nombres.setdefault(ficha_empleado, _nombre_corto_conductor(nombre, apellido, ficha_empleado))
+            except sqlite3.Error as e:
+                print(f"Error al buscar nombres en tabla conductores: {e}")
+                return {unidad: (f"ERROR DB (Conductores): {ficha}" if ficha else "Conductor Desconocido")
+                        for unidad, ficha in fichas.items()}
+        finally:
+            conn.close()
 
     except sqlite3.Error as e:
         print(f"Error crítico en la consulta de asignación dinámica: {e}")
-        return f"ERROR DB (Asignación): {e}"
-    except Exception as e:
-        print(f"Error inesperado al buscar ficha: {e}")
-        return "Error Desconocido"
+        return {unidad: f"ERROR DB (Asignación): {e}" for unidad in unidades}
 
-def get_driver_info_for_unit(unidad: str, fecha_str: str, flota_name: str) -> str:
-    ficha_result = get_driver_ficha_for_unit(unidad, fecha_str, flota_name)
-    
-    if 'ERROR' in ficha_result or 'Desconocido' in ficha_result:
-        return ficha_result
-    
-    full_name_result = get_driver_full_name_by_ficha(ficha_result)
-    
-    return full_name_result
+    return {
+        unidad: (nombres.get(ficha, f"FICHA: {ficha}") if ficha else "Conductor Desconocido")
+        for unidad, ficha in fichas.items()
+    }
+
+def conductores_del_reporte(data_df: pd.DataFrame, flota_name: str) -> Dict[Tuple[str, str], str]:
+    """
+    Mapa (fecha, unidad) -> conductor para todas las unidades del reporte.
+    Se resuelve por día (la asignación cambia de un día a otro) y cada día usa su propia entrada de caché.
+    """
+    conductores: Dict[Tuple[str, str], str] = {}
+    for fecha_str, unidades in data_df.groupby('Fecha')['Und.']:
+        por_unidad = resolver_conductores(fecha_str, flota_name, tuple(sorted(unidades.astype(str).unique())))
+        for unidad, conductor in por_unidad.items():
+            conductores[(fecha_str, unidad)] = conductor
+    return conductores
 
 # --- FIN: Funciones de Búsqueda Dinámica en DB ---
 
@@ -302,26 +292,10 @@ def get_driver_info_for_unit(unidad: str, fecha_str: str, flota_name: str) -> st
 # 1. CONSTANTES DE LA API
 # ====================================================
 
-REPORT_ENDPOINT = "https://flexapi.foresightgps.com/ForesightFlexAPI.ashx" 
-
-# --- CONFIGURACIÓN DE LA API Y SEGURIDAD (st.secrets) ---
-try:
-    # Como el archivo original no tenía secrets.toml, se mantiene la variable estática
-    BASIC_AUTH_HEADER = "dGVycGVsOmZzZ3BzVGVycGVs"
-except KeyError:
-    st.error("ERROR CRÍTICO: No se pudo encontrar la clave 'basic_auth_header' en st.secrets.")
-    st.info("Asegúrese de configurar el archivo '.streamlit/secrets.toml' o la configuración de 'Secrets' en la nube.")
-    st.stop()
-
-# Encabezados (HEADERS) utilizando la clave SEGURA
-HEADERS = {
-    "Content-Type": "application/json",
-    "Authorization":f"Basic {BASIC_AUTH_HEADER}"   
-}
-
-# Parámetros fijos
-USER_ID = "82825"
-COMPANY_ID = "5809"
+# Endpoint, autenticación y cuenta (USER_ID / COMPANY_ID) viven en foresight_api.py
+# 🔑 La clave se lee de st.secrets; sin ella la página se detiene con el error de configuración
+autorizacion_reportes()
+REPORT_ID_EXCESOS = 115
 
 # Parámetro clave para el DOBLE FILTRO
 VELOCITY_MAX_API = "1" 
@@ -341,6 +315,7 @@ NARRATIVE_MIN_SPEED_COL = 'V. min (km/h)'
 
 # Estructura de la tabla consolidada (Nombres de columna internos)
 CONSOLIDATED_COLUMN_NAMES = [
+    'Fecha',                      
     'Und.',                       
     'Exceso',                     
     'Inicio',                     
@@ -354,6 +329,7 @@ CONSOLIDATED_COLUMN_NAMES = [
 
 # Columas a mostrar en la tabla de Streamlit 
 DISPLAY_COLUMN_NAMES = [
+    'Fecha', 
     'Und.', 
     'Exceso', 
     'Inicio', 
@@ -394,69 +370,39 @@ def ejecutar_reporte(current_vehicle_ids, subfleet_id, fecha_inicio_iso, fecha_f
     """Ejecuta una sola solicitud de reporte para un grupo de IDs con fechas dinámicas."""
     
     VALUE_STRING = (
-        f"{USER_ID}|{current_vehicle_ids}|{fecha_inicio_iso}|{fecha_fin_iso}|{VELOCITY_MAX_API}|"       
+        f"{USER_ID_REPORTES}|{current_vehicle_ids}|{fecha_inicio_iso}|{fecha_fin_iso}|{VELOCITY_MAX_API}|"       
         f"{COMPANY_ID}|{subfleet_id}|0" 
     )
 
-    PAYLOAD = {
-        "method": "REPORT_EXECUTE",
-        "conncode": "SATEQSA",
-        "reportid": 115, 
-        "userid": USER_ID,
-        "prefix": True,
-        "parameter": "@USERID|@LIST_VEHICLE_IDS|@STARTDATEANDTIME|@ENDDATEANDTIME|@VELOCITY_MAX|@IsCompany|@IsSubfleet|@IsGroup",
-        "value": VALUE_STRING
-    }
-
     try:
-        response = requests.post(REPORT_ENDPOINT, headers=HEADERS, json=PAYLOAD)
-        response.raise_for_status()
-        
-        if response.headers.get("Content-Type", "").startswith("application/json"):
-            reporte_data = response.json()
-            return reporte_data.get("ForesightFlexAPI", {}).get("DATA1", [])
-        
-        return []
+        reporte_data = ejecutar_reporte_api(
+            REPORT_ID_EXCESOS,
+            "@USERID|@LIST_VEHICLE_IDS|@STARTDATEANDTIME|@ENDDATEANDTIME|@VELOCITY_MAX|@IsCompany|@IsSubfleet|@IsGroup",
+            VALUE_STRING
+        )
+        if reporte_data is None: # Respuesta no JSON: es un error, no un lote sin datos
+            return None
+        return reporte_data.get("DATA1", [])
 
     except requests.exceptions.RequestException as e:
-        return []
+        # None (en lugar de []) permite distinguir un error de un día sin datos y no guardarlo en caché
+        return None
 
 # *** SE ELIMINÓ la función adjust_time_for_display() ya que el ajuste de -1h se aplica
 #     directamente al objeto Full_Time ***
 
-@st.cache_data(show_spinner="Cargando, consolidando y filtrando reportes...")
-def get_report_data(min_speed, vehicle_ids, subfleet_id, fecha_inicio_iso, fecha_fin_iso): 
+def preparar_chunk_excesos(resultados_chunk: list, min_speed, fecha_dia: str) -> pd.DataFrame:
     """
-    Ejecuta todos los reportes, consolida los datos, aplica el filtro de velocidad
-    y realiza el agrupamiento de excesos 'Sostenidos'.
-    
-    RETORNA:
-    - df_final: DataFrame consolidado de eventos (Tabla)
-    - df: DataFrame detallado (Base para el gráfico)
+    Limpia y filtra las filas crudas de un lote de la API (solo registros > min_speed).
+    Retorna el detalle del lote (con la columna 'Fecha' del día consultado) ordenado por UNIDAD y Full_Time,
+    vacío si ningún registro supera min_speed, o None si la respuesta no trae velocidad.
     """
-    
-    id_chunks = chunk_ids(vehicle_ids, CHUNK_SIZE) 
-    resultados_finales = []
-    
-    for chunk in id_chunks:
-        resultados_chunk = ejecutar_reporte(chunk, subfleet_id, fecha_inicio_iso, fecha_fin_iso) 
-        resultados_finales.extend(resultados_chunk)
-
-    # ----------------------------------------------------------------------
-    # Preparación de DataFrame Detallado Vacío para retorno dual
-    empty_consolidated_df = pd.DataFrame(columns=CONSOLIDATED_COLUMN_NAMES + [NARRATIVE_MIN_SPEED_COL])
-    empty_detailed_df = pd.DataFrame(columns=['UNIDAD', 'HORA_VZLA', 'VELOCIDAD (km/h)']) 
-    # ----------------------------------------------------------------------
-
-    if not resultados_finales:
-        return empty_consolidated_df, empty_detailed_df 
+    # Velocidad y coordenadas se decodifican ya como float64
+    df = filas_a_frame(resultados_chunk, (API_SPEED_COLUMN, 'Latitude', 'Longitude'))
 
-    df = pd.DataFrame(resultados_finales)
-    
     if API_SPEED_COLUMN not in df.columns:
-        st.warning(f"La respuesta de la API no contiene la columna '{API_SPEED_COLUMN}' (Velocidad). No se encontraron datos de movimiento o hubo un error de formato. Intente otra fecha o verifique la conexión.")
-        return empty_consolidated_df, empty_detailed_df
-    
+        return None
+
     # 1. Limpieza, preparación y filtrado
     df = df.rename(columns={
         API_TIME_COLUMN: 'Report_Time_Str',
@@ -466,131 +412,403 @@ def get_report_data(min_speed, vehicle_ids, subfleet_id, fecha_inicio_iso, fecha
         'Longitude': 'LONGITUD',
         'Location': 'UBICACIÓN'
     })
-    
-    df['VELOCIDAD (km/h)'] = pd.to_numeric(df['VELOCIDAD (km/h)'], errors='coerce')
+
+    # 2. FILTRADO INICIAL (SOLO EXCESOS) antes de parsear fechas y textos del resto de filas
+    df = df[df['VELOCIDAD (km/h)'] > min_speed] # <--- USA min_speed (N+1)
+    if df.empty:
+        # Lote sin excesos (lo normal): sin filas, to_datetime no tendría zona horaria para tz_convert
+        return df
     
     # *** INICIO DEL CAMBIO PARA CONGRUENCIA DE TIEMPO/UBICACIÓN ***
-    df['Full_Time'] = pd.to_datetime(
+    df = df.assign(Full_Time=pd.to_datetime(
         df['Report_Time_Str'], 
         format='ISO8601', 
         errors='coerce'
-    ).dt.tz_convert(VENEZUELA_TZ) - timedelta(hours=1) # <--- APLICACIÓN DEL AJUSTE DE -1 HORA
+    ).dt.tz_convert(VENEZUELA_TZ) - timedelta(hours=1)) # <--- APLICACIÓN DEL AJUSTE DE -1 HORA
     # *** FIN DEL CAMBIO ***
 
     df['UBICACIÓN'] = df['UBICACIÓN'].str.replace('\n', ' ').str.strip() 
 
-    # 2. FILTRADO INICIAL (SOLO EXCESOS)
-    df = df[df['VELOCIDAD (km/h)'] > min_speed].copy() # <--- USA min_speed (N+1)
-    
     # Columna de hora ajustada en Venezuela (string) para tooltips y narrativas
-    # *** CAMBIO: Se remueve el .apply(adjust_time_for_display) ya que Full_Time es correcto ***
     df['HORA_VZLA'] = df['Full_Time'].dt.strftime('%H:%M:%S')
+    df['Fecha'] = fecha_dia
 
-    if df.empty:
-        return empty_consolidated_df, empty_detailed_df 
+    return df.sort_values(by=['UNIDAD', 'Full_Time']).reset_index(drop=True)
 
-    df = df.sort_values(by=['UNIDAD', 'Full_Time']).reset_index(drop=True)
-    
-    # 3. LÓGICA DE ESTADO (Pico vs. Sostenido)
-    df['Time_Diff_Prev'] = df.groupby('UNIDAD')['Full_Time'].diff().dt.total_seconds()
-    df['Time_Diff_Next'] = df.groupby('UNIDAD')['Full_Time'].diff().dt.total_seconds().shift(-1)
+def consolidar_chunk_excesos(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Clasifica (Pico vs. Sostenido) y agrega los excesos de un lote ya preparado con el kernel NumPy
+    de deteccion_excesos. Los lotes son disjuntos por unidad, así que cada uno se consolida por separado.
+    """
+    # 3-4. LÓGICA DE ESTADO (Pico vs. Sostenido, 60 segundos) Y GRUPOS CONSECUTIVOS EN UNA PASADA
+    runs = detectar_runs_excesos(
+        pd.factorize(df['UNIDAD'])[0],
+        tiempos_a_ns(df['Full_Time']),
+        df['VELOCIDAD (km/h)'].to_numpy(dtype=np.float64),
+        THRESHOLD_SECONDS
+    )
+
+    # 5. CONSOLIDACIÓN DE DATOS: primero los Sostenidos y luego los Picos (mismo orden que antes del sort final)
+    orden = np.concatenate([np.flatnonzero(runs['sostenido']), np.flatnonzero(~runs['sostenido'])])
+    inicio = runs['inicio'][orden]
+    fin = runs['fin'][orden]
+    velocidad_min = runs['velocidad_min'][orden]
+
+    df_lote = pd.DataFrame({
+        'Fecha': df['Fecha'].to_numpy()[inicio],
+        'Und.': df['UNIDAD'].to_numpy()[inicio],
+        'Exceso': np.where(runs['sostenido'][orden], 'Sostenido', 'Pico'),
+        # HORA INICIO/HORA FIN (Hora VZLA) del primer y último registro del evento
+        'Inicio': df['HORA_VZLA'].to_numpy()[inicio],
+        'Fin': df['HORA_VZLA'].to_numpy()[fin],
+        'Tiempo (min)': (runs['duracion_segundos'][orden] / 60).round(1),
+        'N° Reg.': runs['registros'][orden],
+        'V. máx (km/h)': runs['velocidad_max'][orden],
+        'V. prom (km/h)': runs['velocidad_promedio'][orden].round(1),
+        'UBICACIÓN INICIO': df['UBICACIÓN'].to_numpy()[inicio],
+        # Columna de velocidad mínima para la narrativa (no se muestra en tabla)
+        NARRATIVE_MIN_SPEED_COL: velocidad_min.round(0).astype(int).astype(str),
+    })
+
+    return df_lote[CONSOLIDATED_COLUMN_NAMES + [NARRATIVE_MIN_SPEED_COL]]
+
+# ====================================================
+# VENTANAS DE VARIOS DÍAS (CONSULTA POR DÍA, EN PARALELO Y CON CACHÉ LOCAL)
+# ====================================================
+
+CACHE_REPORTES_DIR = "cache_reportes" # Días ya cerrados consultados previamente (no se versiona)
+MAX_DIAS_EN_PARALELO = 4
+TTL_REPORTE_SEGUNDOS = 60 # Memoria del resultado completo (el día en curso cambia)
+MAX_DIAS_REPORTE = 31
+
+def rango_api_dia(dia: date) -> Tuple[str, str]:
+    """Inicio y fin (UTC, formato de la API) de un día completo en hora de Venezuela."""
+    start_dt_local = VENEZUELA_TZ.localize(datetime.combine(dia, datetime.min.time()))
+    fecha_inicio = start_dt_local.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S') + '.217'
+
+    end_dt_local = VENEZUELA_TZ.localize(datetime.combine(dia, datetime.max.time().replace(microsecond=0)))
+    fecha_fin = end_dt_local.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S') + '.999'
+    return fecha_inicio, fecha_fin
+
+def dias_de_ventana(inicio: date, fin: date) -> Tuple[str, ...]:
+    """Días (ISO) entre inicio y fin, ambos incluidos."""
+    return tuple((inicio + timedelta(days=i)).isoformat() for i in range((fin - inicio).days + 1))
+
+def procesar_dia_excesos(min_speed, vehicle_ids: str, subfleet_id, fecha_dia: str) -> Dict[str, Any]:
+    """
+    Consulta y consolida un día completo, lote por lote (solo un lote crudo en memoria a la vez).
+    Función pura (sin llamadas a Streamlit) para poder ejecutarse en hilos.
+    """
+    fecha_inicio_iso, fecha_fin_iso = rango_api_dia(date.fromisoformat(fecha_dia))
+    consolidados = []
+    detallados = []
+    hubo_resultados = False
+    hubo_velocidad = False
+    completo = True
     
-    # LÓGICA CLAVE DE CLASIFICACIÓN (60 segundos)
-    is_sustained = (df['Time_Diff_Prev'].fillna(THRESHOLD_SECONDS + 1) <= THRESHOLD_SECONDS) | \
-                   (df['Time_Diff_Next'].fillna(THRESHOLD_SECONDS + 1) <= THRESHOLD_SECONDS)
+    for chunk in chunk_ids(vehicle_ids, CHUNK_SIZE):
+        resultados_chunk = ejecutar_reporte(chunk, subfleet_id, fecha_inicio_iso, fecha_fin_iso) 
+        if resultados_chunk is None:
+            completo = False
+            continue
+        if not resultados_chunk:
+            continue
+        hubo_resultados = True
 
-    df['TIPO DE EXCESO'] = 'Pico'
-    df.loc[is_sustained, 'TIPO DE EXCESO'] = 'Sostenido'
+        df_chunk = preparar_chunk_excesos(resultados_chunk, min_speed, fecha_dia)
+        del resultados_chunk # Liberar las filas crudas del lote antes de pedir el siguiente
+        if df_chunk is None:
+            continue
+        hubo_velocidad = True
+
+        if df_chunk.empty:
+            continue
+
+        consolidados.append(consolidar_chunk_excesos(df_chunk))
+        detallados.append(df_chunk)
+
+    return {
+        "consolidados": consolidados,
+        "detallados": detallados,
+        "hubo_resultados": hubo_resultados,
+        "hubo_velocidad": hubo_velocidad,
+        "completo": completo,
+    }
+
+def _ruta_cache_dia(min_speed, vehicle_ids: str, subfleet_id, fecha_dia: str) -> str:
+    huella_ids = hashlib.md5(vehicle_ids.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(CACHE_REPORTES_DIR, f"excesos_{subfleet_id}_{huella_ids}_{min_speed}_{fecha_dia}.pkl")
+
+def leer_cache_dia(ruta: str) -> Optional[Dict[str, Any]]:
+    """Resultado de un día ya consultado, o None si no está en la caché local."""
+    if not os.path.exists(ruta):
+        return None
+    try:
+        return pd.read_pickle(ruta)
+    except Exception as e:
+        print(f"[CACHE] No se pudo leer '{ruta}': {e}")
+        return None
+
+def guardar_cache_dia(ruta: str, resultado: Dict[str, Any]) -> None:
+    """Guarda el resultado de un día cerrado (escritura atómica para no dejar archivos a medias)."""
+    try:
+        os.makedirs(CACHE_REPORTES_DIR, exist_ok=True)
+        ruta_temporal = f"{ruta}.tmp"
+        pd.to_pickle(resultado, ruta_temporal)
+        os.replace(ruta_temporal, ruta)
+    except Exception as e:
+        print(f"[CACHE] No se pudo guardar '{ruta}': {e}")
+
+# TTL de 1 minuto: una ventana que incluye el día en curso se vuelve a consultar (los días cerrados
+# se releen de cache_reportes/, así que reconstruir el resultado es barato)
+@st.cache_data(ttl=TTL_REPORTE_SEGUNDOS, show_spinner="Cargando, consolidando y filtrando reportes...")
+def get_report_data(min_speed, vehicle_ids, subfleet_id, dias_reporte: Tuple[str, ...]): 
+    """
+    Ejecuta el reporte para cada día de la ventana y une los resultados.
+    Los días ya cerrados se leen de la caché local si ya se consultaron; el resto se consulta
+    en paralelo (MAX_DIAS_EN_PARALELO) y los días cerrados completos se guardan para la próxima vez.
     
-    # 4. CREAR ID DE GRUPO PARA EXCESOS SOSTENIDOS CONSECUTIVOS
-    df['new_group'] = (df['TIPO DE EXCESO'] == 'Sostenido') & (df['TIPO DE EXCESO'].shift(1) != 'Sostenido')
-    df['Excess_Group'] = df.groupby('UNIDAD')['new_group'].cumsum().mask(df['TIPO DE EXCESO'] == 'Pico', 0)
+    RETORNA:
+    - df_final: DataFrame consolidado de eventos (Tabla), con la columna 'Fecha'
+    - df: DataFrame detallado (Base para el gráfico)
+    """
     
-    # 5. CONSOLIDACIÓN DE DATOS
+    # ----------------------------------------------------------------------
+    # Preparación de DataFrame Detallado Vacío para retorno dual
+    empty_consolidated_df = pd.DataFrame(columns=CONSOLIDATED_COLUMN_NAMES + [NARRATIVE_MIN_SPEED_COL])
+    empty_detailed_df = pd.DataFrame(columns=['UNIDAD', 'HORA_VZLA', 'VELOCIDAD (km/h)', 'Fecha']) 
+    # ----------------------------------------------------------------------
+
+    hoy = datetime.now(VENEZUELA_TZ).date().isoformat()
+    resultados: Dict[str, Dict[str, Any]] = {}
+    pendientes: List[str] = []
+
+    for fecha_dia in dias_reporte:
+        # Solo los días cerrados son estables; el día en curso siempre se vuelve a consultar
+        resultado = leer_cache_dia(_ruta_cache_dia(min_speed, vehicle_ids, subfleet_id, fecha_dia)) if fecha_dia < hoy else None
+        if resultado is None:
+            pendientes.append(fecha_dia)
+        else:
+            resultados[fecha_dia] = resultado
+
+    if pendientes:
+        with ThreadPoolExecutor(max_workers=min(MAX_DIAS_EN_PARALELO, len(pendientes))) as executor:
+            consultas = executor.map(lambda fecha_dia: procesar_dia_excesos(min_speed, vehicle_ids, subfleet_id, fecha_dia), pendientes)
+            for fecha_dia, resultado in zip(pendientes, consultas):
+                resultados[fecha_dia] = resultado
+                if fecha_dia < hoy and resultado["completo"]:
+                    guardar_cache_dia(_ruta_cache_dia(min_speed, vehicle_ids, subfleet_id, fecha_dia), resultado)
+
+    if not any(r["hubo_resultados"] for r in resultados.values()):
+        return empty_consolidated_df, empty_detailed_df 
+
+    if not any(r["hubo_velocidad"] for r in resultados.values()):
+        st.warning(f"La respuesta de la API no contiene la columna '{API_SPEED_COLUMN}' (Velocidad). No se encontraron datos de movimiento o hubo un error de formato. Intente otra fecha o verifique la conexión.")
+        return empty_consolidated_df, empty_detailed_df
+
+    consolidados = [df for fecha_dia in dias_reporte for df in resultados[fecha_dia]["consolidados"]]
+    detallados = [df for fecha_dia in dias_reporte for df in resultados[fecha_dia]["detallados"]]
+
+    if not consolidados:
+        return empty_consolidated_df, empty_detailed_df 
+
+    df_final = pd.concat(consolidados, ignore_index=True)
+    df_final = df_final.sort_values(by=['Und.', 'Fecha', 'Inicio']).reset_index(drop=True)
+
+    # El detallado de cada lote ya viene ordenado; al unirlos se ordena por UNIDAD y hora
+    df = pd.concat(detallados, ignore_index=True).sort_values(by=['UNIDAD', 'Full_Time'], kind='stable').reset_index(drop=True)
     
-    # Agregación para Excesos Sostenidos (Group ID > 0)
-    df_sostenido = df[df['Excess_Group'] > 0].groupby(['UNIDAD', 'Excess_Group']).agg(
-        TIPO_DE_EXCESO=('TIPO DE EXCESO', 'first'), 
-        HORA_INICIO=('Full_Time', 'min'), 
-        HORA_FIN=('Full_Time', 'max'),     
-        REGISTROS=('UNIDAD', 'count'), 
-        VELOCIDAD_MAX=('VELOCIDAD (km/h)', 'max'),
-        VELOCIDAD_MIN=('VELOCIDAD (km/h)', 'min'), 
-        VELOCIDAD_PROMEDIO=('VELOCIDAD (km/h)', 'mean'),                      
-        UBICACION_INICIO=('UBICACIÓN', 'first')
-    ).reset_index()
+    # RETORNO DUAL: Consolidado (Tabla) y Detallado (Gráfico)
+    return df_final, df # df es el DataFrame detallado filtrado (>= min_speed)
+
+# ====================================================
+# GRÁFICO DE VELOCIDAD POR UNIDAD (REDUCIDO Y CACHEADO)
+# ====================================================
+
+# Máximo de puntos de la línea base; los marcadores de exceso se envían completos
+MAX_PUNTOS_LINEA_GRAFICO = 1500
+
+def reducir_serie_min_max(tiempos_ns: np.ndarray, valores: np.ndarray, max_puntos: int) -> np.ndarray:
+    """
+    Índices de una serie reducida por cubetas conservando el mínimo y el máximo de cada cubeta,
+    además del primer/último punto y los bordes de cada grupo (saltos > THRESHOLD_SECONDS).
+    Si la serie ya es pequeña se devuelven todos los índices.
+    """
+    n = len(valores)
+    if n <= max_puntos:
+        return np.arange(n)
+
+    cubetas = max(max_puntos // 2, 1)
+    cubeta = np.arange(n) * cubetas // n
+    # Orden por (cubeta, valor): el primero de cada cubeta es el mínimo y el último el máximo
+    orden = np.lexsort((valores, cubeta))
+    cubeta_ordenada = cubeta[orden]
+    es_primero = np.r_[True, cubeta_ordenada[1:] != cubeta_ordenada[:-1]]
+    es_ultimo = np.r_[cubeta_ordenada[1:] != cubeta_ordenada[:-1], True]
+
+    # Bordes de grupo: punto anterior y posterior a cada salto de tiempo
+    salto = np.flatnonzero(np.diff(tiempos_ns) > THRESHOLD_SECONDS * 1_000_000_000)
+    bordes = np.concatenate([[0, n - 1], salto, salto + 1])
+
+    return np.unique(np.concatenate([orden[es_primero], orden[es_ultimo], bordes]))
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def construir_grafico_velocidad(_df_chart: pd.DataFrame, huella_datos: Tuple[int, int], flota_key: str, unidad: str,
+                                fecha_inicio_api: str, fecha_fin_api: str, limite_velocidad: int, conductor_info: str,
+                                varios_dias: bool = False) -> go.Figure:
+    """
+    Construye el perfil de velocidad de una unidad. La línea base se reduce con reducir_serie_min_max;
+    los excesos van en un único trazo Scattergl con customdata/hovertemplate en lugar de un texto por punto.
+    La figura se cachea por (huella, flota, unidad, fechas, límite, conductor); _df_chart no se hashea y
+    huella_datos (filas, última marca de tiempo en ns) la invalida cuando el día en curso trae registros nuevos.
+    """
+    tiempos = _df_chart['Full_Time']
+    velocidades = _df_chart['VELOCIDAD (km/h)'].to_numpy(dtype=np.float64)
+
+    # --------------------------------------------------------------------------
+    # 1. Definición del Gráfico Base (Línea reducida)
+    # --------------------------------------------------------------------------
+    indices_linea = reducir_serie_min_max(tiempos_a_ns(tiempos), velocidades, MAX_PUNTOS_LINEA_GRAFICO)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(
+        x=tiempos.iloc[indices_linea],
+        y=velocidades[indices_linea],
+        mode='lines',
+        name='Velocidad',
+        line=dict(width=3.5, color='#A52A2A'), # Marrón/Rojo Oscuro para la línea base
+        hoverinfo='skip'
+    ))
     
-    # Aplicar nombres de columna originales a df_sostenido antes de calcular la duración
-    df_sostenido.rename(columns={
-        'TIPO_DE_EXCESO': 'TIPO DE EXCESO',
-        'REGISTROS': '# REGISTROS', 
-        'VELOCIDAD_MAX': 'VELOCIDAD MAX (km/h)', 
-        'VELOCIDAD_MIN': 'VELOCIDAD MIN (km/h)',
-        'VELOCIDAD_PROMEDIO': 'VELOCIDAD PROMEDIO (km/h)', 
-        'UBICACION_INICIO': 'UBICACIÓN INICIO'
-    }, inplace=True)
-
-    # Calcular Duración
-    df_sostenido['DURACIÓN (min)'] = (df_sostenido['HORA_FIN'] - df_sostenido['HORA_INICIO']).dt.total_seconds() / 60
+    # --------------------------------------------------------------------------
+    # 2. CAPA DE LÍMITE DE VELOCIDAD (Regla Punteada Roja)
+    # --------------------------------------------------------------------------
     
-    # Convertir a string y crear las columnas finales HORA INICIO/HORA FIN (Hora VZLA)
-    # *** CAMBIO: Se remueve el .apply(adjust_time_for_display) ***
-    df_sostenido['HORA FIN'] = df_sostenido['HORA_FIN'].dt.strftime('%H:%M:%S')
-    df_sostenido['HORA INICIO'] = df_sostenido['HORA_INICIO'].dt.strftime('%H:%M:%S')
-
-    # Limpiar columnas temporales de datetime
-    df_sostenido = df_sostenido.drop(columns=['HORA_INICIO', 'HORA_FIN'])
+    fig.add_hline(
+        y=limite_velocidad, 
+        line_dash="dot", 
+        line_color="red",
+        annotation_text=f"Límite: {limite_velocidad} km/h",
+        annotation_position="bottom right"
+    )
     
-    # Formateo de decimales
-    df_sostenido['DURACIÓN (min)'] = df_sostenido['DURACIÓN (min)'].round(1)
-    df_sostenido['VELOCIDAD PROMEDIO (km/h)'] = df_sostenido['VELOCIDAD PROMEDIO (km/h)'].round(1)
+    # --------------------------------------------------------------------------
+    # 3. CAPA DE PUNTOS DE INTERÉS (Excesos > Límite): todos los puntos, un solo trazo
+    # --------------------------------------------------------------------------
+    es_exceso = velocidades > limite_velocidad
     
-    # Aplicar el mapeo de nombres de columnas FINAL antes de concatenar
-    df_sostenido.rename(columns=RENAME_MAP, inplace=True)
+    if es_exceso.any():
+        fig.add_trace(go.Scattergl(
+            x=tiempos[es_exceso],
+            y=velocidades[es_exceso],
+            mode='markers',
+            name='Excesos',
+            marker=dict(
+                symbol='diamond', # Forma de rombo
+                size=10, 
+                color='red', 
+                line=dict(width=1, color='black')
+            ),
+            customdata=np.column_stack([
+                _df_chart['HORA_VZLA'].to_numpy()[es_exceso],
+                _df_chart['UBICACIÓN'].to_numpy()[es_exceso]
+            ]),
+            hovertemplate="Hora: %{customdata[0]}<br>Velocidad: %{y:.1f} km/h<br>Ubicación: %{customdata[1]}<extra></extra>"
+        ))
+
+    # --------------------------------------------------------------------------
+    # 4. CAPA DE PICO MÁXIMO ABSOLUTO (AMARILLO)
+    # --------------------------------------------------------------------------
+    max_speed_record = _df_chart.iloc[int(np.nanargmax(velocidades))]
     
-    # Añadir y formatear la columna de velocidad mínima para la narrativa (no se muestra en tabla)
-    df_sostenido[NARRATIVE_MIN_SPEED_COL] = df_sostenido.pop(NARRATIVE_MIN_SPEED_COL).round(0).astype(int).astype(str)
-
-    # Seleccionar las columnas finales para el DataFrame Sostenido
-    df_sostenido = df_sostenido[CONSOLIDATED_COLUMN_NAMES + [NARRATIVE_MIN_SPEED_COL]]
-
-    # Formateo para Excesos Pico
-    df_pico = df[df['TIPO DE EXCESO'] == 'Pico'].copy()
+    fig.add_trace(go.Scatter(
+        x=[max_speed_record['Full_Time']],
+        y=[max_speed_record['VELOCIDAD (km/h)']],
+        mode='markers',
+        name='Pico Máximo',
+        marker=dict(
+            symbol='diamond', # Forma de rombo
+            size=12, 
+            color='yellow', 
+            line=dict(width=2, color='black')
+        ),
+        hoverinfo='text',
+        text=[
+            f"Hora: {max_speed_record['HORA_VZLA']}<br>Pico Máximo: {max_speed_record['VELOCIDAD (km/h)']:.1f} km/h<br>Ubicación: {max_speed_record['UBICACIÓN']}"
+        ]
+    ))
     
-    # Crear las columnas con nombres originales
-    # *** CAMBIO: Se remueve el .apply(adjust_time_for_display) ***
-    df_pico['HORA INICIO'] = df_pico['Full_Time'].dt.strftime('%H:%M:%S')
-    df_pico['HORA FIN'] = df_pico['HORA INICIO']
-    df_pico['DURACIÓN (min)'] = 0.0
-    df_pico['# REGISTROS'] = 1
-    df_pico['VELOCIDAD MAX (km/h)'] = df_pico['VELOCIDAD (km/h)']
-    df_pico['VELOCIDAD PROMEDIO (km/h)'] = df_pico['VELOCIDAD (km/h)']
-    df_pico['UBICACIÓN INICIO'] = df_pico['UBICACIÓN']
-    df_pico['VELOCIDAD PROMEDIO (km/h)'] = df_pico['VELOCIDAD PROMEDIO (km/h)'].round(1)
+    # --------------------------------------------------------------------------
+    # 5. Configuración (TÍTULO IZQUIERDO y COLORES/TICKS)
+    # --------------------------------------------------------------------------
     
-    # Para Pico, la velocidad mínima es la velocidad máxima
-    df_pico['VELOCIDAD MIN (km/h)'] = df_pico['VELOCIDAD (km/h)'] 
+    # Ocultar la leyenda y cambiar el fondo a blanco
+    fig.update_layout(
+        showlegend=False,
+        # Fondo del área de trazado (el gráfico en sí)
+        plot_bgcolor='white', 
+        # Fondo del papel/lienzo (alrededor del gráfico)
+        paper_bgcolor='white',
+        
+        # TÍTULO DEL GRÁFICO (Comportamiento de la Unidad) - Posición Superior Izquierda
+        title=dict(
+            text=f"Comportamiento de la Unidad {unidad}",
+            x=0.01,  # Coloca el título a la izquierda
+            y=0.98,  # Coloca el título arriba
+            xanchor='left',
+            yanchor='top',
+            font=dict(size=20, color='black') # Color negro
+        ),
+        
+        # ANOTACIÓN PARA EL CONDUCTOR (Debajo del Título) - Posición Superior Izquierda
+        annotations=[
+            dict(
+                xref='paper', yref='paper',
+                x=0.01, y=0.93, # Posición justo debajo del título
+                xanchor='left', yanchor='top',
+                text=f"Conductor: {conductor_info}",
+                font=dict(size=14, color='black'), # Color negro
+                showarrow=False
+            )
+        ]
+    )
 
-    # Aplicar el mapeo de nombres de columnas FINAL antes de concatenar
-    df_pico.rename(columns=RENAME_MAP, inplace=True)
+    # Mejorar el formato del eje X
+    fig.update_xaxes(
+        title_text='Hora (VZLA)',
+        # 1. Formato: HH:MM (con día si la ventana abarca varios días)
+        tickformat="%d/%m %H:%M" if varios_dias else "%H:%M", 
+        # 2. Densidad de Ticks: 1 minuto (60000 milisegundos); automática para varios días
+        dtick=None if varios_dias else 60000, 
+        rangeslider_visible=False, # Slider para facilitar el zoom/pan
+        title_font=dict(size=18, color='black'), # Color negro
+        tickfont=dict(size=12, color='black'), # Color negro
+        # Configuración de las líneas de cuadrícula del Eje X 
+        gridcolor='#CCCCCC',    # Color Gris
+        gridwidth=1,            
+        griddash='dot'          # Estilo Punteado
+    )
     
-    # Añadir y formatear la columna de velocidad mínima para la narrativa (no se muestra en tabla)
-    df_pico[NARRATIVE_MIN_SPEED_COL] = df_pico.pop(NARRATIVE_MIN_SPEED_COL).round(0).astype(int).astype(str)
-
-    # 6. UNIFICAR Y RETORNAR
-    df_pico = df_pico[CONSOLIDATED_COLUMN_NAMES + [NARRATIVE_MIN_SPEED_COL]]
+    # Mejorar el formato del eje Y
+    fig.update_yaxes(
+        title_text='Velocidad (km/h)',
+        title_font=dict(size=18, color='black'), # Color negro
+        tickfont=dict(size=14, color='black'), # Color negro
+        tick0=68, # Comienza el eje en 0
+        dtick=2, # Marcas de 2 en 2 km/h (SOLICITADO)
+        # Configuración de las líneas de cuadrícula del Eje Y
+        gridcolor='#CCCCCC',    # Color Gris
+        gridwidth=1,            
+        griddash='dot'          # Estilo Punteado
+    )
 
-    df_final = pd.concat([df_sostenido, df_pico], ignore_index=True)
-    df_final = df_final.sort_values(by=['Und.', 'Inicio']).reset_index(drop=True)
-    
-    # RETORNO DUAL: Consolidado (Tabla) y Detallado (Gráfico)
-    return df_final, df # df es el DataFrame detallado filtrado (>= min_speed)
+    return fig
 
 # ====================================================
 # 4. FUNCIÓN PARA GENERAR TXT (NO MODIFICADA, YA IMPLEMENTADA)
 # ====================================================
 
-def generate_txt_narrative(data_df_full, fecha_str: str, flota_name: str): 
+def generate_txt_narrative(data_df_full, flota_name: str): 
     
     df_sostenido = data_df_full[data_df_full['Exceso'] == 'Sostenido'].copy()
     
@@ -599,10 +817,11 @@ def generate_txt_narrative(data_df_full, fecha_str: str, flota_name: str):
     
     narrative_lines = []
     
-    unidad_conductor_cache = {} 
+    conductores = conductores_del_reporte(data_df_full, flota_name)
     
     for index, row in df_sostenido.iterrows():
         unidad = row['Und.']
+        fecha_str = row['Fecha']
         h_inicio = row['Inicio'][:-3] 
         h_fin = row['Fin'][:-3]
         
@@ -610,11 +829,7 @@ def generate_txt_narrative(data_df_full, fecha_str: str, flota_name: str):
         max_speed = int(row['V. máx (km/h)'])
         promedio = row['V. prom (km/h)']
         
-        if unidad not in unidad_conductor_cache:
-            conductor_info = get_driver_info_for_unit(unidad, fecha_str, flota_name) 
-            unidad_conductor_cache[unidad] = conductor_info
-        else:
-            conductor_info = unidad_conductor_cache[unidad]
+        conductor_info = conductores.get((fecha_str, str(unidad)), "Conductor Desconocido")
             
         if 'FICHA:' in conductor_info or 'Desconocido' in conductor_info or 'ERROR' in conductor_info:
             conductor_text = ""
@@ -661,6 +876,7 @@ if 'selected_speed' not in st.session_state:
     st.session_state.search_speed_threshold = 71 
     st.session_state.fecha_inicio_api = ""
     st.session_state.fecha_fin_api = ""
+    st.session_state.report_days = ()
    
 # ------------------------------------------------------------------
 # SECCIÓN CLAVE: FORMULARIO EN EL SIDEBAR CON BOTÓN SIEMPRE HABILITADO
@@ -679,6 +895,7 @@ with st.sidebar:
         st.session_state.search_speed_threshold = 71
         st.session_state.fecha_inicio_api = ""
         st.session_state.fecha_fin_api = ""
+        st.session_state.report_days = ()
         
         # Si 'home.py' existe en el mismo directorio, esto cambiará de página.
         try:
@@ -712,7 +929,7 @@ with st.sidebar:
         )
         
         # Selector de Fecha
-        date_option_options = (PLACEHOLDER, "Ayer", "Hoy", "Día Específico")
+        date_option_options = (PLACEHOLDER, "Ayer", "Hoy", "Día Específico", "Rango de Fechas", "Semana (ISO)", "Mes")
         
         # Usar el valor persistente de la sesión
         date_option_input = st.selectbox(
@@ -736,6 +953,24 @@ with st.sidebar:
             selected_day = st.date_input("Seleccione el Día:", value=yesterday)
             start_date_calc = selected_day
             end_date_calc = selected_day
+        elif date_option_input == "Rango de Fechas":
+            selected_range = st.date_input(
+                "Seleccione el Rango:",
+                value=(yesterday - timedelta(days=6), yesterday),
+                max_value=current_date
+            )
+            # Mientras se elige el rango el widget puede devolver un solo día
+            start_date_calc = selected_range[0] if selected_range else yesterday
+            end_date_calc = selected_range[-1] if selected_range else yesterday
+        elif date_option_input == "Semana (ISO)":
+            selected_day = st.date_input("Seleccione un día de la semana:", value=yesterday, max_value=current_date)
+            start_date_calc = selected_day - timedelta(days=selected_day.isoweekday() - 1) # Lunes
+            end_date_calc = min(start_date_calc + timedelta(days=6), current_date)       # Domingo (o hoy)
+        elif date_option_input == "Mes":
+            selected_day = st.date_input("Seleccione un día del mes:", value=yesterday, max_value=current_date)
+            start_date_calc = selected_day.replace(day=1)
+            next_month = (start_date_calc + timedelta(days=32)).replace(day=1)
+            end_date_calc = min(next_month - timedelta(days=1), current_date)
         elif date_option_input == "Ayer":
             start_date_calc = yesterday
             end_date_calc = yesterday
@@ -766,6 +1001,9 @@ if submitted:
         st.error("Por favor, seleccione una **Flota válida** y la **Fecha** para generar el reporte.")
         # No se marca como enviado para evitar que el código de renderizado se ejecute
         st.session_state.report_submitted = False
+    elif (end_date_calc - start_date_calc).days + 1 > MAX_DIAS_REPORTE:
+        st.error(f"El rango seleccionado supera el máximo de **{MAX_DIAS_REPORTE} días**.")
+        st.session_state.report_submitted = False
     else:
         # 2. Si la validación pasa, se activa la visualización
         st.session_state.report_submitted = True 
@@ -776,26 +1014,23 @@ if submitted:
         st.session_state.selected_speed = int(speed_limit) 
         st.session_state.search_speed_threshold = int(speed_limit) + 1 # Velocidad para el filtro (N+1) 
 
-        # LÓGICA DE ZONA HORARIA Y CONVERSIÓN A UTC PARA LA API
-        start_dt_local = VENEZUELA_TZ.localize(datetime.combine(start_date_calc, datetime.min.time()))
-        start_dt_utc = start_dt_local.astimezone(pytz.utc)
-        st.session_state.fecha_inicio_api = start_dt_utc.strftime('%Y-%m-%d %H:%M:%S') + '.217'
-
-        end_dt_local = VENEZUELA_TZ.localize(datetime.combine(end_date_calc, datetime.max.time().replace(microsecond=0)))
-        end_dt_utc = end_dt_local.astimezone(pytz.utc)
-        st.session_state.fecha_fin_api = end_dt_utc.strftime('%Y-%m-%d %H:%M:%S') + '.999'
+        # LÓGICA DE ZONA HORARIA Y CONVERSIÓN A UTC PARA LA API (la ventana completa; se consulta día por día)
+        st.session_state.fecha_inicio_api = rango_api_dia(start_date_calc)[0]
+        st.session_state.fecha_fin_api = rango_api_dia(end_date_calc)[1]
+        st.session_state.report_days = dias_de_ventana(start_date_calc, end_date_calc)
     
 
 # --- Sección de Output (Condicional) ---
 
 if st.session_state.report_submitted and st.session_state.selected_flota_key != FLOTA_PLACEHOLDER and st.session_state.selected_date_option != PLACEHOLDER:
     
-    # --- Recalcular la fecha de visualización de forma robusta ---
-    try:
-        api_start_dt = datetime.strptime(st.session_state.fecha_inicio_api[:-4], '%Y-%m-%d %H:%M:%S')
-        start_date_used = pytz.utc.localize(api_start_dt).astimezone(VENEZUELA_TZ).date()
-    except:
-        start_date_used = "Error de Fecha"
+    # --- Días de la ventana del reporte ---
+    report_days = st.session_state.report_days
+    if not report_days:
+        st.session_state.report_submitted = False
+        st.stop()
+    varios_dias = len(report_days) > 1
+    etiqueta_ventana = f"{report_days[0]}_a_{report_days[-1]}" if varios_dias else report_days[0]
         
     # ----------------------------------------------------
     # OBTENER PARÁMETROS DINÁMICOS DE LA FLOTA SELECCIONADA
@@ -818,7 +1053,10 @@ if st.session_state.report_submitted and st.session_state.selected_flota_key !=
     # Título Muestra el límite del usuario (N)
     st.subheader(f"Resultados Consolidados de Excesos > {st.session_state.selected_speed} km/h")  
     
-    caption_text = f"Día (Hora de Venezuela): **{start_date_used.isoformat()}**"
+    if varios_dias:
+        caption_text = f"Del **{report_days[0]}** al **{report_days[-1]}** ({len(report_days)} días, Hora de Venezuela)"
+    else:
+        caption_text = f"Día (Hora de Venezuela): **{report_days[0]}**"
         
     st.caption(caption_text)
     
@@ -827,8 +1065,7 @@ if st.session_state.report_submitted and st.session_state.selected_flota_key !=
         st.session_state.search_speed_threshold, 
         dynamic_vehicle_ids, 
         dynamic_subfleet_id, 
-        st.session_state.fecha_inicio_api,
-        st.session_state.fecha_fin_api
+        report_days
     )
 
     if not data_df.empty:
@@ -862,7 +1099,6 @@ if st.session_state.report_submitted and st.session_state.selected_flota_key !=
         # LÓGICA DE GENERACIÓN Y DESCARGA TXT (SOLICITADA)
         txt_content = generate_txt_narrative(
             data_df, 
-            start_date_used.isoformat(), 
             flota_key
         ) 
         
@@ -897,166 +1133,28 @@ if st.session_state.report_submitted and st.session_state.selected_flota_key !=
                 df_unidad_detallado = detailed_df[detailed_df['UNIDAD'] == unidad_seleccionada].copy()
                 
                 # Añadir información del conductor (opcional, para el título del gráfico)
-                conductor_info = get_driver_info_for_unit(unidad_seleccionada, start_date_used.isoformat(), flota_key)
+                conductores_unidad = conductores_del_reporte(data_df[data_df['Und.'] == unidad_seleccionada], flota_key)
+                conductor_info = " / ".join(dict.fromkeys(conductores_unidad.values())) or "Conductor Desconocido"
                 
                 # Generar el gráfico de línea (CÓDIGO PLOTLY)
                 if not df_unidad_detallado.empty:
                     
                     # Prepara el DataFrame para Plotly (df_chart)
                     # Mantener 'Full_Time' como el eje X principal (datetime object) para Plotly
-                    df_chart = df_unidad_detallado[['Full_Time', 'HORA_VZLA', 'VELOCIDAD (km/h)', 'UBICACIÓN']].copy()
-                    
-                    limite_velocidad = st.session_state.selected_speed
-                    
-                    # --------------------------------------------------------------------------
-                    # 1. Definición del Gráfico Base (Línea con Plotly Express)
-                    # --------------------------------------------------------------------------
-                    
-                    # Se usa un título placeholder aquí, que se sobrescribe en fig.update_layout
-                    fig = px.line(
-                        df_chart, 
-                        x='Full_Time', 
-                        y='VELOCIDAD (km/h)',
-                        title="", # Título vacío, se usará anotación para posición izquierda
-                        color_discrete_sequence=['#A52A2A'], # Marrón/Rojo Oscuro para la línea base
-                        labels={
-                            'Full_Time': 'Hora (VZLA)',
-                            'VELOCIDAD (km/h)': 'Velocidad (km/h)'
-                        }
-                    )
+                    df_chart = df_unidad_detallado[['Full_Time', 'HORA_VZLA', 'VELOCIDAD (km/h)', 'UBICACIÓN']]
                     
-                    # Asegurarse de que la línea base sea gruesa y tenga marcadores con forma de rombo
-                    fig.update_traces(
-                        line=dict(width=3.5), 
-                        mode='lines+markers', 
-                        marker=dict(
-                            symbol='diamond', 
-                            size=8, 
-                            line=dict(width=0.5, color='black')
-                        )
-                    )
-                    
-                    # --------------------------------------------------------------------------
-                    # 2. CAPA DE LÍMITE DE VELOCIDAD (Regla Punteada Roja)
-                    # --------------------------------------------------------------------------
-                    
-                    fig.add_hline(
-                        y=limite_velocidad, 
-                        line_dash="dot", 
-                        line_color="red",
-                        annotation_text=f"Límite: {limite_velocidad} km/h",
-                        annotation_position="bottom right"
-                    )
-                    
-                    # --------------------------------------------------------------------------
-                    # 3. CAPA DE PUNTOS DE INTERÉS (Excesos > Límite)
-                    # --------------------------------------------------------------------------
-                    df_picos_interes = df_chart[df_chart['VELOCIDAD (km/h)'] > limite_velocidad].copy()
-                    
-                    if not df_picos_interes.empty:
-                        # Añadir los puntos de exceso como un scatter plot separado
-                        picos_scatter = go.Scatter(
-                            x=df_picos_interes['Full_Time'],
-                            y=df_picos_interes['VELOCIDAD (km/h)'],
-                            mode='markers',
-                            name='Excesos',
-                            marker=dict(
-                                symbol='diamond', # Forma de rombo
-                                size=10, 
-                                color='red', 
-                                line=dict(width=1, color='black')
-                            ),
-                            hoverinfo='text',
-                            text=[
-                                f"Hora: {r['HORA_VZLA']}<br>Velocidad: {r['VELOCIDAD (km/h)']:.1f} km/h<br>Ubicación: {r['UBICACIÓN']}"
-                                for _, r in df_picos_interes.iterrows()
-                            ]
-                        )
-                        fig.add_trace(picos_scatter)
-
-                    # --------------------------------------------------------------------------
-                    # 4. CAPA DE PICO MÁXIMO ABSOLUTO (AMARILLO)
-                    # --------------------------------------------------------------------------
-                    max_speed_record = df_chart.loc[df_chart['VELOCIDAD (km/h)'].idxmax()]
-                    
-                    max_point_scatter = go.Scatter(
-                        x=[max_speed_record['Full_Time']],
-                        y=[max_speed_record['VELOCIDAD (km/h)']],
-                        mode='markers',
-                        name='Pico Máximo',
-                        marker=dict(
-                            symbol='diamond', # Forma de rombo
-                            size=12, 
-                            color='yellow', 
-                            line=dict(width=2, color='black')
-                        ),
-                        hoverinfo='text',
-                        text=[
-                            f"Hora: {max_speed_record['HORA_VZLA']}<br>Pico Máximo: {max_speed_record['VELOCIDAD (km/h)']:.1f} km/h<br>Ubicación: {max_speed_record['UBICACIÓN']}"
-                        ]
-                    )
-                    fig.add_trace(max_point_scatter)
-                    
-                    # --------------------------------------------------------------------------
-                    # 5. Configuración y Renderizado (MODIFICADO para TÍTULO IZQUIERDO y COLORES/TICKS)
-                    # --------------------------------------------------------------------------
-                    
-                    # Ocultar la leyenda y cambiar el fondo a blanco
-                    fig.update_layout(
-                        showlegend=False,
-                        # Fondo del área de trazado (el gráfico en sí)
-                        plot_bgcolor='white', 
-                        # Fondo del papel/lienzo (alrededor del gráfico)
-                        paper_bgcolor='white',
-                        
-                        # TÍTULO DEL GRÁFICO (Comportamiento de la Unidad) - Posición Superior Izquierda
-                        title=dict(
-                            text=f"Comportamiento de la Unidad {unidad_seleccionada}",
-                            x=0.01,  # Coloca el título a la izquierda
-                            y=0.98,  # Coloca el título arriba
-                            xanchor='left',
-                            yanchor='top',
-                            font=dict(size=20, color='black') # Color negro
-                        ),
-                        
-                        # ANOTACIÓN PARA EL CONDUCTOR (Debajo del Título) - Posición Superior Izquierda
-                        annotations=[
-                            dict(
-                                xref='paper', yref='paper',
-                                x=0.01, y=0.93, # Posición justo debajo del título
-                                xanchor='left', yanchor='top',
-                                text=f"Conductor: {conductor_info}",
-                                font=dict(size=14, color='black'), # Color negro
-                                showarrow=False
-                            )
-                        ]
-                    )
-
-                    # Mejorar el formato del eje X
-                    fig.update_xaxes(
-                        # 1. Formato: HH:MM
-                        tickformat="%H:%M", 
-                        # 2. Densidad de Ticks: 5 minutos (300000 milisegundos)
-                        dtick=60000, 
-                        rangeslider_visible=False, # Slider para facilitar el zoom/pan
-                        title_font=dict(size=18, color='black'), # Color negro
-                        tickfont=dict(size=12, color='black'), # Color negro
-                        # Configuración de las líneas de cuadrícula del Eje X 
-                        gridcolor='#CCCCCC',    # Color Gris
-                        gridwidth=1,            
-                        griddash='dot'          # Estilo Punteado
-                    )
-                    
-                    # Mejorar el formato del eje Y
-                    fig.update_yaxes(
-                        title_font=dict(size=18, color='black'), # Color negro
-                        tickfont=dict(size=14, color='black'), # Color negro
-                        tick0=68, # Comienza el eje en 0
-                        dtick=2, # Marcas de 2 en 2 km/h (SOLICITADO)
-                        # Configuración de las líneas de cuadrícula del Eje Y
-                        gridcolor='#CCCCCC',    # Color Gris
-                        gridwidth=1,            
-                        griddash='dot'          # Estilo Punteado
+                    # Figura cacheada por huella de los datos, flota, unidad, fechas y límite (el DataFrame no se hashea)
+                    huella_datos = (len(df_chart), int(tiempos_a_ns(df_chart['Full_Time']).max()))
+                    fig = construir_grafico_velocidad(
+                        df_chart,
+                        huella_datos,
+                        flota_key,
+                        unidad_seleccionada,
+                        st.session_state.fecha_inicio_api,
+                        st.session_state.fecha_fin_api,
+                        st.session_state.selected_speed,
+                        conductor_info,
+                        varios_dias
                     )
                     
                     # Renderizar el gráfico de Plotly en Streamlit
@@ -1077,10 +1175,11 @@ if st.session_state.report_submitted and st.session_state.selected_flota_key !=
             
             narratives_markdown = []
             
-            unidad_conductor_cache = {}
+            conductores = conductores_del_reporte(data_df, flota_key)
             
             for index, row in df_sostenido_narrative.iterrows():
                 unidad = row['Und.']
+                fecha_evento = row['Fecha']
                 h_inicio = row['Inicio'][:-3] 
                 h_fin = row['Fin'][:-3]
                 
@@ -1088,11 +1187,7 @@ if st.session_state.report_submitted and st.session_state.selected_flota_key !=
                 max_speed = int(row['V. máx (km/h)'])
                 promedio = row['V. prom (km/h)']
                 
-                if unidad not in unidad_conductor_cache:
-                    conductor_info = get_driver_info_for_unit(unidad, start_date_used.isoformat(), flota_key)
-                    unidad_conductor_cache[unidad] = conductor_info
-                else:
-                    conductor_info = unidad_conductor_cache[unidad]
+                conductor_info = conductores.get((fecha_evento, str(unidad)), "Conductor Desconocido")
                 
                 if 'FICHA:' in conductor_info or 'Desconocido' in conductor_info or 'ERROR' in conductor_info:
                     conductor_text = ""
@@ -1100,7 +1195,7 @@ if st.session_state.report_submitted and st.session_state.selected_flota_key !=
                     conductor_text = f" **Conductor: {conductor_info}**" 
                 
                 narrative = (
-                    f"{start_date_used.isoformat()}, "
+                    f"{fecha_evento}, "
                     f" La Unidad {unidad},{conductor_text}, registró un exceso de velocidad sostenido "
                     f" entre {h_inicio} y {h_fin} Hrs, con velocidad de {min_speed} a {max_speed} km/h, "
                     f" y con una velocidad promedio de {promedio:.1f} km/h"
@@ -1115,7 +1210,7 @@ if st.session_state.report_submitted and st.session_state.selected_flota_key !=
                 st.download_button(
                     label="Descargar Resumen TXT",
                     data=txt_content.encode('utf-8'),
-                    file_name=f'excesos_sostenidos_{flota_key}_{start_date_used.isoformat()}.txt',
+                    file_name=f'excesos_sostenidos_{flota_key}_{etiqueta_ventana}.txt',
                     mime='text/plain',
                     key="download_txt_button" 
                 )
@@ -6,7 +6,10 @@ from datetime import datetime, timedelta, timezone
 import pytz 
 import os 
 from typing import Dict, Any, List
-from math import radians, cos, sin, asin, sqrt
+import numpy as np
+from proximidad import construir_indice_zonas, dentro_de_alguna_zona
+from decodificador_json import cargar_json
+from foresight_api import COMPANY_ID, USER_ID_REPORTES, autorizacion_reportes, ejecutar_reporte_api, filas_a_frame
 import sqlite3 # <- AGREGADO: Importa la biblioteca SQLite
 
 hide_st_page_style = """
@@ -36,17 +39,9 @@ VENEZUELA_TZ = timezone(timedelta(hours=-4))
 VENEZUELA_PYTZ = pytz.timezone('America/Caracas')
 
 # --- API ---
-REPORT_ENDPOINT = "https://flexapi.foresightgps.com/ForesightFlexAPI.ashx" 
-# Cadena de autenticación Base64 
-BASIC_AUTH_HEADER = "Basic dGVycGVsOmZzZ3BzVGVycGVs" 
-HEADERS = {
-    "Content-Type": "application/json",
-    "Authorization": BASIC_AUTH_HEADER 
-}
-
-# Parámetros fijos de conexión 
-USER_ID = "82825"
-COMPANY_ID = "5809"
+# Endpoint, autenticación y parámetros fijos de conexión (USER_ID / COMPANY_ID) viven en foresight_api.py
+# 🔑 La clave se lee de st.secrets; sin ella la página se detiene con el error de configuración
+autorizacion_reportes()
 
 # 🚨 PARÁMETROS DE FILTRADO 🚨
 REPORT_ID_PARADAS = 5      
@@ -71,15 +66,22 @@ DISPLAY_COLUMN_NAMES = [
 # 2. FUNCIONES DE DISTANCIA, CARGA DE FLOTAS Y UTILIDAD
 # ====================================================
 
-def haversine(lon1, lat1, lon2, lat2):
-    """Calcula la distancia Haversine en metros entre dos puntos (lat/lon)."""
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1 
-    dlat = lat2 - lat1 
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a)) 
-    r = 6371000 # Radio de la Tierra en metros
-    return c * r
+def marcar_paradas_en_zonas(latitudes: pd.Series, longitudes: pd.Series, zones: List[Dict[str, Any]], radius_meters: float) -> pd.Series:
+    """
+    Máscara de paradas dentro del radio de exclusión de alguna zona conocida.
+    Las coordenadas de las zonas se convierten a arreglos una sola vez y todas las paradas se consultan en lote.
+    """
+    zonas = pd.DataFrame(zones, columns=['lat', 'lon']).apply(pd.to_numeric, errors='coerce').dropna()
+    indice = construir_indice_zonas(zonas[['lat', 'lon']].to_numpy(), radius_meters / 1000.0)
+
+    lat = pd.to_numeric(latitudes, errors='coerce').to_numpy(dtype=np.float64)
+    lon = pd.to_numeric(longitudes, errors='coerce').to_numpy(dtype=np.float64)
+    # Paradas sin coordenadas válidas nunca se excluyen por ubicación
+    validas = ~(np.isnan(lat) | np.isnan(lon))
+
+    excluidas = np.zeros(len(lat), dtype=bool)
+    excluidas[validas] = dentro_de_alguna_zona(indice, lat[validas], lon[validas])
+    return pd.Series(excluidas, index=latitudes.index)
 
 # --------------------------------------------------------------------------
 # --- LÓGICA DE CONEXIÓN A BASE DE DATOS (CORREGIDA) ---
@@ -96,36 +98,41 @@ def get_db_connection(db_file=DB_FILE_PATH):
         st.error(f"❌ Error al conectar con la DB '{db_file}': {e}")
         return None
 
-def get_driver_name_for_unit(conn: sqlite3.Connection, unit_id: str) -> str:
+# SQLite limita la cantidad de parámetros por consulta; los IN se arman por lotes
+SQLITE_MAX_PARAMS = 900
+
+def get_driver_names_for_units(conn: sqlite3.Connection, unit_ids: List[str]) -> Dict[str, str]:
     """
-    Busca el nombre del conductor para una unidad dada en la tabla 'asignacion',
-    usando el campo conductor_ficha y buscando por unidad.
-    
+    Busca en la tabla 'asignacion' el conductor (conductor_ficha) de todas las unidades del reporte
+    con una sola consulta IN (por lotes de SQLITE_MAX_PARAMS), en lugar de una consulta por parada.
+
     🚨 FIX CLAVE: Usa TRIM() en la columna 'unidad' de la DB para manejar
     los espacios en blanco que causan el ERROR_DB.
+    Si una unidad tiene varias asignaciones se conserva la primera (menor id), igual que fetchone().
     """
+    # 1. Limpiamos los IDs de entrada de espacios externos (sin repetir)
+    unit_ids_clean = sorted({str(uid).strip() for uid in unit_ids})
+
     if conn is None:
-        return "ERROR_DB_CONEXIÓN"
-    
-    # 1. Limpiamos el ID de la unidad de entrada de espacios externos
-    unit_id_clean = unit_id.strip()
+        return {uid: "ERROR_DB_CONEXIÓN" for uid in unit_ids_clean}
 
-    # 2. Usamos TRIM(unidad) en la consulta para asegurar que el dato en la DB esté limpio.
-    sql = "SELECT conductor_ficha FROM asignacion WHERE TRIM(unidad) = ?" 
+    drivers: Dict[str, str] = {}
     cur = conn.cursor()
     try:
-        # Ejecutamos la consulta con el ID de unidad limpio
-        cur.execute(sql, (unit_id_clean,))
-        row = cur.fetchone()
-        if row:
-            # Devuelve el nombre del conductor (también limpiado)
-            return str(row[0]).strip()
-        else:
-            return "NO ASIGNADO"
+        for i in range(0, len(unit_ids_clean), SQLITE_MAX_PARAMS):
+            lote = unit_ids_clean[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(lote))
+            # 2. Usamos TRIM(unidad) en la consulta para asegurar que el dato en la DB esté limpio.
+            sql = f"SELECT TRIM(unidad), conductor_ficha FROM asignacion WHERE TRIM(unidad) IN ({placeholders}) ORDER BY id"
+            for unidad, conductor_ficha in cur.execute(sql, lote):
+                # Devuelve el nombre del conductor (también limpiado); la primera asignación gana
+                drivers.setdefault(unidad, str(conductor_ficha).strip())
     except sqlite3.Error as e:
         # En caso de error de SQL (ej: tabla/columna incorrecta)
-        print(f"[ERROR DB] Al buscar conductor para unidad {unit_id}: {e}")
-        return "ERROR_DB"
+        print(f"[ERROR DB] Al buscar conductores para {len(unit_ids_clean)} unidades: {e}")
+        return {uid: "ERROR_DB" for uid in unit_ids_clean}
+
+    return {uid: drivers.get(uid, "NO ASIGNADO") for uid in unit_ids_clean}
 
 # --------------------------------------------------------------------------
 # --- FIN LÓGICA DE CONEXIÓN A BASE DE DATOS ---
@@ -147,7 +154,7 @@ def load_all_fleets_config() -> Dict[str, Dict[str, Any]]:
 
     try:
         with open(mapping_filepath, 'r', encoding='utf-8') as f:
-            flotas_map = json.load(f)
+            flotas_map = cargar_json(f)
     except Exception as e:
         print(f"Error al cargar '{MAPPING_FILE}'. Error: {e}")
         return {}
@@ -161,7 +168,7 @@ def load_all_fleets_config() -> Dict[str, Dict[str, Any]]:
         
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+                data = cargar_json(f)
                 
                 if "ids" in data and isinstance(data["ids"], str): 
                     
@@ -235,7 +242,20 @@ def format_duration_for_narrative(total_minutes: int) -> str:
             return f"{hours} {hour_label}"
     else:
         return f"{total_minutes} minutos"
-        
+
+def format_duration_series(total_minutes: pd.Series) -> pd.Series:
+    """Versión vectorizada de format_duration_for_narrative para una columna completa de minutos."""
+    total_minutes = total_minutes.astype(int)
+    hours = total_minutes // 60
+    minutes_remaining = total_minutes % 60
+
+    hours_text = hours.astype(str) + np.where(hours == 1, " hora", " horas")
+    return pd.Series(np.select(
+        [total_minutes < 60, minutes_remaining > 0],
+        [total_minutes.astype(str) + " minutos", hours_text + ", " + minutes_remaining.astype(str) + " minutos"],
+        default=hours_text
+    ), index=total_minutes.index)
+
 # FUNCIÓN UTILIZADA PARA GENERAR EL TXT/CSV DELIMITADO POR COMAS
 def convert_df_to_csv_text(df_source: pd.DataFrame) -> str:
     """
@@ -281,30 +301,23 @@ def enrich_data_with_driver_and_message(df_source: pd.DataFrame, conn: sqlite3.C
     """
     df = df_source.copy()
     
-    # 1. Obtener el Conductor para cada Unidad
-    # Aplicamos la función de consulta por cada unidad
-    df['Conductor'] = df['Unit'].apply(lambda uid: get_driver_name_for_unit(conn, uid))
+    # 1. Obtener el Conductor para cada Unidad (una consulta para todas las unidades del reporte)
+    drivers = get_driver_names_for_units(conn, df['Unit'].astype(str).unique().tolist())
+    df['Conductor'] = df['Unit'].astype(str).str.strip().map(drivers)
     
-    # 2. Construir el Mensaje de Parada Larga
-    def build_long_stop_message(row):
-        driver = row['Conductor']
-        unit = row['Unit']
-        start_time = row['Start']
-        duration = format_duration_for_narrative(row['T.Total'])
-        # Usar la Ubicacion original de la API
-        location = row['Ubicacion'].replace(';', ',') 
-        
-        # CONSTRUCCIÓN DEL MENSAJE SOLICITADO
-        return (
-            f"⚠️ PARADA LARGA DETECTADA\n"
-            f"Conductor: {driver}\n" 
-            f"Unidad: {unit}\n"
-            f"Inicio: {start_time} (Hora VET)\n"
-            f"Duración Total: {duration}\n"
-            f"Ubicación: {location}"
-        )
-
-    df['Mensaje Parada Larga'] = df.apply(build_long_stop_message, axis=1)
+    # 2. Construir el Mensaje de Parada Larga (operaciones de texto vectorizadas)
+    # Usar la Ubicacion original de la API
+    location = df['Ubicacion'].astype(str).str.replace(';', ',')
+
+    # CONSTRUCCIÓN DEL MENSAJE SOLICITADO
+    df['Mensaje Parada Larga'] = (
+        "⚠️ PARADA LARGA DETECTADA\n"
+        "Conductor: " + df['Conductor'] + "\n"
+        "Unidad: " + df['Unit'].astype(str) + "\n"
+        "Inicio: " + df['Start'].astype(str) + " (Hora VET)\n"
+        "Duración Total: " + format_duration_series(df['T.Total']) + "\n"
+        "Ubicación: " + location
+    )
     
     return df
 
@@ -322,29 +335,19 @@ def ejecutar_reporte_paradas(current_vehicle_ids_chunk, fecha_inicio_iso, fecha_
     
     # Parámetros para REPORT_ID 5
     VALUE_STRING = (
-        f"{USER_ID}|{current_vehicle_ids_chunk}|{fecha_inicio_iso}|{fecha_fin_iso}|"       
+        f"{USER_ID_REPORTES}|{current_vehicle_ids_chunk}|{fecha_inicio_iso}|{fecha_fin_iso}|"       
         f"{COMPANY_ID}|{subfleet_id}|0|{min_duration_minutes}"
     )
 
-    PAYLOAD = {
-        "method": "REPORT_EXECUTE",
-        "conncode": "SATEQSA",
-        "reportid": REPORT_ID_PARADAS, 
-        "userid": USER_ID,
-        "prefix": True,
-        "parameter": "@USERID|@LIST_VEHICLE_IDS|@STARTDATEANDTIME|@ENDDATEANDTIME|@IsCompany|@IsSubfleet|@IsGroup|@STOPMINDURATION", 
-        "value": VALUE_STRING
-    }
-
     try:
-        response = requests.post(REPORT_ENDPOINT, headers=HEADERS, json=PAYLOAD, timeout=30)
-        response.raise_for_status()
-        
-        if response.headers.get("Content-Type", "").startswith("application/json"):
-            reporte_data = response.json()
-            return reporte_data.get("ForesightFlexAPI", {}).get("DATA1", []), reporte_data
-        
-        return [], {"ERROR": "Respuesta no JSON"}
+        reporte_data = ejecutar_reporte_api(
+            REPORT_ID_PARADAS,
+            "@USERID|@LIST_VEHICLE_IDS|@STARTDATEANDTIME|@ENDDATEANDTIME|@IsCompany|@IsSubfleet|@IsGroup|@STOPMINDURATION",
+            VALUE_STRING
+        )
+        if reporte_data is None:
+            return [], {"ERROR": "Respuesta no JSON"}
+        return reporte_data.get("DATA1", []), {"ForesightFlexAPI": reporte_data}
 
     except requests.exceptions.RequestException as e:
         return [], {"ERROR": f"Fallo en la conexión para el chunk {current_vehicle_ids_chunk}: {e}"}
@@ -402,7 +405,8 @@ def get_report_data_paradas(vehicle_ids_full_string: str, fecha_inicio_iso: str,
     if not all_results:
         return pd.DataFrame(columns=empty_df_cols), last_debug_output 
 
-    df = pd.DataFrame(all_results)
+    # Coordenadas decodificadas ya como float64 para el filtro geográfico
+    df = filas_a_frame(all_results, ('Latitude', 'Longitude'))
     
     # Mapeo de columnas internas de la API (Report ID 5)
     df = df.rename(columns={
@@ -434,27 +438,8 @@ def get_report_data_paradas(vehicle_ids_full_string: str, fecha_inicio_iso: str,
     # 2. FILTRO GEOGRÁFICO (Principal, 120m)
     
     if exclusion_zones:
-        # Función para verificar la proximidad y devolver el estado de exclusión
-        def check_proximity_status(row, zones, radius):
-            """Chequea si la parada está dentro del radio de exclusión de cualquier zona conocida."""
-            lat, lon = pd.to_numeric(row['Latitude'], errors='coerce'), pd.to_numeric(row['Longitude'], errors='coerce')
-            if pd.isna(lat) or pd.isna(lon):
-                return False 
-
-            for zone in zones:
-                zone_lat = pd.to_numeric(zone.get('lat'), errors='coerce') 
-                zone_lon = pd.to_numeric(zone.get('lon'), errors='coerce')
-                
-                if not pd.isna(zone_lat) and not pd.isna(zone_lon):
-                    distance = haversine(lon, lat, zone_lon, zone_lat)
-                    if distance <= radius:
-                        return True # Excluido
-                        
-            return False # No excluido
-
-
-        # Aplicar la lógica de proximidad a cada fila
-        is_coord_excluded = df.apply(lambda row: check_proximity_status(row, exclusion_zones, EXCLUSION_RADIUS_METERS), axis=1)
+        # Una sola consulta al índice espacial para todas las paradas
+        is_coord_excluded = marcar_paradas_en_zonas(df['Latitude'], df['Longitude'], exclusion_zones, EXCLUSION_RADIUS_METERS)
         
     else:
         # Si no hay zonas de exclusión definidas
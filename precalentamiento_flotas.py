@@ -0,0 +1,182 @@
+"""
+Precalentamiento de todas las flotas desde la primera sesión del servidor.
+
+Streamlit solo ejecuta una página cuando un navegador la abre, así que home.py y pages/dashboard.py
+llaman a iniciar_precalentamiento() (la primera llamada del proceso lo arranca): un hilo de fondo mantiene una
+instantánea de baja frecuencia de cada flota configurada (servicio_flota), así la primera vista de
+cualquier flota en el dashboard se dibuja sin esperar a la API. Antes del primer sondeo carga también
+los perímetros (geometria_perimetros).
+
+Cada consulta de unidades (la del precalentamiento y la del dashboard) pasa por consultar_unidades,
+que además lleva el seguimiento de desde cuándo cada unidad está quieta y con velocidad cero; el
+dashboard usa ese seguimiento como punto de partida de las duraciones de parada de las unidades
+que ve por primera vez, en lugar de empezarlas en 0.
+"""
+import functools
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from decodificador_json import cargar_json
+from geometria_perimetros import leer_perimetros
+from foresight_api import buscar_unidades, solicitudes_busqueda_unidades
+from servicio_flota import obtener_snapshot, registrar_sondeo_fondo
+
+CONFIG_DIR = "configuracion_flotas"
+PERIMETROS_DIR = "perimetros"
+FLOTA_AGREGADA = "Toda Flota"
+
+# Frecuencia baja: una sesión que mira la flota la refresca más seguido con su intervalo adaptativo
+INTERVALO_PRECALENTAMIENTO_S = 60
+PAUSA_CICLO_PRECALENTAMIENTO_S = 5
+
+_seguimiento: Dict[str, Dict[str, Any]] = {}
+_lock_seguimiento = threading.Lock()
+_precalentamiento = {"iniciado": False}
+_lock_precalentamiento = threading.Lock()
+
+
+# ----------------------------------------------------------------------
+# Seguimiento de movimiento por unidad
+# ----------------------------------------------------------------------
+
+def _actualizar_seguimiento(lista_unidades: List[Dict[str, Any]], marca: float) -> None:
+    with _lock_seguimiento:
+        for unidad in lista_unidades:
+            # Mismo identificador que el dashboard: unitid o name como respaldo
+            unit_id = unidad.get("unitid", unidad.get("name", "N/A_ID_FALLBACK"))
+            try:
+                coordenada = (round(float(unidad.get("ylat", 0.0)), 6), round(float(unidad.get("xlong", 0.0)), 6))
+                detenida = float(unidad.get("speed_dunit", 0.0)) < 1.0
+            except (TypeError, ValueError):
+                continue
+
+            estado = _seguimiento.get(unit_id)
+            if estado is None:
+                _seguimiento[unit_id] = {
+                    "coordenada": coordenada,
+                    "coordenada_desde": marca,
+                    "velocidad_cero_desde": marca if detenida else None,
+                }
+                continue
+            if coordenada != estado["coordenada"]:
+                estado["coordenada"] = coordenada
+                estado["coordenada_desde"] = marca
+            if not detenida:
+                estado["velocidad_cero_desde"] = None
+            elif estado["velocidad_cero_desde"] is None:
+                estado["velocidad_cero_desde"] = marca
+
+
+def consultar_unidades(ids: str, autorizacion: str) -> List[Dict[str, Any]]:
+    """buscar_unidades + seguimiento de movimiento; es la consulta que se pasa a obtener_snapshot."""
+    lista_unidades = buscar_unidades(ids, autorizacion)
+    _actualizar_seguimiento(lista_unidades, time.time())
+    return lista_unidades
+
+
+def semilla_movimiento(unit_id) -> Optional[Dict[str, Any]]:
+    """
+    Lo observado en segundo plano de una unidad: última coordenada, epoch desde el que está en ella
+    y epoch desde el que tiene velocidad cero (None si se está moviendo). None si nunca se consultó.
+    """
+    with _lock_seguimiento:
+        estado = _seguimiento.get(unit_id)
+        return dict(estado) if estado is not None else None
+
+
+# ----------------------------------------------------------------------
+# Flotas y claves de instantánea
+# ----------------------------------------------------------------------
+
+def partes_flota_agregada(nombre_flota: str, ids_por_flota: Dict[str, str]) -> List[Tuple[str, str, str]]:
+    """
+    Reparte los IDs de la flota agregada entre las flotas reales que los contienen: [(flota, ids, clave), ...].
+    Los IDs que no pertenecen a ninguna flota quedan en un grupo propio (con la configuración de la flota agregada).
+    Si la parte es la flota real completa la clave de su instantánea es el nombre de la flota (se comparte con la
+    vista de esa flota); si no, es 'agregada/flota'.
+    """
+    ids_de = {
+        flota: [unit_id.strip() for unit_id in ids.split(',') if unit_id.strip()]
+        for flota, ids in ids_por_flota.items()
+    }
+    flota_por_id = {}
+    for otra_flota, ids_otra in ids_de.items():
+        if otra_flota == nombre_flota:
+            continue
+        for unit_id in ids_otra:
+            flota_por_id.setdefault(unit_id, otra_flota)
+
+    grupos: Dict[str, List[str]] = {}
+    for unit_id in ids_de[nombre_flota]:
+        grupos.setdefault(flota_por_id.get(unit_id, nombre_flota), []).append(unit_id)
+
+    partes = []
+    for flota_grupo, ids_grupo in grupos.items():
+        completa = flota_grupo != nombre_flota and set(ids_grupo) == set(ids_de[flota_grupo])
+        clave = flota_grupo if completa else f"{nombre_flota}/{flota_grupo}"
+        partes.append((flota_grupo, ','.join(ids_grupo), clave))
+    return partes
+
+
+def cargar_ids_flotas(config_dir: str = CONFIG_DIR) -> Dict[str, str]:
+    """IDs de cada flota configurada, con los mismos nombres y requisitos que el dashboard."""
+    ids_por_flota = {}
+    if not os.path.isdir(config_dir):
+        return ids_por_flota
+    for filename in sorted(os.listdir(config_dir)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(config_dir, filename), "rb") as f:
+                data = cargar_json(f)
+        except (OSError, ValueError) as e:
+            print(f" [PRECALENTAMIENTO] No se pudo leer {filename}: {e}")
+            continue
+        if isinstance(data, dict) and all(key in data for key in ["ids", "sede_coords"]):
+            ids_por_flota[os.path.splitext(filename)[0].replace("_", " ")] = data["ids"]
+    return ids_por_flota
+
+
+def claves_precalentamiento(ids_por_flota: Dict[str, str]) -> Dict[str, str]:
+    """Clave de instantánea -> IDs: cada flota real y las partes propias de la flota agregada."""
+    claves = {flota: ids for flota, ids in ids_por_flota.items() if flota != FLOTA_AGREGADA}
+    if FLOTA_AGREGADA in ids_por_flota:
+        for _, ids_grupo, clave in partes_flota_agregada(FLOTA_AGREGADA, ids_por_flota):
+            claves.setdefault(clave, ids_grupo)
+    return claves
+
+
+# ----------------------------------------------------------------------
+# Hilo de precalentamiento
+# ----------------------------------------------------------------------
+
+def _ciclo_precalentamiento(claves: Dict[str, str], autorizacion: str) -> None:
+    # Geometría de los perímetros (shapely + simplificación para el mapa) antes del primer sondeo
+    perimetros = leer_perimetros(PERIMETROS_DIR)
+    print(f"🔥 Precalentamiento: {len(perimetros)} perímetros cargados")
+
+    consultas = {clave: functools.partial(consultar_unidades, ids, autorizacion) for clave, ids in claves.items()}
+    while True:
+        for clave, consulta in consultas.items():
+            # No espera: solo lanza el refresco en segundo plano si la instantánea tiene más de 60 s
+            obtener_snapshot(clave, consulta, INTERVALO_PRECALENTAMIENTO_S, 0)
+        time.sleep(PAUSA_CICLO_PRECALENTAMIENTO_S)
+
+
+def iniciar_precalentamiento(autorizacion: str, config_dir: str = CONFIG_DIR) -> bool:
+    """Arranca (una sola vez por proceso) el sondeo de fondo de todas las flotas. Retorna True si lo arrancó."""
+    with _lock_precalentamiento:
+        if _precalentamiento["iniciado"]:
+            return False
+        _precalentamiento["iniciado"] = True
+
+    claves = claves_precalentamiento(cargar_ids_flotas(config_dir))
+    # Su carga cuenta en el presupuesto global de solicitudes del planificador adaptativo
+    for clave, ids in claves.items():
+        registrar_sondeo_fondo(clave, INTERVALO_PRECALENTAMIENTO_S, solicitudes_busqueda_unidades(ids))
+    threading.Thread(target=_ciclo_precalentamiento, args=(claves, autorizacion), daemon=True,
+                     name="precalentamiento-flotas").start()
+    print(f"🔥 Precalentamiento iniciado para {len(claves)} instantáneas de flota")
+    return True
@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import pytz
 import streamlit as st
+from servicio_flota import obtener_resumenes
 
 DB_FILE = "fospuca_monitoreo_gps.db"
 
@@ -123,6 +124,13 @@ UNIDADES_TOTALES_SEDE = {
     "San Diego": 23,
 }
 
+# Nombre de la flota en el monitoreo en vivo (configuracion_flotas) cuando difiere del de la sede
+FLOTA_EN_VIVO_POR_SEDE = {
+    "Girardot": "Giraldot",
+}
+# Los conteos en vivo solo se usan para pre-llenar si son recientes
+MAX_EDAD_RESUMEN_EN_VIVO_S = 15 * 60
+
 LISTA_ANALISTAS = [
     "ANGLY VILLALOBOS",
     "ANGEL PEÑA",
@@ -343,18 +351,24 @@ if menu == "📝 Registro de Datos":
         if detalles_otras:
           otras_novedades_previas[sede_n] = "\n".join(detalles_otras)
 
+    # Conteos del monitoreo en vivo (servicio_flota): pre-llenan las sedes aún no registradas en este turno
+    resumenes_en_vivo = obtener_resumenes()
+
     for sede in SEDES_DEFAULT:
       tot_predefinido = UNIDADES_TOTALES_SEDE.get(sede, 10)
       p_data = valores_previos.get(sede, {})
+      en_vivo = resumenes_en_vivo.get(FLOTA_EN_VIVO_POR_SEDE.get(sede, sede), {})
+      if en_vivo.get("edad_s", float("inf")) > MAX_EDAD_RESUMEN_EN_VIVO_S:
+        en_vivo = {}
 
       def_analista = p_data.get("analista", LISTA_ANALISTAS[0])
-      def_tot = p_data.get("tot", tot_predefinido)
-      def_disp = p_data.get("disp", tot_predefinido)
-      def_ruta = p_data.get("ruta", int(tot_predefinido * 0.7))
-      def_sede = p_data.get("sede", int(tot_predefinido * 0.3))
+      def_tot = p_data.get("tot", en_vivo.get("total", tot_predefinido))
+      def_disp = p_data.get("disp", en_vivo.get("total", tot_predefinido))
+      def_ruta = p_data.get("ruta", en_vivo.get("en_ruta", int(tot_predefinido * 0.7)))
+      def_sede = p_data.get("sede", en_vivo.get("en_sede", int(tot_predefinido * 0.3)))
       def_cam = p_data.get("cam", int(tot_predefinido * 0.5))
-      def_gps = p_data.get("gps", 0)
-      def_ruta_falla = p_data.get("ruta_falla", 0)
+      def_gps = p_data.get("gps", en_vivo.get("falla_gps", 0))
+      def_ruta_falla = p_data.get("ruta_falla", en_vivo.get("ruta_falla", 0))
       def_nov_gps_texto = novedades_gps_previas.get(sede, "")
       def_otras_nov_texto = otras_novedades_previas.get(sede, "")
 
@@ -365,6 +379,12 @@ if menu == "📝 Registro de Datos":
 
       with st.form(f"form_sede_{sede}"):
         st.markdown(f"#### Flota / Sede: **{sede}**")
+        if en_vivo and not p_data:
+          st.caption(
+              "📡 Valores pre-cargados del monitoreo en vivo (hace"
+              f" {int(en_vivo['edad_s'] // 60)} min). Las cámaras se ingresan"
+              " manualmente."
+          )
         c_analista, c_tot, c_disp = st.columns([2, 1, 1])
         with c_analista:
           analista_seleccionado = st.selectbox(
@@ -0,0 +1,122 @@
+"""
+Índice espacial de zonas (sede, vertedero, resguardo, zonas de exclusión) para verificar
+la proximidad de muchas unidades en una sola llamada.
+
+Las zonas se agrupan en celdas de una grilla lat/lon del tamaño del radio de búsqueda; cada
+punto solo se compara contra las zonas de su celda y de las 8 vecinas, con Haversine vectorizado.
+Lo usan el dashboard (clasificación de la flota) y los reportes (zonas de exclusión).
+"""
+from typing import Any, Dict, Iterable, Tuple
+
+import numpy as np
+
+RADIO_TIERRA_KM = 6371.0
+KM_POR_GRADO = np.pi * RADIO_TIERRA_KM / 180.0
+# Margen sobre el tamaño de celda: en longitud la distancia Haversine puede ser algo menor que el arco del paralelo
+MARGEN_CELDA = 1.5
+# Desplazamiento para combinar (fila, columna) de la celda en una sola clave int64 no negativa
+_DESPLAZAMIENTO_CELDA = np.int64(1 << 30)
+
+# Vecindario 3x3 de una celda
+_VECINOS = [(d_fila, d_columna) for d_fila in (-1, 0, 1) for d_columna in (-1, 0, 1)]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distancia Haversine en km; acepta escalares o arreglos (con broadcasting)."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _claves_celda(filas: np.ndarray, columnas: np.ndarray) -> np.ndarray:
+    return (filas + _DESPLAZAMIENTO_CELDA) * (_DESPLAZAMIENTO_CELDA * 2) + (columnas + _DESPLAZAMIENTO_CELDA)
+
+
+def construir_indice_zonas(coordenadas: Iterable[Tuple[float, float]], radio_km: float) -> Dict[str, Any]:
+    """
+    Construye el índice de un conjunto de zonas [[lat, lon], ...] que comparten el mismo radio.
+    El índice es un diccionario simple para poder guardarlo en cachés de Streamlit.
+    """
+    zonas = np.asarray(list(coordenadas), dtype=np.float64).reshape(-1, 2)
+    lat_zonas, lon_zonas = zonas[:, 0], zonas[:, 1]
+
+    # Celda en grados: al menos el radio en latitud, y corregido por cos(lat) en longitud
+    celda_lat = max(radio_km / KM_POR_GRADO, 1e-6) * MARGEN_CELDA
+    lat_max = float(np.max(np.abs(lat_zonas))) + celda_lat if len(zonas) else 0.0
+    celda_lon = celda_lat / max(np.cos(np.radians(min(lat_max, 89.0))), 1e-6)
+
+    claves = _claves_celda(
+        np.floor(lat_zonas / celda_lat).astype(np.int64),
+        np.floor(lon_zonas / celda_lon).astype(np.int64),
+    )
+    orden = np.argsort(claves, kind="stable")
+
+    return {
+        "lat": lat_zonas[orden],
+        "lon": lon_zonas[orden],
+        "posicion_original": orden,
+        "claves": claves[orden],
+        "celda_lat": celda_lat,
+        "celda_lon": celda_lon,
+        "radio_km": float(radio_km),
+    }
+
+
+def zona_mas_cercana(indice: Dict[str, Any], lats, lons) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Para cada punto, la zona más cercana dentro del radio del índice.
+    Retorna (posicion_zona, distancia_km): posición en la lista original de coordenadas
+    (-1 si ninguna está dentro del radio) y su distancia (inf si no hay).
+    """
+    lats = np.asarray(lats, dtype=np.float64).ravel()
+    lons = np.asarray(lons, dtype=np.float64).ravel()
+    n_puntos = len(lats)
+    posicion = np.full(n_puntos, -1, dtype=np.int64)
+    distancia = np.full(n_puntos, np.inf)
+
+    if n_puntos == 0 or len(indice["claves"]) == 0:
+        return posicion, distancia
+
+    filas = np.floor(lats / indice["celda_lat"]).astype(np.int64)
+    columnas = np.floor(lons / indice["celda_lon"]).astype(np.int64)
+    claves = indice["claves"]
+
+    # Pares candidatos (punto, zona) de las 9 celdas vecinas, expandidos sin bucles por punto
+    puntos_candidatos, zonas_candidatas = [], []
+    for d_fila, d_columna in _VECINOS:
+        claves_punto = _claves_celda(filas + d_fila, columnas + d_columna)
+        inicio = np.searchsorted(claves, claves_punto, side="left")
+        fin = np.searchsorted(claves, claves_punto, side="right")
+        cantidad = fin - inicio
+        if not cantidad.any():
+            continue
+        puntos = np.repeat(np.arange(n_puntos), cantidad)
+        # Desplazamiento de cada candidato dentro del rango [inicio, fin) de su punto
+        desplazamiento = np.arange(len(puntos)) - np.repeat(np.cumsum(cantidad) - cantidad, cantidad)
+        puntos_candidatos.append(puntos)
+        zonas_candidatas.append(np.repeat(inicio, cantidad) + desplazamiento)
+
+    if not puntos_candidatos:
+        return posicion, distancia
+
+    puntos = np.concatenate(puntos_candidatos)
+    zonas = np.concatenate(zonas_candidatas)
+    distancias = haversine_km(lats[puntos], lons[puntos], indice["lat"][zonas], indice["lon"][zonas])
+
+    dentro = distancias <= indice["radio_km"]
+    puntos, zonas, distancias = puntos[dentro], zonas[dentro], distancias[dentro]
+
+    # Quedarse con la zona más cercana de cada punto: ordenar por (punto, distancia) y tomar la primera
+    orden = np.lexsort((distancias, puntos))
+    puntos, zonas, distancias = puntos[orden], zonas[orden], distancias[orden]
+    primera = np.ones(len(puntos), dtype=bool)
+    primera[1:] = puntos[1:] != puntos[:-1]
+
+    posicion[puntos[primera]] = indice["posicion_original"][zonas[primera]]
+    distancia[puntos[primera]] = distancias[primera]
+    return posicion, distancia
+
+
+def dentro_de_alguna_zona(indice: Dict[str, Any], lats, lons) -> np.ndarray:
+    """Máscara booleana: el punto está a una distancia <= radio de al menos una zona del índice."""
+    return zona_mas_cercana(indice, lats, lons)[0] >= 0
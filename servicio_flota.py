@@ -0,0 +1,237 @@
+"""
+Instantáneas (snapshots) de la API en vivo servidas con stale-while-revalidate.
+
+Cada clave (una flota) guarda la última respuesta buena (no vacía). Mientras tenga menos de max_edad_s
+se sirve tal cual; cuando envejece se sirve igual (marcada como obsoleta, con su edad) y un hilo
+en segundo plano la refresca. Si el refresco falla, los reintentos se espacian con espera
+exponencial, así que una API lenta o caída nunca bloquea el ciclo del dashboard: solo la primera
+carga de una flota (sin snapshot todavía) espera, y como máximo espera_primera_carga_s.
+
+El estado es del proceso (compartido por todas las sesiones), igual que el cliente de foresight_api.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from decodificador_json import cargar_json
+
+# Espera exponencial entre reintentos fallidos: 2, 4, 8... hasta 60 s
+ESPERA_BASE_REINTENTO_S = 2
+ESPERA_MAXIMA_REINTENTO_S = 60
+
+_snapshots: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+
+def _nueva_entrada() -> Dict[str, Any]:
+    return {
+        "datos": None,          # Última respuesta buena
+        "marca": 0.0,           # Epoch (time.time()) de la última respuesta buena
+        "error": None,          # Último error del refresco (None si el último refresco fue exitoso)
+        "fallas": 0,            # Fallas seguidas (para la espera exponencial)
+        "proximo_intento": 0.0, # time.monotonic() a partir del cual se puede reintentar
+        "en_curso": None,       # threading.Event del refresco en curso (None si no hay)
+    }
+
+
+def _refrescar(clave: str, consulta: Callable[[], Any]) -> None:
+    """Cuerpo del hilo de refresco: ejecuta la consulta y actualiza la entrada."""
+    try:
+        datos = consulta()
+        # Una respuesta vacía (p. ej. un 200 con una página de mantenimiento en lugar de JSON) es una falla:
+        # no reemplaza a la última instantánea buena
+        error = None if datos else "Respuesta vacía de la API"
+    except Exception as e:
+        datos, error = None, f"{type(e).__name__}: {e}"
+
+    with _lock:
+        entrada = _snapshots[clave]
+        if error is None:
+            entrada.update(datos=datos, marca=time.time(), error=None, fallas=0, proximo_intento=0.0)
+        else:
+            entrada["fallas"] += 1
+            entrada["error"] = error
+            espera = min(ESPERA_MAXIMA_REINTENTO_S, ESPERA_BASE_REINTENTO_S * 2 ** (entrada["fallas"] - 1))
+            entrada["proximo_intento"] = time.monotonic() + espera
+            print(f"⚠️ Refresco de '{clave}' fallido ({entrada['fallas']} seguidos, reintento en {espera} s): {error}")
+        evento, entrada["en_curso"] = entrada["en_curso"], None
+    evento.set()
+
+
+def obtener_snapshot(clave: str, consulta: Callable[[], Any], max_edad_s: float,
+                     espera_primera_carga_s: float) -> Dict[str, Optional[Any]]:
+    """
+    Última instantánea de 'clave', lanzando un refresco en segundo plano si está vencida.
+
+    Retorna un diccionario con:
+    - datos: la última respuesta buena (None si nunca se obtuvo una).
+    - marca: epoch de esa respuesta.
+    - edad_s: segundos desde esa respuesta (None si no hay datos).
+    - error: último error del refresco, si el más reciente falló.
+    """
+    with _lock:
+        entrada = _snapshots.setdefault(clave, _nueva_entrada())
+        vencido = entrada["datos"] is None or time.time() - entrada["marca"] >= max_edad_s
+        if vencido and entrada["en_curso"] is None and time.monotonic() >= entrada["proximo_intento"]:
+            entrada["en_curso"] = threading.Event()
+            threading.Thread(target=_refrescar, args=(clave, consulta), daemon=True,
+                             name=f"refresco-{clave}").start()
+        evento = entrada["en_curso"]
+        sin_datos = entrada["datos"] is None
+
+    # Solo la primera carga espera (acotado); con datos previos se sirven de inmediato
+    if sin_datos and evento is not None:
+        evento.wait(espera_primera_carga_s)
+
+    with _lock:
+        datos, marca, error = entrada["datos"], entrada["marca"], entrada["error"]
+
+    edad_s = time.time() - marca if datos is not None else None
+    return {
+        "datos": datos,
+        "marca": marca,
+        "edad_s": edad_s,
+        "error": error,
+    }
+
+
+# ----------------------------------------------------------------------
+# Planificador adaptativo: intervalo de refresco de cada flota según su actividad,
+# dentro de un presupuesto global de solicitudes a la API compartido por todas las flotas
+# ----------------------------------------------------------------------
+
+INTERVALO_MINIMO_S = 3        # Mucho movimiento o alertas activas
+INTERVALO_BASE_S = 5          # Actividad normal (el antiguo TTL de 5 s)
+INTERVALO_SIN_MOVIMIENTO_S = 10
+INTERVALO_NOCTURNO_S = 15     # De noche sin unidades en movimiento
+INTERVALO_MAXIMO_S = 30       # Toda la flota en Resguardo (Sede) sin movimiento
+FRACCION_MOVIMIENTO_ALTA = 0.3
+HORA_INICIO_NOCHE = 20
+HORA_FIN_NOCHE = 5
+
+PRESUPUESTO_SOLICITUDES_MINUTO = 60
+# Una flota cuenta en el presupuesto mientras alguna sesión la haya consultado en este lapso
+VIGENCIA_FLOTA_ACTIVA_S = 120
+
+_intervalos: Dict[str, Dict[str, float]] = {}
+# Sondeos de fondo (precalentamiento_flotas): carga fija que se descuenta del presupuesto
+_sondeos_fondo: Dict[str, Dict[str, float]] = {}
+
+
+def intervalo_por_actividad(total_unidades: int, en_movimiento: int, en_sede: int,
+                            alertas_activas: int, hora_local: int) -> float:
+    """Intervalo de refresco deseado (s) para una flota según su actividad observada."""
+    if total_unidades == 0:
+        return INTERVALO_BASE_S
+    if alertas_activas:
+        return INTERVALO_MINIMO_S
+    if en_movimiento == 0:
+        if en_sede == total_unidades:
+            return INTERVALO_MAXIMO_S
+        es_noche = hora_local >= HORA_INICIO_NOCHE or hora_local < HORA_FIN_NOCHE
+        return INTERVALO_NOCTURNO_S if es_noche else INTERVALO_SIN_MOVIMIENTO_S
+
+    # Entre el intervalo base y el mínimo, según la fracción de la flota en movimiento
+    proporcion = min(1.0, en_movimiento / total_unidades / FRACCION_MOVIMIENTO_ALTA)
+    return INTERVALO_BASE_S - (INTERVALO_BASE_S - INTERVALO_MINIMO_S) * proporcion
+
+
+def registrar_intervalo(clave: str, intervalo_deseado_s: float, solicitudes_por_refresco: int = 1) -> None:
+    """
+    Guarda el intervalo deseado de una flota (la última sesión que la observó manda).
+    solicitudes_por_refresco cuenta las flotas consultadas en varias solicitudes (partes o páginas de IDs).
+    """
+    with _lock:
+        _intervalos[clave] = {
+            "deseado": float(intervalo_deseado_s),
+            "solicitudes": float(solicitudes_por_refresco),
+            "visto": time.monotonic(),
+        }
+
+
+def registrar_sondeo_fondo(clave: str, intervalo_s: float, solicitudes_por_refresco: int = 1) -> None:
+    """Registra una instantánea que un hilo de fondo refresca cada intervalo_s (cuenta en el presupuesto)."""
+    with _lock:
+        _sondeos_fondo[clave] = {"intervalo": float(intervalo_s), "solicitudes": float(solicitudes_por_refresco)}
+
+
+def intervalo_refresco(clave: str) -> float:
+    """
+    Intervalo efectivo de una flota: el deseado, alargado proporcionalmente en todas las flotas
+    activas si entre todas (más los sondeos de fondo) superan PRESUPUESTO_SOLICITUDES_MINUTO.
+    Un sondeo de fondo de una clave activa no suma: la sesión ya la refresca antes de que venza.
+    Las partes de la flota agregada activa sí suman (cuenta conservadora, se registra con otra clave).
+    """
+    ahora = time.monotonic()
+    with _lock:
+        activas = {
+            otra: (datos["deseado"], datos["solicitudes"]) for otra, datos in _intervalos.items()
+            if ahora - datos["visto"] <= VIGENCIA_FLOTA_ACTIVA_S
+        }
+        fondo = [
+            (datos["intervalo"], datos["solicitudes"]) for otra, datos in _sondeos_fondo.items()
+            if otra not in activas and otra != clave
+        ]
+    activas.setdefault(clave, (INTERVALO_BASE_S, 1.0))
+    solicitudes_minuto = sum(60.0 / intervalo * solicitudes for intervalo, solicitudes in [*activas.values(), *fondo])
+    factor = max(1.0, solicitudes_minuto / PRESUPUESTO_SOLICITUDES_MINUTO)
+    return activas[clave][0] * factor
+
+
+# ----------------------------------------------------------------------
+# Resúmenes por flota (conteos en ruta, en sede, falla GPS...) calculados una vez por instantánea
+# por quien clasifica la flota y leídos por las demás páginas (p. ej. el registro de turno de prop4)
+# ----------------------------------------------------------------------
+
+# Copia en disco para apps que corren en otro proceso (prop4.py se ejecuta como app aparte)
+ARCHIVO_RESUMENES = os.path.join("cache_flotas", "resumenes.json")
+INTERVALO_ESCRITURA_RESUMENES_S = 10
+
+_resumenes: Dict[str, Dict[str, Any]] = {}
+_ultima_escritura_resumenes = {"marca": 0.0}
+
+
+def _escribir_resumenes(resumenes: Dict[str, Dict[str, Any]]) -> None:
+    try:
+        os.makedirs(os.path.dirname(ARCHIVO_RESUMENES), exist_ok=True)
+        ruta_temporal = f"{ARCHIVO_RESUMENES}.tmp"
+        with open(ruta_temporal, "w", encoding="utf-8") as f:
+            json.dump(resumenes, f, ensure_ascii=False)
+        os.replace(ruta_temporal, ARCHIVO_RESUMENES)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar '{ARCHIVO_RESUMENES}': {e}")
+
+
+def publicar_resumen(clave: str, resumen: Dict[str, Any], marca: float) -> None:
+    """Publica el resumen de una flota calculado sobre la instantánea con epoch 'marca'."""
+    with _lock:
+        anterior = _resumenes.get(clave)
+        if anterior is not None and anterior["marca"] >= marca:
+            return  # Ya publicado para esta instantánea (u otra más reciente)
+        _resumenes[clave] = {**resumen, "marca": marca}
+        escribir = time.time() - _ultima_escritura_resumenes["marca"] >= INTERVALO_ESCRITURA_RESUMENES_S
+        if escribir:
+            _ultima_escritura_resumenes["marca"] = time.time()
+            copia = dict(_resumenes)
+    if escribir:
+        _escribir_resumenes(copia)
+
+
+def obtener_resumenes() -> Dict[str, Dict[str, Any]]:
+    """
+    Último resumen publicado de cada flota, con su edad en segundos ('edad_s').
+    Si este proceso no tiene ninguno se lee la copia en disco que deja el dashboard.
+    """
+    with _lock:
+        resumenes = dict(_resumenes)
+    if not resumenes and os.path.exists(ARCHIVO_RESUMENES):
+        try:
+            with open(ARCHIVO_RESUMENES, "rb") as f:
+                resumenes = cargar_json(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ No se pudo leer '{ARCHIVO_RESUMENES}': {e}")
+            resumenes = {}
+    ahora = time.time()
+    return {clave: {**resumen, "edad_s": ahora - resumen["marca"]} for clave, resumen in resumenes.items()}
@@ -0,0 +1,144 @@
+"""
+Paridad del kernel NumPy de deteccion_excesos con la implementación original de pages/reporte_excesos.py
+(cadena groupby/diff/shift/cumsum de get_report_data, pasos 3 a 5, copiada tal cual de la versión base).
+"""
+import numpy as np
+import pandas as pd
+
+from deteccion_excesos import detectar_runs_excesos, tiempos_a_ns
+
+THRESHOLD_SECONDS = 60
+
+
+def _original_pandas(df: pd.DataFrame):
+    """Pasos 3-5 originales: clasificación Pico/Sostenido, grupos consecutivos y agregación."""
+    df = df.copy()
+    df['Time_Diff_Prev'] = df.groupby('UNIDAD')['Full_Time'].diff().dt.total_seconds()
+    df['Time_Diff_Next'] = df.groupby('UNIDAD')['Full_Time'].diff().dt.total_seconds().shift(-1)
+
+    is_sustained = (df['Time_Diff_Prev'].fillna(THRESHOLD_SECONDS + 1) <= THRESHOLD_SECONDS) | \
+                   (df['Time_Diff_Next'].fillna(THRESHOLD_SECONDS + 1) <= THRESHOLD_SECONDS)
+
+    df['TIPO DE EXCESO'] = 'Pico'
+    df.loc[is_sustained, 'TIPO DE EXCESO'] = 'Sostenido'
+
+    df['new_group'] = (df['TIPO DE EXCESO'] == 'Sostenido') & (df['TIPO DE EXCESO'].shift(1) != 'Sostenido')
+    df['Excess_Group'] = df.groupby('UNIDAD')['new_group'].cumsum().mask(df['TIPO DE EXCESO'] == 'Pico', 0)
+
+    df_sostenido = df[df['Excess_Group'] > 0].groupby(['UNIDAD', 'Excess_Group']).agg(
+        HORA_INICIO=('Full_Time', 'min'),
+        HORA_FIN=('Full_Time', 'max'),
+        REGISTROS=('UNIDAD', 'count'),
+        VELOCIDAD_MAX=('VELOCIDAD (km/h)', 'max'),
+        VELOCIDAD_MIN=('VELOCIDAD (km/h)', 'min'),
+        VELOCIDAD_PROMEDIO=('VELOCIDAD (km/h)', 'mean'),
+    ).reset_index()
+    df_pico = df[df['TIPO DE EXCESO'] == 'Pico']
+    return df_sostenido, df_pico
+
+
+def _kernel(df: pd.DataFrame):
+    runs = detectar_runs_excesos(
+        pd.factorize(df['UNIDAD'])[0],
+        tiempos_a_ns(df['Full_Time']),
+        df['VELOCIDAD (km/h)'].to_numpy(dtype=np.float64),
+        THRESHOLD_SECONDS
+    )
+    s = runs['sostenido']
+    df_sostenido = pd.DataFrame({
+        'UNIDAD': df['UNIDAD'].to_numpy()[runs['inicio'][s]],
+        'HORA_INICIO': df['Full_Time'].to_numpy()[runs['inicio'][s]],
+        'HORA_FIN': df['Full_Time'].to_numpy()[runs['fin'][s]],
+        'REGISTROS': runs['registros'][s],
+        'VELOCIDAD_MAX': runs['velocidad_max'][s],
+        'VELOCIDAD_MIN': runs['velocidad_min'][s],
+        'VELOCIDAD_PROMEDIO': runs['velocidad_promedio'][s],
+        'DURACION_S': runs['duracion_segundos'][s],
+    })
+    df_pico = df.iloc[runs['inicio'][~s]]
+    # Un Pico es un evento de un solo registro
+    assert (runs['registros'][~s] == 1).all()
+    return df_sostenido, df_pico
+
+
+def _datos(filas: int, unidades: int, semilla: int, primer_registro_pico: bool) -> pd.DataFrame:
+    """
+    Registros ordenados por (unidad, tiempo) con velocidades enteras (sumas exactas en float64).
+    Con primer_registro_pico, el primer registro de cada unidad queda aislado (> umbral del siguiente).
+    """
+    rng = np.random.default_rng(semilla)
+    codigos = np.sort(rng.integers(0, unidades, filas))
+    pasos = rng.choice([15, 30, 45, 59, 60, 61, 90, 600], filas)
+    if primer_registro_pico:
+        primeros = np.flatnonzero(np.r_[True, codigos[1:] != codigos[:-1]])
+        siguientes = primeros + 1
+        pasos[siguientes[siguientes < filas]] = 600
+    tiempos = pd.Timestamp('2025-10-01', tz='America/Caracas') + pd.to_timedelta(np.cumsum(pasos), unit='s')
+    df = pd.DataFrame({
+        'UNIDAD': np.char.add('U', np.char.zfill(codigos.astype(str), 4)),
+        'Full_Time': tiempos,
+        'VELOCIDAD (km/h)': rng.integers(71, 130, filas).astype(np.float64),
+    })
+    return df.sort_values(by=['UNIDAD', 'Full_Time']).reset_index(drop=True)
+
+
+def _assert_sostenidos_iguales(kernel: pd.DataFrame, original: pd.DataFrame):
+    assert len(kernel) == len(original)
+    # Límites exactos del evento: unidad, primer y último registro
+    assert np.array_equal(kernel['UNIDAD'].to_numpy(), original['UNIDAD'].to_numpy())
+    assert np.array_equal(kernel['HORA_INICIO'].to_numpy(), original['HORA_INICIO'].to_numpy())
+    assert np.array_equal(kernel['HORA_FIN'].to_numpy(), original['HORA_FIN'].to_numpy())
+    assert np.array_equal(kernel['REGISTROS'].to_numpy(), original['REGISTROS'].to_numpy())
+    assert np.array_equal(kernel['VELOCIDAD_MAX'].to_numpy(), original['VELOCIDAD_MAX'].to_numpy())
+    assert np.array_equal(kernel['VELOCIDAD_MIN'].to_numpy(), original['VELOCIDAD_MIN'].to_numpy())
+    assert np.array_equal(kernel['VELOCIDAD_PROMEDIO'].to_numpy(), original['VELOCIDAD_PROMEDIO'].to_numpy())
+    duracion_original = (original['HORA_FIN'] - original['HORA_INICIO']).dt.total_seconds().to_numpy()
+    assert np.array_equal(kernel['DURACION_S'].to_numpy(), duracion_original)
+
+
+def test_paridad_exacta_con_la_implementacion_original():
+    for semilla in range(5):
+        df = _datos(20_000, unidades=150, semilla=semilla, primer_registro_pico=True)
+        sostenido_original, pico_original = _original_pandas(df)
+        sostenido_kernel, pico_kernel = _kernel(df)
+
+        assert len(sostenido_original) > 0 and len(pico_original) > 0
+        _assert_sostenidos_iguales(sostenido_kernel, sostenido_original)
+        assert pico_kernel.index.equals(pico_original.index)
+
+
+def test_corrige_evento_perdido_en_el_cambio_de_unidad():
+    # A termina en un Sostenido y B empieza con uno: el shift(1) original cruzaba la frontera de unidad,
+    # el primer evento de B quedaba en el grupo 0 y desaparecía de la tabla
+    inicio = pd.Timestamp('2025-10-01 08:00', tz='America/Caracas')
+    segundos = {'A': [0, 30, 60], 'B': [0, 30, 60, 90]}
+    df = pd.DataFrame([
+        {'UNIDAD': unidad, 'Full_Time': inicio + pd.Timedelta(seconds=s), 'VELOCIDAD (km/h)': 80.0 + i}
+        for unidad, lista in segundos.items() for i, s in enumerate(lista)
+    ])
+
+    sostenido_original, _ = _original_pandas(df)
+    sostenido_kernel, pico_kernel = _kernel(df)
+
+    assert sostenido_original['UNIDAD'].tolist() == ['A']
+    assert sostenido_kernel['UNIDAD'].tolist() == ['A', 'B']
+    assert pico_kernel.empty
+    # Los eventos que el original sí reportaba son idénticos
+    perdido = (sostenido_kernel['UNIDAD'] == 'B') & (sostenido_kernel['HORA_INICIO'] == inicio)
+    _assert_sostenidos_iguales(sostenido_kernel[~perdido].reset_index(drop=True), sostenido_original)
+    assert sostenido_kernel[perdido]['REGISTROS'].tolist() == [4]
+
+
+def test_registros_nat_nunca_son_sostenidos():
+    inicio = pd.Timestamp('2025-10-01 08:00', tz='America/Caracas')
+    df = pd.DataFrame({
+        'UNIDAD': ['A', 'A', 'A'],
+        'Full_Time': [inicio, inicio + pd.Timedelta(seconds=30), pd.NaT],
+        'VELOCIDAD (km/h)': [90.0, 95.0, 100.0],
+    })
+    sostenido_kernel, pico_kernel = _kernel(df)
+    sostenido_original, pico_original = _original_pandas(df)
+
+    _assert_sostenidos_iguales(sostenido_kernel, sostenido_original)
+    assert pico_kernel.index.equals(pico_original.index)
+    assert pico_kernel['VELOCIDAD (km/h)'].tolist() == [100.0]
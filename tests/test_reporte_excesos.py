@@ -0,0 +1,58 @@
+"""
+Preparación de los lotes crudos del reporte de excesos (pages/reporte_excesos.py).
+La página se importa en modo "bare" de Streamlit (sin servidor): solo define funciones y widgets por defecto.
+"""
+import importlib.util
+import os
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def reporte_excesos():
+    spec = importlib.util.spec_from_file_location("reporte_excesos", os.path.join(RAIZ, "pages", "reporte_excesos.py"))
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def _fila(reporte_excesos, unidad: str, hora: str, velocidad: str) -> dict:
+    return {
+        "Unit": unidad,
+        reporte_excesos.API_TIME_COLUMN: hora,
+        reporte_excesos.API_SPEED_COLUMN: velocidad,
+        "Latitude": "10.48",
+        "Longitude": "-66.90",
+        "Location": "Av. Principal\nCaracas",
+    }
+
+
+def test_lote_sin_excesos_retorna_frame_vacio(reporte_excesos):
+    filas = [_fila(reporte_excesos, "7001", "2025-10-01T12:00:00.000Z", "40")]
+
+    df = reporte_excesos.preparar_chunk_excesos(filas, 72, "2025-10-01")
+
+    assert df is not None
+    assert df.empty
+
+
+def test_lote_con_excesos_conserva_solo_los_registros_sobre_el_limite(reporte_excesos):
+    filas = [
+        _fila(reporte_excesos, "7001", "2025-10-01T12:00:30.000Z", "90"),
+        _fila(reporte_excesos, "7001", "2025-10-01T12:00:00.000Z", "80"),
+        _fila(reporte_excesos, "7002", "2025-10-01T12:00:00.000Z", "40"),
+    ]
+
+    df = reporte_excesos.preparar_chunk_excesos(filas, 72, "2025-10-01")
+
+    assert df["UNIDAD"].tolist() == ["7001", "7001"]
+    assert df["VELOCIDAD (km/h)"].tolist() == [80.0, 90.0]
+    # UTC -> Caracas (UTC-4) con el ajuste de -1 hora de la página
+    assert df["HORA_VZLA"].tolist() == ["07:00:00", "07:00:30"]
+    assert df["UBICACIÓN"].tolist() == ["Av. Principal Caracas"] * 2
+
+
+def test_respuesta_sin_velocidad_retorna_none(reporte_excesos):
+    assert reporte_excesos.preparar_chunk_excesos([{"Unit": "7001"}], 72, "2025-10-01") is None